@@ -1,58 +1,169 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from app.api.responses import FastJSONResponse
 from app.models.account import Account
 from app.schemas.account_schemas import *
-from app.api.services.account_service import AccountService
+from app.api.services.account_service import AccountService, PartiallyApplied
+from app.api.services.idempotency_service import IdempotencyService, IdempotencyConflict
+from utils.concurrency import call_service
 from datetime import datetime
-from utils.static_vars import MONGODB_PATH
-from app.database.mongodb import MongoClient
+from typing import Literal
 
-client = MongoClient(MONGODB_PATH)
-db = client.bank
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+IDEMPOTENCY_KEY = Header(None, alias="Idempotency-Key")
 
 router = APIRouter()
 
 
 class AccountAPI:
-    def __init__(self, account_service: AccountService):
+    def __init__(self, account_service: AccountService, idempotency_service: IdempotencyService=None):
         self.account_service = account_service
+        self.idempotency_service = idempotency_service
+
+
+    async def _idempotent(self, scope: str, key: Optional[str], request: Request, operation):
+        if key is None or self.idempotency_service is None:
+            return await operation()
+
+        # The body as sent, not the parsed schema: fields the server fills in
+        # (transaction_date) would make every retry look like a new request.
+        payload = await request.json()
+        try:
+            record = await call_service(self.idempotency_service.begin, scope, key, payload)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        except IdempotencyConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+        if record is not None:
+            return FastJSONResponse(record["response"], status_code=record["status"],
+                                    headers={"Idempotent-Replayed": "true"})
+
+        try:
+            result = await operation()
+        except HTTPException as e:
+            # Rejections are outcomes too: a replay must not get a second chance to succeed.
+            await call_service(self.idempotency_service.complete, scope, key, payload,
+                               e.status_code, {"detail": e.detail})
+            raise
+        except PartiallyApplied as e:
+            # The money already moved, so a retry must replay this instead of moving it again
+            await call_service(self.idempotency_service.complete, scope, key, payload, 500, {"detail": str(e)})
+            raise HTTPException(status_code=500, detail=str(e))
+        except Exception:
+            # Nothing was applied: the client may retry with the same key
+            await call_service(self.idempotency_service.release, scope, key)
+            raise
+
+        await call_service(self.idempotency_service.complete, scope, key, payload, 200, jsonable_encoder(result))
+        return result
+
+
+    async def create_account(self, account_data: AccountData):
+        await call_service(self.account_service.create_account, account_data)
+
+
+    async def delete_account(self, account_data: AccountData):
+        await call_service(self.account_service.delete_account, account_data)
 
+    
+    async def freeze_account(self, account_data: AccountData):
+        await call_service(self.account_service.freeze_account, account_data)
 
-    def create_account(self, account_data: AccountData):
-        self.account_service.create_account(account_data)
+    
+    async def unfreeze_account(self, account_data: AccountData):
+        await call_service(self.account_service.unfreeze_account, account_data)
 
 
-    def delete_account(self, account_data: AccountData):
-        self.account_service.delete_account(account_data)
+    async def check_balance(self, account_data: AccountData):
+        return {
+            "balance": await call_service(self.account_service.check_balance, account_data)
+        }
 
     
-    def freeze_account(self, account_data: AccountData):
-        self.account_service.freeze_account(account_data)
+    async def deposit(self, request: Request, account_data: AccountTransaction,
+                      idempotency_key: Optional[str]=IDEMPOTENCY_KEY):
+        return await self._idempotent("deposit", idempotency_key, request,
+                                      lambda: self._deposit(account_data))
 
-    
-    def unfreeze_account(self, account_data: AccountData):
-        self.account_service.unfreeze_account(account_data)
 
+    async def _deposit(self, account_data: AccountTransaction):
+        balance = await call_service(self.account_service.deposit, account_data)
+        if balance is None:
+            raise HTTPException(status_code=409, detail="The deposit was rejected")
 
-    def check_balance(self, account_data: AccountData):
-        print(self.account_service.check_balance(account_data))
         return {
-            "balance": self.account_service.check_balance(account_data)
+            "balance": balance
         }
 
-    
-    def deposit(self, account_data: AccountTransaction):
-        self.account_service.deposit(account_data)
 
+    async def withdraw(self, request: Request, account_data: AccountTransaction,
+                       idempotency_key: Optional[str]=IDEMPOTENCY_KEY):
+        return await self._idempotent("withdraw", idempotency_key, request,
+                                      lambda: self._withdraw(account_data))
+
+
+    async def _withdraw(self, account_data: AccountTransaction):
+        balance = await call_service(self.account_service.withdraw, account_data)
+        if balance is None:
+            raise HTTPException(status_code=409, detail="The withdraw was rejected")
+
+        return {
+            "balance": balance
+        }
+
+
+    async def transfer(self, request: Request, account_transaction: AccountTransaction,
+                       idempotency_key: Optional[str]=IDEMPOTENCY_KEY):
+        return await self._idempotent("transfer", idempotency_key, request,
+                                      lambda: call_service(self.account_service.transfer, account_transaction))
+
+
+    async def get_statement(self, statement_request: AccountStatementRequest):
+        statement = await call_service(self.account_service.get_statement, statement_request)
+        if statement is None:
+            raise HTTPException(status_code=404, detail="Account not found")
+
+        return statement
+
+
+    async def set_hot_mode(self, hot_mode: AccountHotMode):
+        hot_mode = await call_service(self.account_service.set_hot_mode, hot_mode)
+        if hot_mode is None:
+            raise HTTPException(status_code=404, detail="Account not found")
+
+        return hot_mode
+
+
+    # Large list responses are returned as FastJSONResponse directly, which
+    # skips response_model validation and encodes the rows in one call.
+    async def apply_batch(self, items: List[AccountBatchTransaction]):
+        try:
+            return FastJSONResponse(await call_service(self.account_service.apply_batch, items))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-    def withdraw(self, account_data: AccountTransaction):
-        self.account_service.withdraw(account_data)
 
+    async def get_transactions_history(self, account_data: AccountHistoryRequest):
+        if not account_data.page_size:
+            return FastJSONResponse(await call_service(self.account_service.get_transactions_history, account_data))
 
-    def transfer(self, account_transaction: AccountTransaction):
-        self.account_service.transfer(account_transaction)
+        try:
+            transactions, next_token = await call_service(self.account_service.get_transactions_history_page,
+                                                          account_data)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
+        headers = {"X-Continuation-Token": next_token} if next_token else None
+        return FastJSONResponse(transactions, headers=headers)
 
-    def get_transactions_history(self, account_data: AccountHistoryRequest):
-        return self.account_service.get_transactions_history(account_data)
 
-    
\ No newline at end of file
+    async def export_transactions_history(self, account_data: AccountHistoryRequest,
+                                          export_format: Literal["ndjson", "csv"]=Query("ndjson", alias="format")):
+        content = await call_service(self.account_service.export_transactions_history, account_data, export_format)
+        return StreamingResponse(content, media_type=EXPORT_MEDIA_TYPES[export_format])
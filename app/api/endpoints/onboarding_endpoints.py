@@ -0,0 +1,23 @@
+from tempfile import SpooledTemporaryFile
+from fastapi import Query, Request
+from app.api.services.onboarding_service import OnboardingService
+from utils.concurrency import call_service
+from utils.static_vars import IMPORT_SPOOL_MAX_BYTES
+from typing import Literal
+
+
+class OnboardingAPI:
+    def __init__(self, onboarding_service: OnboardingService):
+        self.onboarding_service = onboarding_service
+
+
+    # The raw body is spooled (to disk past IMPORT_SPOOL_MAX_BYTES) rather
+    # than parsed by FastAPI, so a large import never sits in memory whole.
+    async def import_onboarding(self, request: Request,
+                                import_format: Literal["ndjson", "csv"]=Query("ndjson", alias="format")):
+        with SpooledTemporaryFile(max_size=IMPORT_SPOOL_MAX_BYTES) as spool:
+            async for chunk in request.stream():
+                spool.write(chunk)
+            spool.seek(0)
+
+            return await call_service(self.onboarding_service.import_file, spool, import_format)
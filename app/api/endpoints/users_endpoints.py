@@ -2,12 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from app.models.user import User
 from app.schemas.user_schemas import UserData, UserUpdate
 from app.api.services.user_service import UserService
-
-from utils.static_vars import MONGODB_PATH
-from app.database.mongodb import MongoClient
-
-client = MongoClient(MONGODB_PATH)
-db = client.bank
+from utils.concurrency import call_service
 
 router = APIRouter()
 
@@ -18,17 +13,18 @@ class UserAPI:
 
     
     async def create_user(self, user_data: UserData):
-        self.user_service.create_user(user_data)
+        await call_service(self.user_service.create_user, user_data)
 
 
     async def update_user(self, user_update: UserUpdate):
-        self.user_service.update_user(user_update)
+        await call_service(self.user_service.update_user, user_update)
     
 
     async def delete_user(self, user_data: UserData):
-        self.user_service.delete_user(user_data)
+        await call_service(self.user_service.delete_user, user_data)
     
     
     async def get_user_info(self, user_data: UserData):
-        return self.user_service.get_user_info(user_data.document_id).to_dict()
+        user_info = await call_service(self.user_service.get_user_info, user_data.document_id)
+        return user_info.to_dict()
         
@@ -0,0 +1,37 @@
+import time
+
+from utils.metrics import REQUEST_LATENCY
+
+
+class RequestMetricsMiddleware:
+    """Pure ASGI middleware recording request latency per route template.
+
+    Streaming responses are measured until their last body chunk is sent.
+    """
+
+    def __init__(self, app, histogram=REQUEST_LATENCY):
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope; unknown paths share
+            # one label so scanners cannot blow up the series count.
+            route = scope.get("route")
+            self.histogram.observe((scope["method"], route.path if route else "unmatched", str(status)),
+                                   time.perf_counter() - start)
@@ -1,35 +1,114 @@
+from contextlib import asynccontextmanager
 from fastapi import APIRouter, FastAPI
-from app.models.user import User
-from app.models.account import Account
-from app.api.services.user_service import UserService
-from app.api.services.account_service import AccountService
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from app.models.user import User, AsyncUser
+from app.models.account import Account, AsyncAccount
+from app.models.idempotency import IdempotencyKey, AsyncIdempotencyKey
+from app.models.ledger import Ledger, AsyncLedger
+from app.models.onboarding import Onboarding, AsyncOnboarding
+from app.models.history_writer import HistoryWriter, AsyncHistoryWriter
+from app.api.services.user_service import UserService, AsyncUserService
+from app.api.services.account_service import AccountService, AsyncAccountService
+from app.api.services.idempotency_service import IdempotencyService, AsyncIdempotencyService
+from app.api.services.onboarding_service import OnboardingService, AsyncOnboardingService
 from app.api.endpoints.users_endpoints import UserAPI
 from app.api.endpoints.accounts_endpoints import AccountAPI
-from utils.static_vars import MONGODB_PATH
-from pymongo import MongoClient
+from app.api.endpoints.onboarding_endpoints import OnboardingAPI
+from app.api.middleware import RequestMetricsMiddleware
+from app.api.responses import FastJSONResponse
+from app.database.mongodb import MongoClientManager, AsyncIOMotorClient, ensure_indexes
+from utils.concurrency import call_service
+from utils.metrics import render_metrics
+from utils.static_vars import (ATOMIC_BALANCE_UPDATES, ENSURE_INDEXES_ON_STARTUP, LEDGER_BALANCES,
+                               MONGODB_DATABASE, HISTORY_WRITE_BEHIND)
 
 from typing import List
 
-client = MongoClient(MONGODB_PATH)
-db = client.bank
-User.set_database(db)
-Account.set_database(db)
 
-application = FastAPI()
+def cache_stats():
+    return {
+        "user": User.cache.stats(),
+        "balance": Account.balance_cache.stats(),
+        "idempotency": IdempotencyKey.cache.stats()
+    }
+
+
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+def bind_database(name: str=MONGODB_DATABASE):
+    """Create this process's Mongo clients and bind the models and services to them.
+
+    Nothing connects at import time, so every server worker builds its own
+    clients and pools after it has been started.
+    """
+    db = MongoClientManager.get_database(name)
+    for model in (User, Account, IdempotencyKey, Ledger, Onboarding):
+        model.set_database(db)
+
+    if AsyncIOMotorClient is not None:
+        async_db = MongoClientManager.get_async_database(name)
+        for model in (AsyncUser, AsyncAccount, AsyncIdempotencyKey, AsyncLedger, AsyncOnboarding):
+            model.set_database(async_db)
+
+        user_api.user_service = AsyncUserService(async_db)
+        account_api.account_service = AsyncAccountService(async_db, atomic=ATOMIC_BALANCE_UPDATES,
+                                                          journal=LEDGER_BALANCES)
+        account_api.idempotency_service = AsyncIdempotencyService(async_db)
+        onboarding_api.onboarding_service = AsyncOnboardingService(async_db, journal=LEDGER_BALANCES)
+    else:
+        user_api.user_service = UserService(db)
+        account_api.account_service = AccountService(db, atomic=ATOMIC_BALANCE_UPDATES, journal=LEDGER_BALANCES)
+        account_api.idempotency_service = IdempotencyService(db)
+        onboarding_api.onboarding_service = OnboardingService(db, journal=LEDGER_BALANCES)
+
+    return db
+
+
+def start_history_writer():
+    # Only the model family the services use gets the writer
+    model = AsyncAccount if AsyncIOMotorClient is not None else Account
+    writer = (AsyncHistoryWriter if model is AsyncAccount else HistoryWriter)(model.get_database())
+    writer.start()
+    model.history_writer = writer
+    return writer
+
+
+async def stop_history_writer(writer) -> None:
+    AsyncAccount.history_writer = Account.history_writer = None
+    await call_service(writer.close)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db = bind_database()
+    if ENSURE_INDEXES_ON_STARTUP:
+        await run_in_threadpool(ensure_indexes, db)
+    writer = start_history_writer() if HISTORY_WRITE_BEHIND else None
+    yield
+    if writer is not None:
+        await stop_history_writer(writer)
+    MongoClientManager.close()
+
+
+application = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+application.add_middleware(RequestMetricsMiddleware)
 user_router = APIRouter()
 account_router = APIRouter()
+onboarding_router = APIRouter()
 
 # Setup User routes
-user_service = UserService(db)
-user_api = UserAPI(user_service)
+# Services are attached by bind_database once the worker is running
+user_api = UserAPI(None)
 user_router.post("/create-user")(user_api.create_user)
 user_router.post("/update-user")(user_api.update_user)
 user_router.post("/delete-user")(user_api.delete_user)
 user_router.post("/info-user", response_model=dict)(user_api.get_user_info)
 
 # Setup Account routes
-account_service = AccountService(db)
-account_api = AccountAPI(account_service)
+account_api = AccountAPI(None)
 account_router.post("/create-account")(account_api.create_account)
 account_router.post("/delete-account")(account_api.delete_account)
 account_router.post("/freeze-account")(account_api.freeze_account)
@@ -38,8 +117,24 @@ account_router.post("/check-balance-account", response_model=dict)(account_api.c
 account_router.post("/deposit-account")(account_api.deposit)
 account_router.post("/withdraw-account")(account_api.withdraw)
 account_router.post("/transfer-account")(account_api.transfer)
+account_router.post("/batch-transactions", response_model=List[dict])(account_api.apply_batch)
 account_router.post("/get-transactions-history", response_model=List[dict])(account_api.get_transactions_history)
+account_router.post("/export-transactions-history")(account_api.export_transactions_history)
+account_router.post("/statement-account", response_model=dict)(account_api.get_statement)
+account_router.post("/hot-account", response_model=dict)(account_api.set_hot_mode)
+
+# Setup onboarding routes
+onboarding_api = OnboardingAPI(None)
+onboarding_router.post("/import-onboarding", response_model=dict)(onboarding_api.import_onboarding)
+
+# Setup monitoring routes
+monitoring_router = APIRouter()
+monitoring_router.get("/pool-stats", response_model=dict)(MongoClientManager.pool_stats)
+monitoring_router.get("/cache-stats", response_model=dict)(cache_stats)
+monitoring_router.get("/metrics", response_class=PlainTextResponse)(metrics)
 
 # Include routers in the app
 application.include_router(user_router)
-application.include_router(account_router)
\ No newline at end of file
+application.include_router(account_router)
+application.include_router(onboarding_router)
+application.include_router(monitoring_router)
\ No newline at end of file
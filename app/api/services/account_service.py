@@ -1,102 +1,798 @@
-from app.models.account import Account
-from app.schemas.account_schemas import AccountData, AccountTransaction, AccountHistoryRequest
+import csv
+import io
+import json
+
+from bson import ObjectId, Int64
+from pymongo import UpdateOne
+from app.models.account import (Account, AsyncAccount, history_append_operation, day_key,
+                                transaction_count_update, statement_operation)
+from app.models.ledger import Ledger, AsyncLedger, ledger_entries
+from app.database.transactions import run_in_transaction, async_run_in_transaction
+from app.schemas.account_schemas import (AccountData, AccountTransaction, AccountHistoryRequest,
+                                         AccountBatchTransaction, AccountStatementRequest,
+                                         AccountHotMode)
 from datetime import datetime
-from decimal import Decimal
+from typing import List
+from utils.cache import MISSING
+from utils.money import MINOR_UNITS, to_minor, to_major
+from utils.static_vars import HISTORY_MAX_PAGE_SIZE, BATCH_MAX_ITEMS
+
+HISTORY_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+HISTORY_EXPORT_FIELDS = ["timestamp", "type", "value", "counterpart"]
+HISTORY_EXPORT_CHUNK_ROWS = 500
+
+
+def history_export_encoder(export_format: str):
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def encode(row: dict) -> str:
+            writer.writerow([row.get(field) for field in HISTORY_EXPORT_FIELDS])
+            line = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return line
+
+        return encode({field: field for field in HISTORY_EXPORT_FIELDS}), encode
+
+    return "", lambda row: json.dumps(row, default=str) + "\n"
+
+
+def chunked_export(header: str, encode, rows):
+    # The header goes out on its own so clients see bytes before the first batch
+    if header:
+        yield header
+
+    chunk = []
+    for row in rows:
+        chunk.append(encode(row))
+        if len(chunk) == HISTORY_EXPORT_CHUNK_ROWS:
+            yield "".join(chunk)
+            chunk = []
+
+    if chunk:
+        yield "".join(chunk)
+
+
+async def async_chunked_export(header: str, encode, rows):
+    if header:
+        yield header
+
+    chunk = []
+    async for row in rows:
+        chunk.append(encode(row))
+        if len(chunk) == HISTORY_EXPORT_CHUNK_ROWS:
+            yield "".join(chunk)
+            chunk = []
+
+    if chunk:
+        yield "".join(chunk)
+
+
+class PartiallyApplied(Exception):
+    """The balance write committed but recording it failed; the request must not be applied again."""
+
+
+BATCH_OPERATIONS = {
+    "deposit": 1,
+    "withdraw": -1
+}
+# Narrowest account fields each call site reads; the ids always come along
+BALANCE_FIELDS = ("balance", "balance_shards")
+FROZEN_FIELDS = ("is_frozen",)
+TRANSFER_FIELDS = ("is_frozen", "balance_shards")
+BATCH_ACCOUNT_PROJECTION = {"_id": 0, "account_id": 1, "user_document": 1, "balance": 1, "is_frozen": 1,
+                            "balance_shards": 1}
+
+
+def plan_batch(items: List[AccountBatchTransaction], accounts: dict, batch_id: str):
+    # Items are simulated in order against the loaded balances. Each account
+    # then gets one guarded $inc: it needs at least the largest running debit
+    # of the batch, so a concurrent withdrawal can't push it negative.
+    results = []
+    plans = {}
+    balances = {document: account["balance"] for document, account in accounts.items()}
+
+    for index, item in enumerate(items):
+        result = {"index": index, "user_document": item.user_document,
+                  "operation": item.operation, "status": "rejected"}
+        results.append(result)
+        account = accounts.get(item.user_document)
+
+        if item.operation not in BATCH_OPERATIONS:
+            result["reason"] = "unknown operation"
+        elif not item.value or item.value <= 0:
+            result["reason"] = "invalid value"
+        elif account is None:
+            result["reason"] = "account not found"
+        elif account["is_frozen"]:
+            result["reason"] = "account is frozen"
+        elif balances[item.user_document] + BATCH_OPERATIONS[item.operation] * to_minor(item.value) < 0:
+            result["reason"] = "insufficient funds"
+        else:
+            delta = BATCH_OPERATIONS[item.operation] * to_minor(item.value)
+            balances[item.user_document] += delta
+            plan = plans.setdefault(account["account_id"], {"net": 0, "need": 0, "items": [], "days": {}})
+            plan["net"] += delta
+            day = day_key(item.transaction_date)
+            plan["days"][day] = plan["days"].get(day, 0) + 1
+            plan["need"] = max(plan["need"], -plan["net"])
+            plan["items"].append(index)
+            result["status"] = "applied"
+            result["balance"] = to_major(balances[item.user_document])
+
+    updates = []
+    for account_id, plan in plans.items():
+        update = transaction_count_update(counts=plan["days"])
+        update["$inc"]["balance"] = Int64(plan["net"])
+        update["$set"] = {"last_batch_id": batch_id}
+        updates.append(UpdateOne({"account_id": account_id, "is_frozen": False, "balance": {"$gte": plan["need"]}},
+                                 update))
+
+    return results, plans, updates
+
+
+def split_hot_accounts(accounts: dict):
+    # A hot account holds part of its funds in shards, which the batch's single
+    # guarded $inc can't see; its items go one by one through the atomic path.
+    hot = {document: account for document, account in accounts.items() if account.get("balance_shards")}
+    return {document: account for document, account in accounts.items() if document not in hot}, hot
+
+
+def hot_batch_items(items: List[AccountBatchTransaction], hot: dict, results: list):
+    # plan_batch saw hot accounts as missing; items it rejected for another reason stay rejected
+    for index, item in enumerate(items):
+        if item.user_document in hot and results[index].get("reason") == "account not found":
+            yield index, item, hot[item.user_document]
+
+
+def record_hot_item(results: list, plans: dict, index: int, account: dict, updated) -> None:
+    result = results[index]
+    if updated is None:
+        result["reason"] = "account is frozen" if account["is_frozen"] else "insufficient funds"
+        return
+
+    del result["reason"]
+    result["status"] = "applied"
+    result["balance"] = to_major(updated.balance)
+    plan = plans.setdefault(account["account_id"], {"net": 0, "need": 0, "items": [], "days": {}})
+    plan["items"].append(index)
+
+
+def reject_conflicts(results: list, plans: dict, conflicts: list) -> None:
+    for account in conflicts:
+        reject_plan_items(results, plans, account["account_id"])
+
+
+def reject_plan_items(results: list, plans: dict, account_id: str, start: int=0) -> None:
+    plan = plans[account_id]
+    for index in plan["items"][start:]:
+        results[index]["status"] = "rejected"
+        results[index]["reason"] = "concurrent update"
+        del results[index]["balance"]
+
+    del plan["items"][start:]
+    if not plan["items"]:
+        del plans[account_id]
+
+
+def ledger_batch_movements(items: List[AccountBatchTransaction], plan: dict) -> list:
+    return [(BATCH_OPERATIONS[items[index].operation] * to_minor(items[index].value), items[index].operation,
+             None, items[index].transaction_date.replace(microsecond=0))
+            for index in plan["items"]]
+
+
+def ledger_projection_update(entries: List[dict]) -> UpdateOne:
+    counts = {}
+    for entry in entries:
+        day = day_key(entry["timestamp"])
+        counts[day] = counts.get(day, 0) + 1
+
+    update = transaction_count_update(counts=counts)
+    update["$inc"]["balance"] = Int64(sum(entry["delta"] for entry in entries))
+    return UpdateOne({"account_id": entries[0]["account_id"]}, update)
+
+
+def batch_history_operations(items: List[AccountBatchTransaction], plans: dict):
+    history_operations = []
+    statement_operations = []
+    for account_id, plan in plans.items():
+        for index in plan["items"]:
+            item = items[index]
+            transaction_data = {
+                "timestamp": item.transaction_date.replace(microsecond=0),
+                "type": item.operation,
+                "value": to_minor(item.value),
+                "counterpart": None
+            }
+            history_operations.append(UpdateOne(*history_append_operation(account_id, transaction_data), upsert=True))
+            statement_operations.append(UpdateOne(*statement_operation(account_id, transaction_data), upsert=True))
+
+    return history_operations, statement_operations
+
+
+def statement_response(statement: dict) -> dict:
+    return {
+        **statement,
+        "opening_balance": to_major(statement["opening_balance"]),
+        "closing_balance": to_major(statement["closing_balance"]),
+        "totals": {transaction_type: to_major(total) for transaction_type, total in statement["totals"].items()}
+    }
+
+
+def normalize_batch(items: List[AccountBatchTransaction|dict]) -> List[AccountBatchTransaction]:
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f"A batch holds at most {BATCH_MAX_ITEMS} items")
+
+    normalized = []
+    for item in items:
+        if isinstance(item, dict):
+            item = AccountBatchTransaction(**item)
+        normalized.append(item)
+
+    return normalized
 
 
 class AccountService:
-    def __init__(self, db):
+    def __init__(self, db, atomic: bool=False, journal: bool=False):
         self._db = db
+        self.atomic = atomic
+        self.journal = journal
 
     def create_account(self, account_data: AccountData):
-        account = Account(**account_data.to_dict())
+        account = Account(**{**account_data.to_dict(), "balance": to_minor(account_data.balance)})
         account.create()
+        if self.journal:
+            Ledger.open(account.account_id, account.balance)
     
 
     def delete_account(self, account_data: AccountData):
-        account = Account.find_by_document_id(account_data.user_document)
+        account = Account.find_by_document_id(account_data.user_document, BALANCE_FIELDS)
         if account:
             print('h')
             _ = account.delete()
     
     
     def freeze_account(self, account_data: AccountData):
-        account = Account.find_by_document_id(account_data.user_document)
+        account = Account.find_by_document_id(account_data.user_document, ())
         if account:
             account.freeze()
     
 
     def unfreeze_account(self, account_data: AccountData):
-        account = Account.find_by_document_id(account_data.user_document)
+        account = Account.find_by_document_id(account_data.user_document, ())
         if account:
             account.unfreeze()
     
 
     def check_balance(self, account_data: AccountData):
-        account = Account.find_by_document_id(account_data.user_document)
+        return to_major(Account.balance_cache.get_or_load(account_data.user_document,
+                                                          lambda: self._load_balance(account_data.user_document)))
+
+
+    def _load_balance(self, document_id: str):
+        account = Account.find_by_document_id(document_id, () if self.journal else BALANCE_FIELDS)
+        if self.journal:
+            return Ledger.balance(account.account_id)
+
         return account.balance_check()
+
+
+    @staticmethod
+    def _journal(account: Account, delta, entry_type: str, transaction_day: datetime=None,
+                 counterpart: str=None, session=None):
+        # Only debits can be refused, for lack of funds; the projection follows the entry
+        entry = Ledger.append(account.account_id, delta, entry_type, counterpart, transaction_day, session)
+        if entry is None:
+            return None
+
+        return Account.project_ledger_entry(entry, transaction_day, session)
+
+
+    def _journal_transfer(self, account: Account, recipient: Account, value, transaction_day: datetime):
+        # Both entries and their projections commit together, or neither does:
+        # a debit can't be left without its credit.
+        def apply(session):
+            debited = self._journal(account, -value, "transfer-out", transaction_day, recipient.user_document,
+                                    session)
+            if debited is None:
+                return None
+
+            credited = self._journal(recipient, value, "transfer-in", counterpart=account.user_document,
+                                     session=session)
+            return (debited, credited) if credited is not None else None
+
+        applied = run_in_transaction(self._db.client, apply)
+        Account.balance_cache.invalidate(account.user_document, recipient.user_document)
+        return applied
+
+
+    def get_daily_transaction_count(self, account_data: AccountData, day: datetime=None):
+        return Account.count_transactions_on(account_data.user_document, day or datetime.now())
     
 
     def deposit(self, account_data: AccountTransaction|dict):
         if isinstance(account_data, dict):
             account_data = AccountTransaction(**account_data)
-            account_data.transaction_date = datetime.strptime(account_data.transaction_date, "%Y-%m-%d %H:%M:%S")
 
-        account = Account.find_by_document_id(account_data.user_document)
         transaction_date = account_data.transaction_date.strftime("%Y-%m-%d %H:%M:%S")
-        account.deposit(account_data.value)
-        account.add_transaction(transaction_type="deposit", 
-                                value=account_data.value, 
-                                transaction_time=transaction_date)
-        account.update_transaction_count(transaction_date)
+        value = to_minor(account_data.value)
+        if self.journal:
+            account = Account.find_by_document_id(account_data.user_document, FROZEN_FIELDS)
+            if account is None or account.is_frozen:
+                return None
+
+            account = self._journal(account, value, "deposit", account_data.transaction_date)
+            if account is None:
+                return None
+        elif self.atomic:
+            account = Account.atomic_deposit(account_data.user_document, value,
+                                             account_data.transaction_date)
+            if account is None:
+                return None
+        else:
+            account = Account.find_by_document_id(account_data.user_document, BALANCE_FIELDS)
+            account.deposit(value, account_data.transaction_date)
+
+        try:
+            account.add_transaction(transaction_type="deposit",
+                                    value=value,
+                                    transaction_time=transaction_date)
+        except Exception as e:
+            raise PartiallyApplied("The deposit was applied but could not be recorded") from e
+
+        return to_major(account.balance_check())
     
 
     def withdraw(self, account_data: AccountTransaction|dict):
         if isinstance(account_data, dict):
             account_data = AccountTransaction(**account_data)
-            account_data.transaction_date = datetime.strptime(account_data.transaction_date, "%Y-%m-%d %H:%M:%S")
 
-        account = Account.find_by_document_id(account_data.user_document)
         transaction_date = account_data.transaction_date.strftime("%Y-%m-%d %H:%M:%S")
-        account.withdraw(account_data.value)
-        account.add_transaction(transaction_type="withdraw", 
-                                value=account_data.value, 
-                                transaction_time=transaction_date)
-        account.update_transaction_count(transaction_date)
+        value = to_minor(account_data.value)
+        if self.journal:
+            account = Account.find_by_document_id(account_data.user_document, FROZEN_FIELDS)
+            if account is None or account.is_frozen:
+                return None
+
+            account = self._journal(account, -value, "withdraw", account_data.transaction_date)
+            if account is None:
+                return None
+        elif self.atomic:
+            account = Account.atomic_withdraw(account_data.user_document, value,
+                                              account_data.transaction_date)
+            if account is None:
+                return None
+        else:
+            account = Account.find_by_document_id(account_data.user_document, BALANCE_FIELDS)
+            # A refused withdrawal leaves no history or statement entry
+            if not account.withdraw(value, account_data.transaction_date):
+                return None
+
+        try:
+            account.add_transaction(transaction_type="withdraw",
+                                    value=value,
+                                    transaction_time=transaction_date)
+        except Exception as e:
+            raise PartiallyApplied("The withdraw was applied but could not be recorded") from e
+
+        return to_major(account.balance_check())
     
 
     def transfer(self, account_data: AccountTransaction):
-        account = Account.find_by_document_id(account_data.user_document)
-        recipient_account = Account.find_by_document_id(account_data.recipient_document)
+        account = Account.find_by_document_id(account_data.user_document, TRANSFER_FIELDS)
+        recipient_account = Account.find_by_document_id(account_data.recipient_document, TRANSFER_FIELDS)
         transaction_date = account_data.transaction_date.strftime("%Y-%m-%d %H:%M:%S")
-        account.transfer(recipient_account.account_id, account_data.value)
+        value = to_minor(account_data.value)
+        # The transfer filters check it again, against a concurrent freeze
+        if account.is_frozen or recipient_account.is_frozen:
+            return
 
-        account.add_transaction(transaction_type="transfer-out", 
-                                value=account_data.value, 
-                                counterpart=recipient_account.user_document, 
-                                transaction_time=transaction_date)
-        account.update_transaction_count(transaction_date)
+        if self.journal:
+            applied = self._journal_transfer(account, recipient_account, value, account_data.transaction_date)
+            if applied is None:
+                return
 
-        recipient_account.add_transaction(transaction_type="transfer-in", 
-                                          value=account_data.value, 
-                                          counterpart=account.user_document, 
-                                          transaction_time=transaction_date)
+            account, recipient_account = applied
+        else:
+            recipient_account = account.transfer(recipient_account, value, account_data.transaction_date)
+            if recipient_account is None:
+                return
+
+        try:
+            account.add_transaction(transaction_type="transfer-out",
+                                    value=value,
+                                    counterpart=recipient_account.user_document,
+                                    transaction_time=transaction_date)
+
+            recipient_account.add_transaction(transaction_type="transfer-in",
+                                              value=value,
+                                              counterpart=account.user_document,
+                                              transaction_time=transaction_date)
+        except Exception as e:
+            raise PartiallyApplied("The transfer was applied but could not be recorded") from e
     
 
+    def set_hot_mode(self, hot_mode: AccountHotMode):
+        account = Account.find_by_document_id(hot_mode.user_document, ())
+        if account is None:
+            return None
+
+        account.set_hot_shards(hot_mode.shards)
+        return {"user_document": account.user_document, "shards": account.balance_shards}
+
+
+    def get_statement(self, statement_request: AccountStatementRequest):
+        account = Account.find_by_document_id(statement_request.user_document, BALANCE_FIELDS)
+        if account is None:
+            return None
+
+        return statement_response(account.get_statement(statement_request.month))
+
+
     def get_transactions_history(self, account_data: AccountHistoryRequest):
-        account = Account.find_by_document_id(account_data.user_document)
-        transactions = account.get_transaction_history()
+        account = Account.find_by_document_id(account_data.user_document, ())
+
+        return account.get_transaction_history(*self._history_range(account_data),
+                                               timestamp_format=HISTORY_TIMESTAMP_FORMAT,
+                                               value_scale=MINOR_UNITS)
+
+
+    def get_transactions_history_page(self, account_data: AccountHistoryRequest):
+        account = Account.find_by_document_id(account_data.user_document, ())
+        page_size = min(account_data.page_size, HISTORY_MAX_PAGE_SIZE)
+
+        return account.get_transaction_history_page(page_size, account_data.continuation_token,
+                                                    *self._history_range(account_data),
+                                                    timestamp_format=HISTORY_TIMESTAMP_FORMAT,
+                                                    value_scale=MINOR_UNITS)
+
+
+    def apply_batch(self, items: List[AccountBatchTransaction|dict]) -> List[dict]:
+        items = normalize_batch(items)
+        documents = list({item.user_document for item in items})
+        accounts = {account["user_document"]: account
+                    for account in self._db.accounts.find({"user_document": {"$in": documents}},
+                                                          BATCH_ACCOUNT_PROJECTION)}
+
+        if self.journal:
+            results, plans = self._journal_batch(items, accounts)
+        else:
+            batch_id = str(ObjectId())
+            accounts, hot = split_hot_accounts(accounts)
+            results, plans, updates = plan_batch(items, accounts, batch_id)
+            if updates:
+                write_result = self._db.accounts.bulk_write(updates, ordered=False)
+                if write_result.modified_count < len(updates):
+                    conflicts = self._db.accounts.find({"account_id": {"$in": list(plans)},
+                                                        "last_batch_id": {"$ne": batch_id}},
+                                                       {"_id": 0, "account_id": 1})
+                    reject_conflicts(results, plans, list(conflicts))
+            for index, item, account in hot_batch_items(items, hot, results):
+                update = Account.atomic_deposit if item.operation == "deposit" else Account.atomic_withdraw
+                record_hot_item(results, plans, index, account,
+                                update(item.user_document, to_minor(item.value), item.transaction_date))
 
+        Account.balance_cache.invalidate(*documents)
+        history_operations, statement_operations = batch_history_operations(items, plans)
+        if history_operations:
+            self._db.transactions_history.bulk_write(history_operations, ordered=True)
+            self._db.statements.bulk_write(statement_operations, ordered=True)
+
+        return results
+
+
+    def _journal_batch(self, items: List[AccountBatchTransaction], accounts: dict):
+        # Funds are checked against the ledger heads; each account's entries go
+        # in as one chain, and a concurrent append rejects the items it cut off.
+        heads = Ledger.heads([account["account_id"] for account in accounts.values()])
+        for account in accounts.values():
+            account["balance"] = heads[account["account_id"]]["balance"]
+
+        results, plans, _ = plan_batch(items, accounts, None)
+        updates = []
+        for account_id, plan in list(plans.items()):
+            entries = ledger_entries(account_id, heads[account_id], ledger_batch_movements(items, plan))
+            inserted = Ledger.append_many(entries)
+            if inserted < len(entries):
+                reject_plan_items(results, plans, account_id, inserted)
+            if inserted:
+                updates.append(ledger_projection_update(entries[:inserted]))
+
+        if updates:
+            self._db.accounts.bulk_write(updates, ordered=False)
+
+        return results, plans
+
+
+    def export_transactions_history(self, account_data: AccountHistoryRequest, export_format: str="ndjson"):
+        account = Account.find_by_document_id(account_data.user_document, ())
+        header, encode = history_export_encoder(export_format)
+        rows = account.iter_transaction_history(*self._history_range(account_data),
+                                                timestamp_format=HISTORY_TIMESTAMP_FORMAT,
+                                                value_scale=MINOR_UNITS)
+
+        return chunked_export(header, encode, rows)
+
+
+    @staticmethod
+    def _history_range(account_data: AccountHistoryRequest):
         if not account_data.end_date:
             account_data.end_date = datetime.now()
 
         if account_data.start_date:
-            transactions = [t for t in transactions if t["timestamp"] >= account_data.start_date and t["timestamp"] <= account_data.end_date]
+            return account_data.start_date, account_data.end_date
+
+        return None, None
+
+
+class AsyncAccountService(AccountService):
+    async def create_account(self, account_data: AccountData):
+        account = AsyncAccount(**{**account_data.to_dict(), "balance": to_minor(account_data.balance)})
+        await account.create()
+        if self.journal:
+            await AsyncLedger.open(account.account_id, account.balance)
+
+
+    async def delete_account(self, account_data: AccountData):
+        account = await AsyncAccount.find_by_document_id(account_data.user_document, BALANCE_FIELDS)
+        if account:
+            _ = await account.delete()
+
+
+    async def freeze_account(self, account_data: AccountData):
+        account = await AsyncAccount.find_by_document_id(account_data.user_document, ())
+        if account:
+            await account.freeze()
+
+
+    async def unfreeze_account(self, account_data: AccountData):
+        account = await AsyncAccount.find_by_document_id(account_data.user_document, ())
+        if account:
+            await account.unfreeze()
+
+
+    async def check_balance(self, account_data: AccountData):
+        balance = Account.balance_cache.get(account_data.user_document)
+        if balance is MISSING:
+            generation = Account.balance_cache.generation
+            account = await AsyncAccount.find_by_document_id(account_data.user_document,
+                                                             () if self.journal else BALANCE_FIELDS)
+            balance = await AsyncLedger.balance(account.account_id) if self.journal else account.balance_check()
+            Account.balance_cache.set(account_data.user_document, balance, generation)
+
+        return to_major(balance)
+
+
+    async def get_daily_transaction_count(self, account_data: AccountData, day: datetime=None):
+        return await AsyncAccount.count_transactions_on(account_data.user_document, day or datetime.now())
+
+
+    @staticmethod
+    async def _journal(account: AsyncAccount, delta, entry_type: str, transaction_day: datetime=None,
+                       counterpart: str=None, session=None):
+        entry = await AsyncLedger.append(account.account_id, delta, entry_type, counterpart, transaction_day,
+                                         session)
+        if entry is None:
+            return None
+
+        return await AsyncAccount.project_ledger_entry(entry, transaction_day, session)
+
+
+    async def _journal_transfer(self, account: AsyncAccount, recipient: AsyncAccount, value,
+                                transaction_day: datetime):
+        async def apply(session):
+            debited = await self._journal(account, -value, "transfer-out", transaction_day, recipient.user_document,
+                                          session)
+            if debited is None:
+                return None
+
+            credited = await self._journal(recipient, value, "transfer-in", counterpart=account.user_document,
+                                           session=session)
+            return (debited, credited) if credited is not None else None
+
+        applied = await async_run_in_transaction(self._db.client, apply)
+        Account.balance_cache.invalidate(account.user_document, recipient.user_document)
+        return applied
+
+
+    async def deposit(self, account_data: AccountTransaction|dict):
+        if isinstance(account_data, dict):
+            account_data = AccountTransaction(**account_data)
+
+        transaction_date = account_data.transaction_date.strftime("%Y-%m-%d %H:%M:%S")
+        value = to_minor(account_data.value)
+        if self.journal:
+            account = await AsyncAccount.find_by_document_id(account_data.user_document, FROZEN_FIELDS)
+            if account is None or account.is_frozen:
+                return None
+
+            account = await self._journal(account, value, "deposit", account_data.transaction_date)
+            if account is None:
+                return None
+        elif self.atomic:
+            account = await AsyncAccount.atomic_deposit(account_data.user_document, value,
+                                                        account_data.transaction_date)
+            if account is None:
+                return None
+        else:
+            account = await AsyncAccount.find_by_document_id(account_data.user_document, BALANCE_FIELDS)
+            await account.deposit(value, account_data.transaction_date)
+
+        try:
+            await account.add_transaction(transaction_type="deposit",
+                                          value=value,
+                                          transaction_time=transaction_date)
+        except Exception as e:
+            raise PartiallyApplied("The deposit was applied but could not be recorded") from e
+
+        return to_major(account.balance_check())
+
+
+    async def withdraw(self, account_data: AccountTransaction|dict):
+        if isinstance(account_data, dict):
+            account_data = AccountTransaction(**account_data)
+
+        transaction_date = account_data.transaction_date.strftime("%Y-%m-%d %H:%M:%S")
+        value = to_minor(account_data.value)
+        if self.journal:
+            account = await AsyncAccount.find_by_document_id(account_data.user_document, FROZEN_FIELDS)
+            if account is None or account.is_frozen:
+                return None
+
+            account = await self._journal(account, -value, "withdraw", account_data.transaction_date)
+            if account is None:
+                return None
+        elif self.atomic:
+            account = await AsyncAccount.atomic_withdraw(account_data.user_document, value,
+                                                         account_data.transaction_date)
+            if account is None:
+                return None
+        else:
+            account = await AsyncAccount.find_by_document_id(account_data.user_document, BALANCE_FIELDS)
+            if not await account.withdraw(value, account_data.transaction_date):
+                return None
+
+        try:
+            await account.add_transaction(transaction_type="withdraw",
+                                          value=value,
+                                          transaction_time=transaction_date)
+        except Exception as e:
+            raise PartiallyApplied("The withdraw was applied but could not be recorded") from e
+
+        return to_major(account.balance_check())
+
+
+    async def transfer(self, account_data: AccountTransaction):
+        account = await AsyncAccount.find_by_document_id(account_data.user_document, TRANSFER_FIELDS)
+        recipient_account = await AsyncAccount.find_by_document_id(account_data.recipient_document,
+                                                                   TRANSFER_FIELDS)
+        transaction_date = account_data.transaction_date.strftime("%Y-%m-%d %H:%M:%S")
+        value = to_minor(account_data.value)
+        # The transfer filters check it again, against a concurrent freeze
+        if account.is_frozen or recipient_account.is_frozen:
+            return
+
+        if self.journal:
+            applied = await self._journal_transfer(account, recipient_account, value, account_data.transaction_date)
+            if applied is None:
+                return
+
+            account, recipient_account = applied
+        else:
+            recipient_account = await account.transfer(recipient_account, value, account_data.transaction_date)
+            if recipient_account is None:
+                return
+
+        try:
+            await account.add_transaction(transaction_type="transfer-out",
+                                          value=value,
+                                          counterpart=recipient_account.user_document,
+                                          transaction_time=transaction_date)
+
+            await recipient_account.add_transaction(transaction_type="transfer-in",
+                                                    value=value,
+                                                    counterpart=account.user_document,
+                                                    transaction_time=transaction_date)
+        except Exception as e:
+            raise PartiallyApplied("The transfer was applied but could not be recorded") from e
+
+
+    async def set_hot_mode(self, hot_mode: AccountHotMode):
+        account = await AsyncAccount.find_by_document_id(hot_mode.user_document, ())
+        if account is None:
+            return None
+
+        await account.set_hot_shards(hot_mode.shards)
+        return {"user_document": account.user_document, "shards": account.balance_shards}
+
+
+    async def get_statement(self, statement_request: AccountStatementRequest):
+        account = await AsyncAccount.find_by_document_id(statement_request.user_document, BALANCE_FIELDS)
+        if account is None:
+            return None
+
+        return statement_response(await account.get_statement(statement_request.month))
+
+
+    async def get_transactions_history(self, account_data: AccountHistoryRequest):
+        account = await AsyncAccount.find_by_document_id(account_data.user_document, ())
+
+        return await account.get_transaction_history(*self._history_range(account_data),
+                                                     timestamp_format=HISTORY_TIMESTAMP_FORMAT,
+                                                     value_scale=MINOR_UNITS)
+
+
+    async def get_transactions_history_page(self, account_data: AccountHistoryRequest):
+        account = await AsyncAccount.find_by_document_id(account_data.user_document, ())
+        page_size = min(account_data.page_size, HISTORY_MAX_PAGE_SIZE)
+
+        return await account.get_transaction_history_page(page_size, account_data.continuation_token,
+                                                          *self._history_range(account_data),
+                                                          timestamp_format=HISTORY_TIMESTAMP_FORMAT,
+                                                          value_scale=MINOR_UNITS)
+
+
+    async def export_transactions_history(self, account_data: AccountHistoryRequest, export_format: str="ndjson"):
+        account = await AsyncAccount.find_by_document_id(account_data.user_document, ())
+        header, encode = history_export_encoder(export_format)
+        rows = account.iter_transaction_history(*self._history_range(account_data),
+                                                timestamp_format=HISTORY_TIMESTAMP_FORMAT,
+                                                value_scale=MINOR_UNITS)
+
+        return async_chunked_export(header, encode, rows)
+
+
+    async def apply_batch(self, items: List[AccountBatchTransaction|dict]) -> List[dict]:
+        items = normalize_batch(items)
+        documents = list({item.user_document for item in items})
+        cursor = self._db.accounts.find({"user_document": {"$in": documents}}, BATCH_ACCOUNT_PROJECTION)
+        accounts = {account["user_document"]: account async for account in cursor}
+
+        if self.journal:
+            results, plans = await self._journal_batch(items, accounts)
+        else:
+            batch_id = str(ObjectId())
+            accounts, hot = split_hot_accounts(accounts)
+            results, plans, updates = plan_batch(items, accounts, batch_id)
+            if updates:
+                write_result = await self._db.accounts.bulk_write(updates, ordered=False)
+                if write_result.modified_count < len(updates):
+                    conflicts = await self._db.accounts.find({"account_id": {"$in": list(plans)},
+                                                              "last_batch_id": {"$ne": batch_id}},
+                                                             {"_id": 0, "account_id": 1}).to_list(None)
+                    reject_conflicts(results, plans, conflicts)
+            for index, item, account in hot_batch_items(items, hot, results):
+                update = AsyncAccount.atomic_deposit if item.operation == "deposit" else AsyncAccount.atomic_withdraw
+                record_hot_item(results, plans, index, account,
+                                await update(item.user_document, to_minor(item.value), item.transaction_date))
+
+        Account.balance_cache.invalidate(*documents)
+        history_operations, statement_operations = batch_history_operations(items, plans)
+        if history_operations:
+            await self._db.transactions_history.bulk_write(history_operations, ordered=True)
+            await self._db.statements.bulk_write(statement_operations, ordered=True)
+
+        return results
+
 
-        for transaction in transactions:
-            transaction["timestamp"] = transaction["timestamp"].strftime("%Y-%m-%d %H:%M:%S")
+    async def _journal_batch(self, items: List[AccountBatchTransaction], accounts: dict):
+        heads = await AsyncLedger.heads([account["account_id"] for account in accounts.values()])
+        for account in accounts.values():
+            account["balance"] = heads[account["account_id"]]["balance"]
 
-        return transactions
+        results, plans, _ = plan_batch(items, accounts, None)
+        updates = []
+        for account_id, plan in list(plans.items()):
+            entries = ledger_entries(account_id, heads[account_id], ledger_batch_movements(items, plan))
+            inserted = await AsyncLedger.append_many(entries)
+            if inserted < len(entries):
+                reject_plan_items(results, plans, account_id, inserted)
+            if inserted:
+                updates.append(ledger_projection_update(entries[:inserted]))
 
-        
+        if updates:
+            await self._db.accounts.bulk_write(updates, ordered=False)
 
+        return results, plans
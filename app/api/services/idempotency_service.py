@@ -0,0 +1,66 @@
+import hashlib
+import json
+from app.models.idempotency import IdempotencyKey, AsyncIdempotencyKey
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    pass
+
+
+def record_id(scope: str, key: str) -> str:
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise ValueError(f"Idempotency keys must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+
+    return f"{scope}:{key}"
+
+
+def request_fingerprint(payload) -> str:
+    body = payload.to_dict() if hasattr(payload, "to_dict") else payload
+    encoded = json.dumps(body, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(encoded.encode(), digest_size=16).hexdigest()
+
+
+def check_record(record: dict|None, fingerprint: str) -> dict|None:
+    if record is None:
+        return None
+
+    if record["fingerprint"] != fingerprint:
+        raise ValueError("The idempotency key was already used for a different request")
+
+    if record["status"] is None:
+        raise IdempotencyConflict("A request with this idempotency key is still in progress")
+
+    return record
+
+
+class IdempotencyService:
+    def __init__(self, db):
+        self._db = db
+
+    def begin(self, scope: str, key: str, payload) -> dict|None:
+        fingerprint = request_fingerprint(payload)
+        return check_record(IdempotencyKey.claim(record_id(scope, key), fingerprint), fingerprint)
+
+
+    def complete(self, scope: str, key: str, payload, status: int, response) -> None:
+        IdempotencyKey.complete(record_id(scope, key), request_fingerprint(payload), status, response)
+
+
+    def release(self, scope: str, key: str) -> None:
+        IdempotencyKey.release(record_id(scope, key))
+
+
+class AsyncIdempotencyService(IdempotencyService):
+    async def begin(self, scope: str, key: str, payload) -> dict|None:
+        fingerprint = request_fingerprint(payload)
+        return check_record(await AsyncIdempotencyKey.claim(record_id(scope, key), fingerprint), fingerprint)
+
+
+    async def complete(self, scope: str, key: str, payload, status: int, response) -> None:
+        await AsyncIdempotencyKey.complete(record_id(scope, key), request_fingerprint(payload), status, response)
+
+
+    async def release(self, scope: str, key: str) -> None:
+        await AsyncIdempotencyKey.release(record_id(scope, key))
@@ -0,0 +1,140 @@
+import codecs
+import csv
+import json
+
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from app.models.onboarding import Onboarding, AsyncOnboarding
+from app.schemas.onboarding_schemas import OnboardingRow
+from utils.money import to_minor
+from utils.static_vars import IMPORT_BATCH_SIZE, IMPORT_MAX_REPORTED_ERRORS
+
+IMPORT_FORMATS = ("ndjson", "csv")
+
+
+def parse_rows(lines, import_format: str):
+    """Yield ``(row, fields, error)`` per record; ``row`` counts records from 1."""
+    if import_format == "csv":
+        for row, fields in enumerate(csv.DictReader(lines), start=1):
+            # Empty cells count as missing, so defaults apply
+            yield row, {key: value for key, value in fields.items()
+                        if key is not None and value not in ("", None)}, None
+        return
+
+    row = 0
+    for line in lines:
+        if not line.strip():
+            continue
+
+        row += 1
+        try:
+            fields = json.loads(line)
+        except ValueError:
+            yield row, None, "invalid JSON"
+            continue
+
+        if isinstance(fields, dict):
+            yield row, fields, None
+        else:
+            yield row, None, "expected a JSON object"
+
+
+def validate_row(fields: dict):
+    try:
+        row = OnboardingRow(**fields)
+    except ValidationError as e:
+        return None, "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+
+    return {**row.to_dict(), "balance": to_minor(row.balance)}, None
+
+
+def batched_rows(lines, import_format: str, batch_size: int=IMPORT_BATCH_SIZE):
+    # Yields (valid rows, rejected rows) a batch at a time, so memory stays
+    # bounded by the batch size whatever the size of the input.
+    batch, rejected = [], []
+    for row, fields, error in parse_rows(lines, import_format):
+        if error is None:
+            fields, error = validate_row(fields)
+        if error is not None:
+            rejected.append({"row": row, "error": error})
+        else:
+            batch.append((row, fields))
+        if len(batch) + len(rejected) == batch_size:
+            yield batch, rejected
+            batch, rejected = [], []
+
+    if batch or rejected:
+        yield batch, rejected
+
+
+def batch_report(batch: list, failures: dict) -> list:
+    return [{"row": batch[index][0], "document_id": batch[index][1]["document_id"], "error": error}
+            for index, error in sorted(failures.items())]
+
+
+def record_report_entry(summary: dict, entry: dict, max_errors: int) -> None:
+    # Only the first max_errors rejections are kept; the counts cover them all
+    if "imported" in entry:
+        summary.update(imported=entry["imported"], failed=entry["failed"])
+    elif len(summary["errors"]) < max_errors:
+        summary["errors"].append(entry)
+
+
+class OnboardingService:
+    def __init__(self, db, journal: bool=False):
+        self._db = db
+        self.journal = journal
+
+    def iter_import(self, lines, import_format: str="ndjson", batch_size: int=IMPORT_BATCH_SIZE):
+        """Import users and accounts from NDJSON or CSV ``lines``.
+
+        Yields one entry per rejected row, then a final
+        ``{"imported": n, "failed": m}`` entry.
+        """
+        imported = failed = 0
+        for batch, rejected in batched_rows(lines, import_format, batch_size):
+            failures = Onboarding.import_batch([fields for _, fields in batch], self.journal) if batch else {}
+            report = rejected + batch_report(batch, failures)
+            imported += len(batch) - len(failures)
+            failed += len(report)
+            yield from sorted(report, key=lambda entry: entry["row"])
+
+        yield {"imported": imported, "failed": failed}
+
+
+    def import_file(self, file, import_format: str="ndjson", max_errors: int=IMPORT_MAX_REPORTED_ERRORS) -> dict:
+        summary = {"imported": 0, "failed": 0, "errors": []}
+        for entry in self.iter_import(codecs.iterdecode(file, "utf-8-sig"), import_format):
+            record_report_entry(summary, entry, max_errors)
+
+        return summary
+
+
+class AsyncOnboardingService(OnboardingService):
+    async def iter_import(self, lines, import_format: str="ndjson", batch_size: int=IMPORT_BATCH_SIZE):
+        imported = failed = 0
+        batches = batched_rows(lines, import_format, batch_size)
+        while True:
+            # Reading and parsing the spooled upload blocks, so each batch is
+            # pulled in the threadpool rather than on the event loop.
+            parsed = await run_in_threadpool(next, batches, None)
+            if parsed is None:
+                break
+
+            batch, rejected = parsed
+            failures = await AsyncOnboarding.import_batch([fields for _, fields in batch], self.journal) if batch else {}
+            report = rejected + batch_report(batch, failures)
+            imported += len(batch) - len(failures)
+            failed += len(report)
+            for entry in sorted(report, key=lambda entry: entry["row"]):
+                yield entry
+
+        yield {"imported": imported, "failed": failed}
+
+
+    async def import_file(self, file, import_format: str="ndjson", max_errors: int=IMPORT_MAX_REPORTED_ERRORS) -> dict:
+        summary = {"imported": 0, "failed": 0, "errors": []}
+        async for entry in self.iter_import(codecs.iterdecode(file, "utf-8-sig"), import_format):
+            record_report_entry(summary, entry, max_errors)
+
+        return summary
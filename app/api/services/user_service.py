@@ -1,4 +1,4 @@
-from app.models.user import User
+from app.models.user import User, AsyncUser
 from app.schemas.user_schemas import *
 
 
@@ -34,4 +34,34 @@ class UserService:
             raise FileNotFoundError()
 
         return UserData(**user.__dict__)
-        
\ No newline at end of file
+
+
+class AsyncUserService(UserService):
+    async def create_user(self, user_data: UserData) -> None:
+        user = AsyncUser(**user_data.to_dict())
+        await user.create()
+
+
+    async def update_user(self, update_data: UserUpdate) -> None:
+        user = await AsyncUser.find_by_document(update_data.document_id)
+
+        update_data = {key:value for key, value in update_data.to_dict().items() if value is not None}
+        await user.update(update_data)
+
+
+    async def delete_user(self, user_data: UserData) -> None:
+        user = await AsyncUser.find_by_document(user_data.document_id)
+
+        for key,value in user.__dict__.items():
+            if value != user_data.__dict__[key]:
+                raise Exception("Couldn't verify client data")
+
+        await user.delete()
+
+
+    async def get_user_info(self, document_id: str) -> UserData:
+        user = await AsyncUser.find_by_document(document_id)
+        if not user:
+            raise FileNotFoundError()
+
+        return UserData(**user.__dict__)
@@ -0,0 +1,129 @@
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from app.database.mongodb import MongoClientManager, ensure_indexes
+from app.models.account import (account_projection, bucket_day, history_append_operation, history_pipeline,
+                                statement_later_net_pipeline, shard_total_pipeline)
+from app.models.ledger import heads_pipeline, replay_pipeline
+from app.models.user import USER_EXISTS_PROJECTION
+
+# Queries the index alone must answer: a FETCH in their plan is a regression
+COVERED_QUERIES = {"User.exists", "Account.exists", "Account.find_by_document_id(ids)"}
+
+
+def model_queries() -> list:
+    # One entry per query shape the models send; values are placeholders,
+    # only the shape matters to the planner.
+    now = datetime.now().replace(microsecond=0)
+    after = {"day": bucket_day(now), "bucket": ObjectId(), "position": 0}
+    transaction_data = {"timestamp": now, "type": "deposit", "value": 0, "counterpart": None}
+    history_filter, history_update = history_append_operation("", transaction_data)
+
+    return [
+        ("User.find_by_document",
+         {"find": "users", "filter": {"document_id": ""}}),
+        ("User.exists",
+         {"find": "users", "filter": {"document_id": ""}, "projection": USER_EXISTS_PROJECTION, "limit": 1}),
+        ("User.find_by_name",
+         {"find": "users", "filter": {"firstname": "", "lastname": ""}}),
+        ("Account.find_by_account_id",
+         {"find": "accounts", "filter": {"account_id": ""}}),
+        ("Account.find_by_document_id",
+         {"find": "accounts", "filter": {"user_document": ""}}),
+        ("Account.find_by_document_id(ids)",
+         {"find": "accounts", "filter": {"user_document": ""}, "projection": account_projection(()), "limit": 1}),
+        ("Account.exists",
+         {"find": "accounts", "filter": {"user_document": ""}, "projection": {"_id": 0, "user_document": 1},
+          "limit": 1}),
+        ("Account.atomic_withdraw",
+         {"findAndModify": "accounts",
+          "query": {"user_document": "", "is_frozen": False, "balance": {"$gte": 0}},
+          "update": {"$inc": {"balance": 0}}}),
+        ("Account.count_transactions_on",
+         {"find": "accounts", "filter": {"user_document": ""}, "projection": {"_id": 0, "daily_transactions": 1}}),
+        ("Account.add_transaction",
+         {"update": "transactions_history",
+          "updates": [{"q": history_filter, "u": history_update, "upsert": True}]}),
+        ("Account.get_transaction_history",
+         {"aggregate": "transactions_history",
+          "pipeline": history_pipeline("", now - timedelta(days=30), now), "cursor": {}}),
+        ("Account.get_transaction_history_page",
+         {"aggregate": "transactions_history",
+          "pipeline": history_pipeline("", after=after, limit=100), "cursor": {}}),
+        ("Account.get_statement",
+         {"aggregate": "statements", "pipeline": statement_later_net_pipeline("", "2024-01"), "cursor": {}}),
+        ("Account.shard_total",
+         {"aggregate": "balance_shards", "pipeline": shard_total_pipeline(""), "cursor": {}}),
+        ("Account.set_hot_shards",
+         {"find": "balance_shards", "filter": {"account_id": "", "shard": {"$gte": 0}}}),
+        ("Ledger.head",
+         {"find": "ledger", "filter": {"account_id": ""}, "sort": {"seq": -1}, "limit": 1}),
+        ("Ledger.heads",
+         {"aggregate": "ledger", "pipeline": heads_pipeline(["", ""]), "cursor": {}}),
+        ("Ledger.replay",
+         {"aggregate": "ledger", "pipeline": replay_pipeline({"": {"seq": 0}}), "cursor": {}}),
+        ("AccountService.apply_batch",
+         {"find": "accounts", "filter": {"user_document": {"$in": ["", ""]}}})
+    ]
+
+
+def winning_plan_stages(explain: dict) -> set:
+    stages = set()
+
+    def walk(node, in_winning_plan: bool):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == "rejectedPlans":
+                    continue
+                if key == "stage" and in_winning_plan:
+                    stages.add(value)
+                walk(value, in_winning_plan or key == "winningPlan")
+        elif isinstance(node, list):
+            for item in node:
+                walk(item, in_winning_plan)
+
+    walk(explain, False)
+    return stages
+
+
+def verify_query_plans(db) -> list:
+    failures = []
+    for name, command in model_queries():
+        stages = winning_plan_stages(db.command("explain", command, verbosity="queryPlanner"))
+        if "COLLSCAN" in stages:
+            failures.append({"query": name, "problem": "COLLSCAN", "stages": sorted(stages)})
+        elif "SORT" in stages:
+            # An in-memory sort reads every match before the first result comes back
+            failures.append({"query": name, "problem": "SORT", "stages": sorted(stages)})
+        elif name in COVERED_QUERIES and "FETCH" in stages:
+            failures.append({"query": name, "problem": "FETCH", "stages": sorted(stages)})
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the declared indexes of the bank database.")
+    parser.add_argument("command", choices=["ensure", "verify"])
+    parser.add_argument("--database", default=None)
+    args = parser.parse_args()
+
+    db = MongoClientManager.get_database(args.database) if args.database else MongoClientManager.get_database()
+    if args.command == "ensure":
+        for collection, names in ensure_indexes(db).items():
+            print(f"{collection}: {', '.join(names)}")
+        return
+
+    failures = verify_query_plans(db)
+    for failure in failures:
+        print(f"{failure['problem']} in {failure['query']}: {', '.join(failure['stages'])}")
+    if failures:
+        sys.exit(1)
+
+    print("All model queries use an index without sorting in memory, covered ones without fetching")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from app.database.mongodb import MongoClientManager
+from app.models.ledger import Ledger
+from utils.static_vars import LEDGER_REBUILD_BATCH_SIZE, LEDGER_REBUILD_WORKERS
+
+
+def account_id_batches(db, batch_size: int=LEDGER_REBUILD_BATCH_SIZE):
+    batch = []
+    for account in db.accounts.find({}, {"_id": 0, "account_id": 1}).sort("account_id", 1):
+        batch.append(account["account_id"])
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def run_partitioned(db, task, workers: int=LEDGER_REBUILD_WORKERS, batch_size: int=LEDGER_REBUILD_BATCH_SIZE) -> list:
+    # Accounts are independent, so batches replay concurrently; each one is a
+    # couple of aggregations, and pymongo releases the GIL while it waits.
+    Ledger.set_database(db)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(task, account_id_batches(db, batch_size)))
+
+
+def compact_ledger(db, workers: int=LEDGER_REBUILD_WORKERS, batch_size: int=LEDGER_REBUILD_BATCH_SIZE) -> dict:
+    """Write a new snapshot for every account with entries since its last one and prune what it covers."""
+    summary = {"snapshots": 0, "pruned": 0, "drifted": []}
+    for result in run_partitioned(db, Ledger.compact, workers, batch_size):
+        summary["snapshots"] += result["snapshots"]
+        summary["pruned"] += result["pruned"]
+        summary["drifted"] += result["drifted"]
+
+    return summary
+
+
+def rebuild_balances(db, workers: int=LEDGER_REBUILD_WORKERS, batch_size: int=LEDGER_REBUILD_BATCH_SIZE) -> int:
+    """Reset every ``accounts.balance`` from the ledger; returns the number corrected."""
+    return sum(run_partitioned(db, Ledger.rebuild, workers, batch_size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact the ledger or rebuild balances from it.")
+    parser.add_argument("command", choices=["compact", "rebuild"])
+    parser.add_argument("--database", default=None)
+    parser.add_argument("--workers", type=int, default=LEDGER_REBUILD_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=LEDGER_REBUILD_BATCH_SIZE)
+    args = parser.parse_args()
+
+    db = MongoClientManager.get_database(args.database) if args.database else MongoClientManager.get_database()
+    if args.command == "compact":
+        summary = compact_ledger(db, args.workers, args.batch_size)
+        print(f"{summary['snapshots']} snapshots written, {summary['pruned']} entries pruned")
+        for account_id in summary["drifted"]:
+            print(f"DRIFT {account_id}: replayed balance disagrees with the newest entry")
+        return
+
+    print(f"{rebuild_balances(db, args.workers, args.batch_size)} balances corrected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import argparse
+from datetime import datetime
+from itertools import groupby
+
+from bson import Int64
+from pymongo import ReplaceOne
+
+from app.database.mongodb import MongoClientManager, create_accounts_indexes, create_transactions_history_indexes
+from app.models.account import bucket_day, STATEMENT_SIGNS, statement_id
+from utils.money import MINOR_UNITS
+from utils.static_vars import HISTORY_BUCKET_SIZE
+
+LEGACY_AMOUNT_TYPES = ["double", "int", "decimal"]
+
+
+def bucket_transactions_history(db, bucket_size: int=HISTORY_BUCKET_SIZE) -> int:
+    """Split legacy one-document-per-account histories into day buckets.
+
+    Only documents without a ``day`` field are touched, so the migration can be
+    re-run safely. Returns the number of legacy documents converted.
+    """
+    if "account_id_1" in db.transactions_history.index_information():
+        db.transactions_history.drop_index("account_id_1")
+
+    migrated = 0
+    for legacy in db.transactions_history.find({"day": {"$exists": False}}):
+        transactions = sorted(legacy.get("transactions", []), key=lambda t: t["timestamp"])
+        buckets = []
+        for day, entries in groupby(transactions, key=lambda t: bucket_day(t["timestamp"])):
+            entries = list(entries)
+            for i in range(0, len(entries), bucket_size):
+                chunk = entries[i:i + bucket_size]
+                buckets.append({
+                    "migrated_from": legacy["_id"],
+                    "account_id": legacy["account_id"],
+                    "day": day,
+                    "count": len(chunk),
+                    "transactions": chunk
+                })
+
+        # Drop buckets left behind by an interrupted run before re-inserting
+        db.transactions_history.delete_many({"migrated_from": legacy["_id"]})
+        if buckets:
+            db.transactions_history.insert_many(buckets)
+        db.transactions_history.delete_one({"_id": legacy["_id"]})
+        migrated += 1
+
+    create_transactions_history_indexes(db)
+    return migrated
+
+
+def minor_unit_amounts(db, minor_units: int=MINOR_UNITS) -> int:
+    """Rewrite major-unit balances and transaction values as int64 minor units.
+
+    The models only write Int64 amounts, so any other numeric type is a legacy
+    major-unit value; converted amounts are skipped and the migration can be
+    re-run safely. Run it after ``bucket-history``. Returns the number of
+    documents rewritten.
+    """
+    def to_long(field: str) -> dict:
+        return {"$toLong": {"$round": [{"$multiply": [field, minor_units]}, 0]}}
+
+    accounts = db.accounts.update_many({"balance": {"$type": LEGACY_AMOUNT_TYPES}},
+                                       [{"$set": {"balance": to_long("$balance")}}])
+    history = db.transactions_history.update_many(
+        {"transactions.value": {"$type": LEGACY_AMOUNT_TYPES}},
+        [{"$set": {"transactions": {"$map": {
+            "input": "$transactions",
+            "as": "entry",
+            "in": {"$cond": [{"$in": [{"$type": "$$entry.value"}, LEGACY_AMOUNT_TYPES]},
+                             {"$mergeObjects": ["$$entry", {"value": to_long("$$entry.value")}]},
+                             "$$entry"]}
+        }}}}]
+    )
+
+    return accounts.modified_count + history.modified_count
+
+
+def backfill_statements(db) -> int:
+    """Rebuild the monthly statements from the bucketed transaction history.
+
+    Totals are summed server-side per account, month and type; balances are
+    derived from the nets when a statement is read. Run it after
+    ``minor-units`` and while writes are paused. Returns the number of
+    statements written.
+    """
+    pipeline = [
+        {"$unwind": "$transactions"},
+        {"$group": {"_id": {"account_id": "$account_id",
+                            "month": {"$dateToString": {"format": "%Y-%m", "date": "$transactions.timestamp"}},
+                            "type": "$transactions.type"},
+                    "total": {"$sum": "$transactions.value"},
+                    "count": {"$sum": 1}}},
+        {"$sort": {"_id.account_id": 1, "_id.month": -1}}
+    ]
+
+    months = {}
+    for row in db.transactions_history.aggregate(pipeline, allowDiskUse=True):
+        key = (row["_id"]["account_id"], row["_id"]["month"])
+        statement = months.setdefault(key, {"totals": {}, "counts": {}, "net": 0})
+        statement["totals"][row["_id"]["type"]] = Int64(row["total"])
+        statement["counts"][row["_id"]["type"]] = row["count"]
+        statement["net"] += STATEMENT_SIGNS.get(row["_id"]["type"], 0) * row["total"]
+
+    written = 0
+    for account_id, account_months in groupby(months.items(), key=lambda item: item[0][0]):
+        operations = [ReplaceOne({"_id": statement_id(account_id, month)}, {
+            "account_id": account_id,
+            "month": month,
+            "totals": statement["totals"],
+            "counts": statement["counts"],
+            "net": Int64(statement["net"])
+        }, upsert=True) for (_, month), statement in account_months]
+
+        db.statements.bulk_write(operations, ordered=False)
+        written += len(operations)
+
+    return written
+
+
+def open_ledger_snapshots(db) -> int:
+    """Give every account an opening ledger snapshot of its current balance.
+
+    Run it before turning on ``LEDGER_BALANCES``. Existing snapshots are kept,
+    so the migration can be re-run safely. Returns the number of snapshots
+    created.
+    """
+    before = db.ledger_snapshots.count_documents({"seq": 0})
+    db.accounts.aggregate([
+        {"$project": {"_id": {"$concat": ["$account_id", ":0"]},
+                      "account_id": 1,
+                      "seq": {"$literal": 0},
+                      "balance": {"$toLong": {"$ifNull": ["$balance", 0]}},
+                      "created_at": {"$literal": datetime.now().replace(microsecond=0)}}},
+        {"$merge": {"into": "ledger_snapshots", "on": "_id",
+                    "whenMatched": "keepExisting", "whenNotMatched": "insert"}}
+    ])
+
+    return db.ledger_snapshots.count_documents({"seq": 0}) - before
+
+
+def covering_account_indexes(db) -> int:
+    """Build the (user_document, account_id) index and drop the one it supersedes.
+
+    Returns the number of indexes dropped, so a re-run reports 0.
+    """
+    create_accounts_indexes(db)
+    if "user_document_1" not in db.accounts.index_information():
+        return 0
+
+    db.accounts.drop_index("user_document_1")
+    return 1
+
+
+def history_sort_index(db) -> int:
+    """Build the (account_id, day, _id) history index and drop the (account_id, day) one it extends."""
+    create_transactions_history_indexes(db)
+    if "account_id_1_day_1" not in db.transactions_history.index_information():
+        return 0
+
+    db.transactions_history.drop_index("account_id_1_day_1")
+    return 1
+
+
+MIGRATIONS = {
+    "bucket-history": bucket_transactions_history,
+    "minor-units": minor_unit_amounts,
+    "backfill-statements": backfill_statements,
+    "ledger-snapshots": open_ledger_snapshots,
+    "covering-indexes": covering_account_indexes,
+    "history-sort-index": history_sort_index
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a data migration against the bank database.")
+    parser.add_argument("migration", choices=sorted(MIGRATIONS))
+    parser.add_argument("--database", default=None)
+    args = parser.parse_args()
+
+    db = MongoClientManager.get_database(args.database) if args.database else MongoClientManager.get_database()
+    print(f"{args.migration}: {MIGRATIONS[args.migration](db)} documents migrated")
+
+
+if __name__ == "__main__":
+    main()
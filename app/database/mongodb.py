@@ -1,14 +1,259 @@
-from pymongo import MongoClient, ASCENDING
+import os
+import threading
+import time
+
+from pymongo import MongoClient, ASCENDING, IndexModel, monitoring
+
+from utils.static_vars import (MONGODB_PATH, MONGODB_DATABASE, MONGODB_MAX_POOL_SIZE,
+                               MONGODB_MIN_POOL_SIZE, MONGODB_MAX_IDLE_TIME_MS,
+                               MONGODB_WAIT_QUEUE_TIMEOUT_MS, MONGODB_CONNECT_TIMEOUT_MS,
+                               MONGODB_SERVER_SELECTION_TIMEOUT_MS, IDEMPOTENCY_TTL_SECONDS)
+from utils.metrics import MONGO_COMMAND_LATENCY
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:
+    AsyncIOMotorClient = None
+
+
+INDEXES = {
+    "users": [
+        IndexModel([("document_id", ASCENDING)], unique=True),
+        IndexModel([("phone", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel([("firstname", ASCENDING), ("lastname", ASCENDING)])
+    ],
+    "accounts": [
+        IndexModel([("account_id", ASCENDING)], unique=True),
+        # Lookups by document that only need the ids never read the document
+        IndexModel([("user_document", ASCENDING), ("account_id", ASCENDING)])
+    ],
+    "transactions_history": [
+        # History reads walk buckets in (day, _id) order straight off the index, without a blocking sort
+        IndexModel([("account_id", ASCENDING), ("day", ASCENDING), ("_id", ASCENDING)])
+    ],
+    "balance_shards": [
+        IndexModel([("account_id", ASCENDING), ("shard", ASCENDING)])
+    ],
+    "ledger": [
+        IndexModel([("account_id", ASCENDING), ("seq", ASCENDING)], unique=True)
+    ],
+    "ledger_snapshots": [
+        IndexModel([("account_id", ASCENDING), ("seq", ASCENDING)])
+    ],
+    "idempotency_keys": [
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS)
+    ]
+}
+
 
 def create_users_indexes(db):
-    db.users.create_index([("document_id", ASCENDING)], unique=True)
-    db.users.create_index([("phone", ASCENDING)], unique=True)
-    db.users.create_index([("email", ASCENDING)], unique=True)
+    db.users.create_indexes(INDEXES["users"])
 
 
 def create_accounts_indexes(db):
-    db.accounts.create_index([("account_id", ASCENDING)], unique=True)
+    db.accounts.create_indexes(INDEXES["accounts"])
     
 
 def create_transactions_history_indexes(db):
-    db.transactions_history.create_index([("account_id", ASCENDING)], unique=True)
+    db.transactions_history.create_indexes(INDEXES["transactions_history"])
+
+
+def ensure_indexes(db) -> dict:
+    return {collection: db[collection].create_indexes(indexes) for collection, indexes in INDEXES.items()}
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Collects connection pool counters for every client it is attached to."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections_open = 0
+            self.checked_out = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.wait_queue_timeouts = 0
+            self.wait_time_total_ms = 0.0
+            self.wait_time_max_ms = 0.0
+            self.pool_clears = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "connections_open": self.connections_open,
+                "checked_out": self.checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "wait_queue_timeouts": self.wait_queue_timeouts,
+                "wait_time_total_ms": round(self.wait_time_total_ms, 3),
+                "wait_time_avg_ms": round(self.wait_time_total_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_time_max_ms": round(self.wait_time_max_ms, 3),
+                "pool_clears": self.pool_clears
+            }
+
+    def _wait_ms(self) -> float:
+        started = getattr(self._local, "checkout_started", None)
+        self._local.checkout_started = None
+        return (time.perf_counter() - started) * 1000 if started else 0.0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_open -= 1
+
+    def connection_check_out_started(self, event):
+        self._local.checkout_started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        wait_ms = self._wait_ms()
+        with self._lock:
+            self.checkout_failures += 1
+            self.wait_time_total_ms += wait_ms
+            if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+                self.wait_queue_timeouts += 1
+
+    def connection_checked_out(self, event):
+        wait_ms = self._wait_ms()
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.wait_time_total_ms += wait_ms
+            self.wait_time_max_ms = max(self.wait_time_max_ms, wait_ms)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Feeds driver-reported command durations into the Mongo latency histogram."""
+
+    # Commands whose first field is not the collection name.
+    COLLECTION_FIELDS = {"getMore": "collection"}
+
+    def __init__(self, histogram=MONGO_COMMAND_LATENCY):
+        self.histogram = histogram
+        self._collections = {}
+
+    def started(self, event):
+        name = event.command_name
+        collection = event.command.get(self.COLLECTION_FIELDS.get(name, name))
+        self._collections[(event.connection_id, event.request_id)] = (
+            collection if isinstance(collection, str) else ""
+        )
+
+    def _observe(self, event, outcome: str):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        self.histogram.observe((event.command_name, collection, outcome), event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._observe(event, "success")
+
+    def failed(self, event):
+        self._observe(event, "failure")
+
+
+class MongoClientManager:
+    """Owns the single application-wide Mongo client and its connection pool.
+
+    When motor is installed the pymongo client is the one wrapped by the motor
+    client, so sync models and async models share one pool.
+    """
+    _client = None
+    _async_client = None
+    pool_listener = PoolStatsListener()
+    command_listener = CommandMetricsListener()
+
+    @classmethod
+    def client_options(cls) -> dict:
+        return {
+            "maxPoolSize": MONGODB_MAX_POOL_SIZE,
+            "minPoolSize": MONGODB_MIN_POOL_SIZE,
+            "maxIdleTimeMS": MONGODB_MAX_IDLE_TIME_MS,
+            "waitQueueTimeoutMS": MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+            "connectTimeoutMS": MONGODB_CONNECT_TIMEOUT_MS,
+            "serverSelectionTimeoutMS": MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+            "event_listeners": [cls.pool_listener, cls.command_listener]
+        }
+
+    @classmethod
+    def get_client(cls) -> MongoClient:
+        if cls._client is None:
+            if AsyncIOMotorClient is not None:
+                cls._client = cls.get_async_client().delegate
+            else:
+                cls._client = MongoClient(MONGODB_PATH, **cls.client_options())
+
+        return cls._client
+
+    @classmethod
+    def get_async_client(cls):
+        if AsyncIOMotorClient is None:
+            raise RuntimeError("motor is not installed")
+
+        if cls._async_client is None:
+            cls._async_client = AsyncIOMotorClient(MONGODB_PATH, **cls.client_options())
+
+        return cls._async_client
+
+    @classmethod
+    def get_database(cls, name: str=MONGODB_DATABASE):
+        return cls.get_client()[name]
+
+    @classmethod
+    def get_async_database(cls, name: str=MONGODB_DATABASE):
+        return cls.get_async_client()[name]
+
+    @classmethod
+    def pool_stats(cls) -> dict:
+        return {
+            "max_pool_size": MONGODB_MAX_POOL_SIZE,
+            "wait_queue_timeout_ms": MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+            **cls.pool_listener.stats()
+        }
+
+    @classmethod
+    def close(cls) -> None:
+        if cls._async_client is not None:
+            cls._async_client.close()
+        elif cls._client is not None:
+            cls._client.close()
+
+        cls._client = None
+        cls._async_client = None
+
+    @classmethod
+    def forget(cls) -> None:
+        # A forked child must not touch its parent's sockets: drop the inherited
+        # clients without closing them, so the parent keeps its pool.
+        cls._client = None
+        cls._async_client = None
+        cls.pool_listener.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=MongoClientManager.forget)
@@ -0,0 +1,39 @@
+import argparse
+import json
+import sys
+
+from app.api.services.onboarding_service import IMPORT_FORMATS, OnboardingService
+from app.database.mongodb import MongoClientManager
+from app.models.onboarding import Onboarding
+from utils.static_vars import IMPORT_BATCH_SIZE, LEDGER_BALANCES
+
+
+def import_format_for(path: str, import_format: str=None) -> str:
+    if import_format:
+        return import_format
+
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import users and their accounts from an NDJSON or CSV file.")
+    parser.add_argument("path", help="file to import, or - for stdin")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, default=None,
+                        help="defaults to csv for .csv files, ndjson otherwise")
+    parser.add_argument("--database", default=None)
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    db = MongoClientManager.get_database(args.database) if args.database else MongoClientManager.get_database()
+    Onboarding.set_database(db)
+    service = OnboardingService(db, journal=LEDGER_BALANCES)
+
+    # The report is one JSON line per rejected row, then the totals
+    source = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8-sig")
+    with source:
+        for entry in service.iter_import(source, import_format_for(args.path, args.format), args.batch_size):
+            print(json.dumps(entry))
+
+
+if __name__ == "__main__":
+    main()
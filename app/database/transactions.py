@@ -0,0 +1,137 @@
+import asyncio
+import random
+import threading
+import time
+from pymongo.errors import PyMongoError
+
+from utils.static_vars import TRANSACTION_MAX_ATTEMPTS, TRANSACTION_BACKOFF_MS, TRANSACTION_BACKOFF_MAX_MS
+
+TRANSIENT_ERROR = "TransientTransactionError"
+UNKNOWN_COMMIT_RESULT = "UnknownTransactionCommitResult"
+
+
+class TransactionStats:
+    """Counts commits, refusals and retried attempts across every transaction run."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.commits = 0
+            self.refusals = 0
+            self.transient_retries = 0
+            self.commit_retries = 0
+            self.failures = 0
+
+    def record(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"commits": self.commits, "refusals": self.refusals, "transient_retries": self.transient_retries,
+                    "commit_retries": self.commit_retries, "failures": self.failures}
+
+
+TRANSACTION_STATS = TransactionStats()
+
+
+def backoff_delay(attempt: int) -> float:
+    # Full jitter, so writers that collided don't collide again in lockstep
+    ceiling = min(TRANSACTION_BACKOFF_MAX_MS, TRANSACTION_BACKOFF_MS * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling) / 1000
+
+
+def mark_transient(error: PyMongoError) -> PyMongoError:
+    # For conflicts the server reports as a plain error, such as two transactions
+    # inserting the same unique key, which are as safe to retry as a write conflict
+    error._add_error_label(TRANSIENT_ERROR)
+    return error
+
+
+def retryable(error: PyMongoError, label: str, attempt: int, max_attempts: int) -> bool:
+    return error.has_error_label(label) and attempt < max_attempts
+
+
+def run_in_transaction(client, callback, max_attempts: int=TRANSACTION_MAX_ATTEMPTS):
+    """Run ``callback(session)`` in a transaction on ``client`` and return its result.
+
+    The whole transaction is retried with backoff on TransientTransactionError
+    (write conflicts, elections), the commit alone on
+    UnknownTransactionCommitResult. A callback returning ``None`` aborts.
+    """
+    with client.start_session() as session:
+        for attempt in range(1, max_attempts + 1):
+            try:
+                session.start_transaction()
+                result = callback(session)
+                if result is None:
+                    session.abort_transaction()
+                    TRANSACTION_STATS.record("refusals")
+                    return None
+
+                commit_with_retry(session, max_attempts)
+                TRANSACTION_STATS.record("commits")
+                return result
+            except PyMongoError as e:
+                if session.in_transaction:
+                    session.abort_transaction()
+                if not retryable(e, TRANSIENT_ERROR, attempt, max_attempts):
+                    TRANSACTION_STATS.record("failures")
+                    raise
+
+                TRANSACTION_STATS.record("transient_retries")
+                time.sleep(backoff_delay(attempt))
+
+
+def commit_with_retry(session, max_attempts: int=TRANSACTION_MAX_ATTEMPTS) -> None:
+    for attempt in range(1, max_attempts + 1):
+        try:
+            session.commit_transaction()
+            return
+        except PyMongoError as e:
+            if not retryable(e, UNKNOWN_COMMIT_RESULT, attempt, max_attempts):
+                raise
+
+            TRANSACTION_STATS.record("commit_retries")
+            time.sleep(backoff_delay(attempt))
+
+
+async def async_run_in_transaction(client, callback, max_attempts: int=TRANSACTION_MAX_ATTEMPTS):
+    async with await client.start_session() as session:
+        for attempt in range(1, max_attempts + 1):
+            try:
+                session.start_transaction()
+                result = await callback(session)
+                if result is None:
+                    await session.abort_transaction()
+                    TRANSACTION_STATS.record("refusals")
+                    return None
+
+                await async_commit_with_retry(session, max_attempts)
+                TRANSACTION_STATS.record("commits")
+                return result
+            except PyMongoError as e:
+                if session.in_transaction:
+                    await session.abort_transaction()
+                if not retryable(e, TRANSIENT_ERROR, attempt, max_attempts):
+                    TRANSACTION_STATS.record("failures")
+                    raise
+
+                TRANSACTION_STATS.record("transient_retries")
+                await asyncio.sleep(backoff_delay(attempt))
+
+
+async def async_commit_with_retry(session, max_attempts: int=TRANSACTION_MAX_ATTEMPTS) -> None:
+    for attempt in range(1, max_attempts + 1):
+        try:
+            await session.commit_transaction()
+            return
+        except PyMongoError as e:
+            if not retryable(e, UNKNOWN_COMMIT_RESULT, attempt, max_attempts):
+                raise
+
+            TRANSACTION_STATS.record("commit_retries")
+            await asyncio.sleep(backoff_delay(attempt))
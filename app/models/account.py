@@ -1,14 +1,291 @@
-from pymongo import MongoClient
+import json
+import random
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from bson import ObjectId, Int64
+from bson.errors import InvalidId
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
-from decimal import Decimal
 from typing import List
 
-from app.models.user import User
+from app.database.transactions import run_in_transaction, async_run_in_transaction
+from app.models.user import User, AsyncUser
 from utils.AccountIdGenerator import AccountIdGenerator
-from utils.static_vars import MONGODB_PATH
+from utils.cache import TTLCache
+from utils.static_vars import (HISTORY_BUCKET_SIZE, HISTORY_EXPORT_BATCH_SIZE, BALANCE_CACHE_SIZE,
+                               BALANCE_CACHE_TTL_SECONDS)
+
+
+def bucket_day(timestamp: datetime) -> datetime:
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def history_append_operation(account_id: str, transaction_data: dict):
+    # Appends go to the open bucket of the transaction's day; a full bucket
+    # no longer matches the filter, so the upsert starts a new one.
+    return ({"account_id": account_id,
+             "day": bucket_day(transaction_data["timestamp"]),
+             "count": {"$lt": HISTORY_BUCKET_SIZE}},
+            {"$push": {"transactions": transaction_data},
+             "$inc": {"count": 1}})
+
+
+def history_bucket_document(account_id: str, timestamp: datetime) -> dict:
+    # An open, empty bucket; the day's first append fills it instead of upserting
+    return {"account_id": account_id, "day": bucket_day(timestamp), "transactions": [], "count": 0}
+
+
+def history_bucket_query(account_id: str, start_date: datetime=None, end_date: datetime=None) -> dict:
+    query = {"account_id": account_id}
+    day_range = {}
+    if start_date:
+        day_range["$gte"] = bucket_day(start_date)
+    if end_date:
+        day_range["$lte"] = bucket_day(end_date)
+    if day_range:
+        query["day"] = day_range
+
+    return query
+
+
+def history_pipeline(account_id: str, start_date: datetime=None, end_date: datetime=None,
+                     after: dict=None, limit: int=None, timestamp_format: str=None,
+                     value_scale: int=None) -> list:
+    # Buckets are walked in (day, _id) order and unwound in array order, which
+    # gives every entry a stable (day, bucket, position) key for keyset paging.
+    bucket_query = history_bucket_query(account_id, start_date, end_date)
+    entry_query = {}
+    if start_date or end_date:
+        entry_query["transactions.timestamp"] = {}
+        if start_date:
+            entry_query["transactions.timestamp"]["$gte"] = start_date
+        if end_date:
+            entry_query["transactions.timestamp"]["$lte"] = end_date
+
+    if after:
+        # The day bound keeps the scan on one index range; the $or only trims its first day
+        day_range = bucket_query.setdefault("day", {})
+        day_range["$gte"] = max(day_range.get("$gte", after["day"]), after["day"])
+        bucket_query["$or"] = [{"day": {"$gt": after["day"]}},
+                               {"day": after["day"], "_id": {"$gte": after["bucket"]}}]
+        entry_query["$or"] = [{"_id": {"$ne": after["bucket"]}},
+                              {"position": {"$gt": after["position"]}}]
+
+    entry = "$transactions"
+    formatted = {}
+    if timestamp_format:
+        formatted["timestamp"] = {"$dateToString": {"format": timestamp_format, "date": "$transactions.timestamp"}}
+    if value_scale:
+        formatted["value"] = {"$divide": ["$transactions.value", value_scale]}
+    if formatted:
+        entry = {"$mergeObjects": ["$transactions", formatted]}
+    if after is not None or limit:
+        entry = {"$mergeObjects": [entry, {"_bucket": "$_id", "_day": "$day", "_position": "$position"}]}
+
+    pipeline = [{"$match": bucket_query},
+                {"$sort": {"day": ASCENDING, "_id": ASCENDING}},
+                {"$unwind": {"path": "$transactions", "includeArrayIndex": "position"}}]
+    if entry_query:
+        pipeline.append({"$match": entry_query})
+    if limit:
+        pipeline.append({"$limit": limit})
+    pipeline.append({"$replaceWith": entry})
+
+    return pipeline
+
+
+def encode_history_token(entry: dict) -> str:
+    token = {"b": str(entry["_bucket"]), "d": entry["_day"].isoformat(), "p": entry["_position"]}
+    return urlsafe_b64encode(json.dumps(token).encode()).decode()
+
+
+def decode_history_token(token: str) -> dict:
+    try:
+        data = json.loads(urlsafe_b64decode(token.encode()))
+        return {"bucket": ObjectId(data["b"]), "day": datetime.fromisoformat(data["d"]),
+                "position": int(data["p"])}
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise ValueError("Invalid continuation token") from e
+
+
+def history_page(rows: list, page_size: int):
+    next_token = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_token = encode_history_token(rows[-1])
+
+    for row in rows:
+        del row["_bucket"], row["_day"], row["_position"]
+
+    return rows, next_token
+
+
+def day_key(timestamp: datetime) -> str:
+    return timestamp.strftime("%Y-%m-%d")
+
+
+def transaction_count_update(transaction_day: datetime=None, counts: dict=None) -> dict:
+    # Per-day counters live in a date-keyed map on the account, so they ride
+    # along with the balance change in the same single-document write.
+    counts = counts or ({day_key(transaction_day): 1} if transaction_day else {})
+    if not counts:
+        return {}
+
+    return {"$inc": {f"daily_transactions.{day}": count for day, count in counts.items()},
+            "$max": {"last_date_transaction": datetime.strptime(max(counts), "%Y-%m-%d")}}
+
+
+def balance_update(delta, transaction_day: datetime=None) -> dict:
+    update = transaction_count_update(transaction_day)
+    update.setdefault("$inc", {})["balance"] = Int64(delta)
+    return update
+
+
+def balance_set(balance, transaction_day: datetime=None) -> dict:
+    return {"$set": {"balance": Int64(balance)}, **transaction_count_update(transaction_day)}
+
+
+STATEMENT_SIGNS = {
+    "deposit": 1,
+    "withdraw": -1,
+    "transfer-in": 1,
+    "transfer-out": -1
+}
+
+
+def statement_month(timestamp: datetime) -> str:
+    return timestamp.strftime("%Y-%m")
+
+
+def statement_id(account_id: str, month: str) -> str:
+    return f"{account_id}:{month}"
+
+
+def statement_operation(account_id: str, transaction_data: dict):
+    # One summary per account and month. Totals and the net change are $inc'd,
+    # so entries may land in any order, back-dated ones included; balances are
+    # derived from the nets when the statement is read.
+    month = statement_month(transaction_data["timestamp"])
+    transaction_type = transaction_data["type"]
+    value = transaction_data["value"] or 0
+    signed = STATEMENT_SIGNS.get(transaction_type, 0) * value
+    return ({"_id": statement_id(account_id, month)},
+            {"$setOnInsert": {"account_id": account_id, "month": month},
+             "$inc": {f"totals.{transaction_type}": Int64(value), f"counts.{transaction_type}": 1,
+                      "net": Int64(signed)}})
+
+
+def statement_range_query(account_id: str, after: str="", before: str="~") -> dict:
+    # Statement ids share the account prefix, so neighbouring months are an _id range
+    return {"_id": {"$gt": statement_id(account_id, after), "$lt": statement_id(account_id, before)}}
+
+
+def statement_later_net_pipeline(account_id: str, month: str) -> list:
+    # The net change of every month after ``month``
+    return [{"$match": statement_range_query(account_id, after=month)},
+            {"$group": {"_id": None, "net": {"$sum": "$net"}}}]
+
+
+def statement_document(account_id: str, month: str, statement: dict=None, closing_balance: int=0) -> dict:
+    # The closing balance is the current balance less what the later months
+    # changed, so no stored opening balance can be fixed by an entry that
+    # arrived out of order. A month without entries opens where it closes.
+    statement = statement or {}
+    return {"account_id": account_id, "month": month,
+            "opening_balance": closing_balance - statement.get("net", 0), "closing_balance": closing_balance,
+            "totals": statement.get("totals", {}), "counts": statement.get("counts", {})}
+
+
+TRANSFER_PROJECTION = {"_id": 0, "balance": 1}
+
+
+def active_account_query(account_id: str) -> dict:
+    # Frozen accounts are left out of transfers, as of deposits and withdrawals
+    return {"account_id": account_id, "is_frozen": False}
+
+
+def transfer_debit_query(account_id: str, value) -> dict:
+    return {**active_account_query(account_id), "balance": {"$gte": value}}
+
+
+def balance_shard_id(account_id: str, shard: int) -> str:
+    return f"{account_id}:{shard}"
+
+
+def shard_credit_operation(account_id: str, shards: int, value):
+    # Credits land on a random sub-balance, so concurrent credits to a hot
+    # account only conflict when they pick the same shard. No upsert: a shard
+    # removed by set_hot_shards matches nothing and the credit goes to the account.
+    return ({"_id": balance_shard_id(account_id, random.randrange(shards))},
+            {"$inc": {"balance": Int64(value)}})
+
+
+def shard_total_pipeline(account_id: str) -> list:
+    return [{"$match": {"account_id": account_id}},
+            {"$group": {"_id": None, "balance": {"$sum": "$balance"}}}]
+
+
+def shard_drain_plan(balance, shards: List[dict], value):
+    # The account document is written by every debit anyway (daily counters),
+    # so it is drawn on first; then the largest shards, to touch as few as
+    # possible. Returns (account_take, [(shard_id, take)]), or None when short.
+    if balance + sum(shard["balance"] for shard in shards) < value:
+        return None
+
+    account_take = min(max(balance, 0), value)
+    remaining = value - account_take
+    takes = []
+    for shard in sorted(shards, key=lambda shard: shard["balance"], reverse=True):
+        if remaining <= 0:
+            break
+        take = min(shard["balance"], remaining)
+        if take > 0:
+            takes.append((shard["_id"], take))
+            remaining -= take
+
+    return account_take, takes
+
+
+def shard_debit_operations(takes: list) -> List[UpdateOne]:
+    return [UpdateOne({"_id": shard_id}, {"$inc": {"balance": Int64(-take)}}) for shard_id, take in takes]
+
+
+def shard_resize_operations(account_id: str, shards: int) -> List[UpdateOne]:
+    return [UpdateOne({"_id": balance_shard_id(account_id, shard)},
+                      {"$setOnInsert": {"account_id": account_id, "shard": shard, "balance": Int64(0)}},
+                      upsert=True)
+            for shard in range(shards)]
+
+
+def account_document(account_id: str, user_document: str, balance=0, is_frozen: bool=False,
+                     last_date_transaction: datetime=None) -> dict:
+    return {
+        "account_id": account_id,
+        "user_document": user_document,
+        "balance": Int64(balance),
+        "is_frozen": is_frozen,
+        "daily_transactions": {},
+        "last_date_transaction": last_date_transaction
+    }
+
+
+def account_projection(fields: tuple=None):
+    # Identity fields always come along; with no other fields the lookup is
+    # answered from the (user_document, account_id) index alone.
+    if fields is None:
+        return None
+
+    return {"_id": 0, "account_id": 1, "user_document": 1, **{field: 1 for field in fields}}
+
+
+ACCOUNT_FIELDS = ("account_id", "user_document", "balance", "is_frozen", "last_date_transaction", "balance_shards")
+
 
 class Account:
     _db = None
+    balance_cache = TTLCache(BALANCE_CACHE_SIZE, BALANCE_CACHE_TTL_SECONDS)
+    # Set to a started HistoryWriter to queue history appends instead of writing them inline
+    history_writer = None
 
     @classmethod
     def get_database(cls):
@@ -18,57 +295,72 @@ class Account:
     def set_database(cls, db):
         cls._db = db
 
-    def __init__(self, user_document: str, balance: Decimal=0, 
+    @classmethod
+    def from_document(cls, document: dict, shard_balance: int=0):
+        # Account documents also carry bookkeeping fields the model doesn't expose
+        fields = {key: document[key] for key in ACCOUNT_FIELDS if key in document}
+        fields["balance"] = fields.get("balance", 0) + shard_balance
+        fields["shard_balance"] = shard_balance
+        if isinstance(fields.get("last_date_transaction"), datetime):
+            daily_transactions = document.get("daily_transactions", {})
+            fields["last_date_transactions_count"] = daily_transactions.get(day_key(fields["last_date_transaction"]), 0)
+        else:
+            fields["last_date_transaction"] = None
+
+        return cls(**fields)
+
+    def __init__(self, user_document: str, balance: int=0, 
                  is_frozen: bool=False, account_id: str=None, 
                  last_date_transactions_count: int=0, 
-                 last_date_transaction: str=datetime.today().strftime("%d-%m-%Y")):
+                 last_date_transaction: datetime=None,
+                 balance_shards: int=0, shard_balance: int=0):
         
         self.account_id: str = account_id
         self.user_document: str = user_document
-        self.balance: float = balance
+        # For a hot account, balance includes the shard_balance held in
+        # its balance_shards sub-balance documents
+        self.balance: int = balance
+        self.balance_shards: int = balance_shards
+        self.shard_balance: int = shard_balance
         self.is_frozen: bool = is_frozen
         self.transaction_history: List[dict] = []
         self.last_date_transactions_count: int = last_date_transactions_count
-        self.last_date_transaction: str = last_date_transaction
+        self.last_date_transaction: datetime = last_date_transaction
 
 
     def create(self) -> int:
         User.set_database(self._db)
-        user = User.find_by_document(self.user_document)
-
-        if user is None:
+        if not User.exists(self.user_document):
             raise Exception("The client is not registered")
         
-        self.account_id = AccountIdGenerator.generate(self._db)
-
-        account_data = {
-            "account_id": self.account_id,
-            "user_document": self.user_document,
-            "balance": self.balance,
-            "is_frozen": self.is_frozen,
-            "last_date_transactions_count": self.last_date_transactions_count,
-            "last_date_transaction": self.last_date_transaction
-        }
+        for _ in range(5):
+            self.account_id = AccountIdGenerator.generate(self._db)
+
+            account_data = account_document(self.account_id, self.user_document, self.balance, self.is_frozen,
+                                            self.last_date_transaction)
 
-        with MongoClient(MONGODB_PATH).start_session() as session:
-            with session.start_transaction():
+            try:
                 inserted_id = self._db.accounts.insert_one(account_data).inserted_id
-                self._db.transactions_history.insert_one({
-                    "account_id": self.account_id,
-                    "transactions": self.transaction_history
-                })
+                break
+            except DuplicateKeyError:
+                # Only IDs left by the former random generator can clash
+                continue
+        else:
+            raise Exception("Failed to generate unique account id. Please try again.")
 
-                session.commit_transaction()
-        
+        self.balance_cache.invalidate(self.user_document)
         return inserted_id
     
 
     def delete(self) -> int:
-        if Decimal(self.balance) > 0:
+        if self.balance > 0:
             return 0
         
         print(self.account_id)
         delete_result = self._db.accounts.delete_one({"account_id": self.account_id})
+        if self.balance_shards:
+            self._db.balance_shards.delete_many({"account_id": self.account_id})
+        self.balance_cache.invalidate(self.user_document)
         return delete_result.deleted_count
 
 
@@ -76,101 +368,677 @@ class Account:
         self.is_frozen = True
         self._db.accounts.update_one({"account_id": self.account_id},
                                      {"$set": {"is_frozen": self.is_frozen}})
+        self.balance_cache.invalidate(self.user_document)
 
     
     def unfreeze(self) -> None:
         self.is_frozen = False
         self._db.accounts.update_one({"account_id": self.account_id},
                                      {"$set": {"is_frozen": self.is_frozen}})
+        self.balance_cache.invalidate(self.user_document)
         
     
-    def balance_check(self) -> float:
+    def balance_check(self) -> int:
+        # Includes the shards of a hot account, summed when it was loaded
         return self.balance
 
     
-    def deposit(self, value) -> None:
+    def deposit(self, value, transaction_day: datetime=None) -> None:
         self.balance += value
-        self._db.accounts.update_one({"account_id": self.account_id},
-                                     {"$set": {"balance": self.balance}})
+        if self.balance_shards:
+            # Writing back balance - shard_balance would erase credits landing on the shards since the load
+            self._db.accounts.update_one({"account_id": self.account_id}, balance_update(value, transaction_day))
+        else:
+            self._db.accounts.update_one({"account_id": self.account_id},
+                                         balance_set(self.balance - self.shard_balance, transaction_day))
+        self.balance_cache.invalidate(self.user_document)
 
 
-    def withdraw(self, value) -> None:
+    def withdraw(self, value, transaction_day: datetime=None) -> bool:
+        # False when the withdrawal was refused and nothing was written
         if value > self.balance:
-            return
+            return False
         
+        if self.balance_shards:
+            # The funds may sit in the shards, which only a drain can take from
+            balance = run_in_transaction(self._db.client,
+                                         lambda session: self._drain(value, transaction_day, session))
+            self.balance_cache.invalidate(self.user_document)
+            if balance is None:
+                return False
+
+            self.balance = balance
+            return True
+
         self.balance -= value
         self._db.accounts.update_one({"account_id": self.account_id},
-                                     {"$set": {"balance": self.balance}})
+                                     balance_set(self.balance - self.shard_balance, transaction_day))
+        self.balance_cache.invalidate(self.user_document)
+        return True
         
     
-    def transfer(self, to_account: str, value) -> None:
-        if value > self.balance:
-            return
-        
-        with MongoClient(MONGODB_PATH).start_session() as session:
-            with session.start_transaction():
-                recipient = Account.find_by_account_id(to_account)
-                self.balance -= value
-                recipient.balance += value
-
-                self._db.accounts.update_one({"account_id": self.account_id},
-                                             {"$set": {"balance": self.balance}})
-                
-                self._db.accounts.update_one({"account_id": recipient.account_id},
-                                             {"$set": {"balance": recipient.balance}})
-                
-                session.commit_transaction()
-
-
-    def add_transaction(self, transaction_type: str, value: float=None, counterpart: str=None, transaction_time: str=datetime.now().strftime("%Y-%m-%d %H:%M:%S")):
+    def transfer(self, recipient: "Account", value, transaction_day: datetime=None):
+        # Returns the credited recipient, or None when the transfer is refused.
+        # Both legs run on one session; the funds check is the debit's filter.
+        if value <= 0:
+            return None
+
+        def apply(session):
+            sender = self._debit(value, transaction_day, session)
+            if sender is None:
+                return None
+
+            credited = recipient._credit(value, session)
+            return (sender, credited) if credited is not None else None
+
+        applied = run_in_transaction(self._db.client, apply)
+        self.balance_cache.invalidate(self.user_document, recipient.user_document)
+        if applied is None:
+            return None
+
+        self.balance, recipient.balance = applied
+        return recipient
+
+
+    def _debit(self, value, transaction_day: datetime=None, session=None):
+        # New balance, or None when short of funds
+        if self.balance_shards:
+            return self._drain(value, transaction_day, session)
+
+        sender = self._db.accounts.find_one_and_update(transfer_debit_query(self.account_id, value),
+                                                       balance_update(-value, transaction_day),
+                                                       projection=TRANSFER_PROJECTION,
+                                                       return_document=ReturnDocument.AFTER,
+                                                       session=session)
+        return sender["balance"] if sender else None
+
+
+    def _credit(self, value, session=None):
+        if self.balance_shards:
+            credited = self._db.balance_shards.update_one(*shard_credit_operation(self.account_id,
+                                                                                  self.balance_shards, value),
+                                                          session=session)
+            if credited.matched_count:
+                account = self._db.accounts.find_one(active_account_query(self.account_id), TRANSFER_PROJECTION,
+                                                     session=session)
+                return account["balance"] + Account.shard_total(self.account_id, session) if account else None
+
+        credited = self._db.accounts.find_one_and_update(active_account_query(self.account_id),
+                                                         balance_update(value),
+                                                         projection=TRANSFER_PROJECTION,
+                                                         return_document=ReturnDocument.AFTER,
+                                                         session=session)
+        return credited["balance"] if credited else None
+
+
+    def _drain(self, value, transaction_day: datetime=None, session=None):
+        # Runs inside a transaction: the reads are its snapshot, and a credit
+        # landing on a shard this debit draws on is a write conflict, so one
+        # of the two is retried rather than either overdrawing.
+        account = self._db.accounts.find_one(active_account_query(self.account_id), TRANSFER_PROJECTION,
+                                             session=session)
+        if account is None:
+            return None
+
+        shards = list(self._db.balance_shards.find({"account_id": self.account_id, "balance": {"$gt": 0}},
+                                                   session=session))
+        plan = shard_drain_plan(account["balance"], shards, value)
+        if plan is None:
+            return None
+
+        account_take, takes = plan
+        if takes:
+            self._db.balance_shards.bulk_write(shard_debit_operations(takes), ordered=False, session=session)
+        self._db.accounts.update_one({"account_id": self.account_id},
+                                     balance_update(-account_take, transaction_day), session=session)
+        return account["balance"] + sum(shard["balance"] for shard in shards) - value
+
+
+    def set_hot_shards(self, shards: int) -> None:
+        """Spread credits over ``shards`` sub-balance documents; 0 turns hot mode off.
+
+        Shards at or above the new count are folded back into the account
+        document. Deleting a shard conflicts with any credit still landing on
+        it, so no credit is lost to a removed shard.
+        """
+        def apply(session):
+            removed = list(self._db.balance_shards.find({"account_id": self.account_id, "shard": {"$gte": shards}},
+                                                        session=session))
+            if removed:
+                self._db.balance_shards.delete_many({"_id": {"$in": [shard["_id"] for shard in removed]}},
+                                                    session=session)
+            if shards:
+                self._db.balance_shards.bulk_write(shard_resize_operations(self.account_id, shards),
+                                                   ordered=False, session=session)
+            self._db.accounts.update_one({"account_id": self.account_id},
+                                         {"$set": {"balance_shards": shards},
+                                          "$inc": {"balance": Int64(sum(shard["balance"] for shard in removed))}},
+                                         session=session)
+            return True
+
+        run_in_transaction(self._db.client, apply)
+        self.balance_shards = shards
+        self.balance_cache.invalidate(self.user_document)
+
+
+    def add_transaction(self, transaction_type: str, value: int=None, counterpart: str=None, transaction_time: str=None):
         transaction_data = {
-            "timestamp": datetime.strptime(transaction_time, "%Y-%m-%d %H:%M:%S"),
+            "timestamp": datetime.strptime(transaction_time, "%Y-%m-%d %H:%M:%S") if transaction_time else datetime.now().replace(microsecond=0),
             "type": transaction_type,
-            "value": value,
+            "value": Int64(value) if value is not None else None,
             "counterpart": counterpart
         }
 
         self.transaction_history.append(transaction_data)
-        self._db.transactions_history.update_one({"account_id": self.account_id},
-                                                  {"$push": {"transactions": transaction_data}},
-                                                  upsert=True)
+        history = history_append_operation(self.account_id, transaction_data)
+        statement = statement_operation(self.account_id, transaction_data)
+        if self.history_writer is not None:
+            self.history_writer.submit(UpdateOne(*history, upsert=True), UpdateOne(*statement, upsert=True))
+            return
+
+        self._db.transactions_history.update_one(*history, upsert=True)
+        self._db.statements.update_one(*statement, upsert=True)
 
 
-    def get_transaction_history(self):
-        transactions = self._db.transactions_history.find_one({"account_id": self.account_id})
-        return [t for t in transactions["transactions"]]
+    def get_transaction_history(self, start_date: datetime=None, end_date: datetime=None,
+                                timestamp_format: str=None, value_scale: int=None):
+        pipeline = history_pipeline(self.account_id, start_date, end_date, timestamp_format=timestamp_format,
+                                    value_scale=value_scale)
+        return list(self._db.transactions_history.aggregate(pipeline))
+
+
+    def get_transaction_history_page(self, page_size: int, continuation_token: str=None,
+                                     start_date: datetime=None, end_date: datetime=None,
+                                     timestamp_format: str=None, value_scale: int=None):
+        after = decode_history_token(continuation_token) if continuation_token else None
+        pipeline = history_pipeline(self.account_id, start_date, end_date, after=after,
+                                    limit=page_size + 1, timestamp_format=timestamp_format,
+                                    value_scale=value_scale)
+        return history_page(list(self._db.transactions_history.aggregate(pipeline)), page_size)
+
+
+    def get_statement(self, month: str) -> dict:
+        statement = self._db.statements.find_one({"_id": statement_id(self.account_id, month)})
+        later = list(self._db.statements.aggregate(statement_later_net_pipeline(self.account_id, month)))
+        return statement_document(self.account_id, month, statement,
+                                  self.balance - (later[0]["net"] if later else 0))
+
+
+    def iter_transaction_history(self, start_date: datetime=None, end_date: datetime=None,
+                                 timestamp_format: str=None, value_scale: int=None,
+                                 batch_size: int=HISTORY_EXPORT_BATCH_SIZE):
+        pipeline = history_pipeline(self.account_id, start_date, end_date, timestamp_format=timestamp_format,
+                                    value_scale=value_scale)
+        return self._db.transactions_history.aggregate(pipeline, batchSize=batch_size)
     
 
-    def update_transaction_count(self, transaction_datetime: str):
-        transaction_date = datetime.strptime(transaction_datetime, "%Y-%m-%d %H:%M:%S")
-        if self.last_date_transaction == transaction_date:
-            self.last_date_transactions_count += 1
-        else:
-            self.last_date_transactions_count = 1
+    @staticmethod
+    def count_transactions_on(document_id: str, day: datetime):
+        key = day_key(day)
+        account = Account._db.accounts.find_one({"user_document": document_id},
+                                                {"_id": 0, f"daily_transactions.{key}": 1})
+        if account:
+            return account.get("daily_transactions", {}).get(key, 0)
+
+        return None
+
 
-        self._db.accounts.update_one({"user_document": self.user_document},
-                                     {"$set": {"last_date_transactions_count": self.last_date_transactions_count,
-                                               "last_date_transaction": transaction_date}})
-                
-        
     @staticmethod
-    def find_by_account_id(account_id):
-        account =  Account._db.accounts.find_one({"account_id": account_id})
+    def find_by_account_id(account_id, fields: tuple=None):
+        # With ``fields``, only those (plus the ids) are fetched; the rest of
+        # the returned account keeps its defaults.
+        account =  Account._db.accounts.find_one({"account_id": account_id}, account_projection(fields))
         if account:
-            del account["_id"]
-            return Account(**account)
+            return Account._load(account)
         
         return None
 
     
     @staticmethod
-    def find_by_document_id(document_id):
-        account = Account._db.accounts.find_one({"user_document": document_id}) 
+    def find_by_document_id(document_id, fields: tuple=None):
+        account = Account._db.accounts.find_one({"user_document": document_id}, account_projection(fields))
         if account:
-            del account["_id"]
-            return Account(**account)
+            return Account._load(account)
         
         return None
-            
-    
 
+
+    @staticmethod
+    def exists(document_id) -> bool:
+        # Covered by the user_document index, no document is read
+        return Account._db.accounts.find_one({"user_document": document_id},
+                                             {"_id": 0, "user_document": 1}) is not None
+
+
+    @staticmethod
+    def shard_total(account_id: str, session=None) -> int:
+        totals = list(Account._db.balance_shards.aggregate(shard_total_pipeline(account_id), session=session))
+        return totals[0]["balance"] if totals else 0
+
+
+    @staticmethod
+    def _load(document: dict):
+        # Hot accounts are loaded with their sub-balances summed in
+        shard_balance = Account.shard_total(document["account_id"]) if document.get("balance_shards") else 0
+        return Account.from_document(document, shard_balance)
+
+
+    @staticmethod
+    def atomic_deposit(document_id, value, transaction_day: datetime=None):
+        # A non-positive amount would turn a guarded update into the opposite movement
+        if value <= 0:
+            return None
+
+        return Account._atomic_balance_update({"user_document": document_id, "is_frozen": False},
+                                              value, transaction_day)
+
+
+    @staticmethod
+    def atomic_withdraw(document_id, value, transaction_day: datetime=None):
+        # None when the amount isn't positive, or the account is missing, frozen or short of funds
+        if value <= 0:
+            return None
+
+        account = Account._atomic_balance_update({"user_document": document_id, "is_frozen": False,
+                                                  "balance": {"$gte": value}},
+                                                 -value, transaction_day)
+        if account is None:
+            # A hot account may hold the funds in its shards
+            return Account._hot_withdraw(document_id, value, transaction_day)
+
+        return account
+
+
+    @staticmethod
+    def _hot_withdraw(document_id, value, transaction_day: datetime=None):
+        account = Account._db.accounts.find_one({"user_document": document_id, "is_frozen": False,
+                                                 "balance_shards": {"$gt": 0}})
+        if account is None:
+            return None
+
+        account = Account.from_document(account)
+        balance = run_in_transaction(Account._db.client,
+                                     lambda session: account._drain(value, transaction_day, session))
+        Account.balance_cache.invalidate(document_id)
+        if balance is None:
+            return None
+
+        account.balance = balance
+        return account
+
+
+    @staticmethod
+    def _atomic_balance_update(query: dict, delta, transaction_day: datetime=None):
+        account = Account._db.accounts.find_one_and_update(query,
+                                                           balance_update(delta, transaction_day),
+                                                           projection={"_id": 0},
+                                                           return_document=ReturnDocument.AFTER)
+        Account.balance_cache.invalidate(query["user_document"])
+        if account:
+            return Account._load(account)
+
+        return None
+
+
+    @staticmethod
+    def project_ledger_entry(entry: dict, transaction_day: datetime=None, session=None):
+        # In journal mode accounts.balance is a projection of the ledger; $inc
+        # keeps it commutative, and the returned account carries the entry's
+        # running balance so history and statements follow the ledger.
+        account = Account._db.accounts.find_one_and_update({"account_id": entry["account_id"]},
+                                                           balance_update(entry["delta"], transaction_day),
+                                                           projection={"_id": 0},
+                                                           return_document=ReturnDocument.AFTER,
+                                                           session=session)
+        if account is None:
+            return None
+
+        Account.balance_cache.invalidate(account["user_document"])
+        account = Account.from_document(account)
+        account.balance = entry["balance"]
+        return account
+
+
+class AsyncAccount(Account):
+    _db = None
+    history_writer = None
+
+    async def create(self):
+        AsyncUser.set_database(self._db)
+        if not await AsyncUser.exists(self.user_document):
+            raise Exception("The client is not registered")
+
+        for _ in range(5):
+            self.account_id = await AccountIdGenerator.generate_async(self._db)
+
+            account_data = account_document(self.account_id, self.user_document, self.balance, self.is_frozen,
+                                            self.last_date_transaction)
+
+            try:
+                inserted_id = (await self._db.accounts.insert_one(account_data)).inserted_id
+                break
+            except DuplicateKeyError:
+                # Only IDs left by the former random generator can clash
+                continue
+        else:
+            raise Exception("Failed to generate unique account id. Please try again.")
+
+        self.balance_cache.invalidate(self.user_document)
+        return inserted_id
+
+
+    async def delete(self) -> int:
+        if self.balance > 0:
+            return 0
+
+        delete_result = await self._db.accounts.delete_one({"account_id": self.account_id})
+        if self.balance_shards:
+            await self._db.balance_shards.delete_many({"account_id": self.account_id})
+        self.balance_cache.invalidate(self.user_document)
+        return delete_result.deleted_count
+
+
+    async def freeze(self) -> None:
+        self.is_frozen = True
+        await self._db.accounts.update_one({"account_id": self.account_id},
+                                           {"$set": {"is_frozen": self.is_frozen}})
+        self.balance_cache.invalidate(self.user_document)
+
+
+    async def unfreeze(self) -> None:
+        self.is_frozen = False
+        await self._db.accounts.update_one({"account_id": self.account_id},
+                                           {"$set": {"is_frozen": self.is_frozen}})
+        self.balance_cache.invalidate(self.user_document)
+
+
+    async def deposit(self, value, transaction_day: datetime=None) -> None:
+        self.balance += value
+        if self.balance_shards:
+            await self._db.accounts.update_one({"account_id": self.account_id},
+                                               balance_update(value, transaction_day))
+        else:
+            await self._db.accounts.update_one({"account_id": self.account_id},
+                                               balance_set(self.balance - self.shard_balance, transaction_day))
+        self.balance_cache.invalidate(self.user_document)
+
+
+    async def withdraw(self, value, transaction_day: datetime=None) -> bool:
+        if value > self.balance:
+            return False
+
+        if self.balance_shards:
+            balance = await async_run_in_transaction(self._db.client,
+                                                     lambda session: self._drain(value, transaction_day, session))
+            self.balance_cache.invalidate(self.user_document)
+            if balance is None:
+                return False
+
+            self.balance = balance
+            return True
+
+        self.balance -= value
+        await self._db.accounts.update_one({"account_id": self.account_id},
+                                           balance_set(self.balance - self.shard_balance, transaction_day))
+        self.balance_cache.invalidate(self.user_document)
+        return True
+
+
+    async def transfer(self, recipient: "AsyncAccount", value, transaction_day: datetime=None):
+        if value <= 0:
+            return None
+
+        async def apply(session):
+            sender = await self._debit(value, transaction_day, session)
+            if sender is None:
+                return None
+
+            credited = await recipient._credit(value, session)
+            return (sender, credited) if credited is not None else None
+
+        applied = await async_run_in_transaction(self._db.client, apply)
+        self.balance_cache.invalidate(self.user_document, recipient.user_document)
+        if applied is None:
+            return None
+
+        self.balance, recipient.balance = applied
+        return recipient
+
+
+    async def _debit(self, value, transaction_day: datetime=None, session=None):
+        if self.balance_shards:
+            return await self._drain(value, transaction_day, session)
+
+        sender = await self._db.accounts.find_one_and_update(transfer_debit_query(self.account_id, value),
+                                                             balance_update(-value, transaction_day),
+                                                             projection=TRANSFER_PROJECTION,
+                                                             return_document=ReturnDocument.AFTER,
+                                                             session=session)
+        return sender["balance"] if sender else None
+
+
+    async def _credit(self, value, session=None):
+        if self.balance_shards:
+            credited = await self._db.balance_shards.update_one(*shard_credit_operation(self.account_id,
+                                                                                        self.balance_shards, value),
+                                                                session=session)
+            if credited.matched_count:
+                account = await self._db.accounts.find_one(active_account_query(self.account_id),
+                                                           TRANSFER_PROJECTION, session=session)
+                if account is None:
+                    return None
+
+                return account["balance"] + await AsyncAccount.shard_total(self.account_id, session)
+
+        credited = await self._db.accounts.find_one_and_update(active_account_query(self.account_id),
+                                                               balance_update(value),
+                                                               projection=TRANSFER_PROJECTION,
+                                                               return_document=ReturnDocument.AFTER,
+                                                               session=session)
+        return credited["balance"] if credited else None
+
+
+    async def _drain(self, value, transaction_day: datetime=None, session=None):
+        account = await self._db.accounts.find_one(active_account_query(self.account_id), TRANSFER_PROJECTION,
+                                                   session=session)
+        if account is None:
+            return None
+
+        shards = await self._db.balance_shards.find({"account_id": self.account_id, "balance": {"$gt": 0}},
+                                                    session=session).to_list(None)
+        plan = shard_drain_plan(account["balance"], shards, value)
+        if plan is None:
+            return None
+
+        account_take, takes = plan
+        if takes:
+            await self._db.balance_shards.bulk_write(shard_debit_operations(takes), ordered=False, session=session)
+        await self._db.accounts.update_one({"account_id": self.account_id},
+                                           balance_update(-account_take, transaction_day), session=session)
+        return account["balance"] + sum(shard["balance"] for shard in shards) - value
+
+
+    async def set_hot_shards(self, shards: int) -> None:
+        async def apply(session):
+            removed = await self._db.balance_shards.find({"account_id": self.account_id,
+                                                          "shard": {"$gte": shards}},
+                                                         session=session).to_list(None)
+            if removed:
+                await self._db.balance_shards.delete_many({"_id": {"$in": [shard["_id"] for shard in removed]}},
+                                                          session=session)
+            if shards:
+                await self._db.balance_shards.bulk_write(shard_resize_operations(self.account_id, shards),
+                                                         ordered=False, session=session)
+            await self._db.accounts.update_one({"account_id": self.account_id},
+                                               {"$set": {"balance_shards": shards},
+                                                "$inc": {"balance": Int64(sum(shard["balance"] for shard in removed))}},
+                                               session=session)
+            return True
+
+        await async_run_in_transaction(self._db.client, apply)
+        self.balance_shards = shards
+        self.balance_cache.invalidate(self.user_document)
+
+
+    async def add_transaction(self, transaction_type: str, value: int=None, counterpart: str=None, transaction_time: str=None):
+        transaction_data = {
+            "timestamp": datetime.strptime(transaction_time, "%Y-%m-%d %H:%M:%S") if transaction_time else datetime.now().replace(microsecond=0),
+            "type": transaction_type,
+            "value": Int64(value) if value is not None else None,
+            "counterpart": counterpart
+        }
+
+        self.transaction_history.append(transaction_data)
+        history = history_append_operation(self.account_id, transaction_data)
+        statement = statement_operation(self.account_id, transaction_data)
+        if self.history_writer is not None:
+            await self.history_writer.submit(UpdateOne(*history, upsert=True), UpdateOne(*statement, upsert=True))
+            return
+
+        await self._db.transactions_history.update_one(*history, upsert=True)
+        await self._db.statements.update_one(*statement, upsert=True)
+
+
+    async def get_transaction_history(self, start_date: datetime=None, end_date: datetime=None,
+                                      timestamp_format: str=None, value_scale: int=None):
+        pipeline = history_pipeline(self.account_id, start_date, end_date, timestamp_format=timestamp_format,
+                                    value_scale=value_scale)
+        return await self._db.transactions_history.aggregate(pipeline).to_list(None)
+
+
+    async def get_transaction_history_page(self, page_size: int, continuation_token: str=None,
+                                           start_date: datetime=None, end_date: datetime=None,
+                                           timestamp_format: str=None, value_scale: int=None):
+        after = decode_history_token(continuation_token) if continuation_token else None
+        pipeline = history_pipeline(self.account_id, start_date, end_date, after=after,
+                                    limit=page_size + 1, timestamp_format=timestamp_format,
+                                    value_scale=value_scale)
+        rows = await self._db.transactions_history.aggregate(pipeline).to_list(None)
+        return history_page(rows, page_size)
+
+
+    async def get_statement(self, month: str) -> dict:
+        statement = await self._db.statements.find_one({"_id": statement_id(self.account_id, month)})
+        later = await self._db.statements.aggregate(statement_later_net_pipeline(self.account_id, month)).to_list(None)
+        return statement_document(self.account_id, month, statement,
+                                  self.balance - (later[0]["net"] if later else 0))
+
+
+    @staticmethod
+    async def count_transactions_on(document_id: str, day: datetime):
+        key = day_key(day)
+        account = await AsyncAccount._db.accounts.find_one({"user_document": document_id},
+                                                           {"_id": 0, f"daily_transactions.{key}": 1})
+        if account:
+            return account.get("daily_transactions", {}).get(key, 0)
+
+        return None
+
+
+    @staticmethod
+    async def find_by_account_id(account_id, fields: tuple=None):
+        account = await AsyncAccount._db.accounts.find_one({"account_id": account_id}, account_projection(fields))
+        if account:
+            return await AsyncAccount._load(account)
+
+        return None
+
+
+    @staticmethod
+    async def find_by_document_id(document_id, fields: tuple=None):
+        account = await AsyncAccount._db.accounts.find_one({"user_document": document_id},
+                                                           account_projection(fields))
+        if account:
+            return await AsyncAccount._load(account)
+
+        return None
+
+
+    @staticmethod
+    async def exists(document_id) -> bool:
+        return await AsyncAccount._db.accounts.find_one({"user_document": document_id},
+                                                        {"_id": 0, "user_document": 1}) is not None
+
+
+    @staticmethod
+    async def shard_total(account_id: str, session=None) -> int:
+        totals = await AsyncAccount._db.balance_shards.aggregate(shard_total_pipeline(account_id),
+                                                                 session=session).to_list(None)
+        return totals[0]["balance"] if totals else 0
+
+
+    @staticmethod
+    async def _load(document: dict):
+        shard_balance = await AsyncAccount.shard_total(document["account_id"]) if document.get("balance_shards") else 0
+        return AsyncAccount.from_document(document, shard_balance)
+
+
+
+    @staticmethod
+    async def atomic_deposit(document_id, value, transaction_day: datetime=None):
+        if value <= 0:
+            return None
+
+        return await AsyncAccount._atomic_balance_update({"user_document": document_id, "is_frozen": False},
+                                                         value, transaction_day)
+
+
+    @staticmethod
+    async def atomic_withdraw(document_id, value, transaction_day: datetime=None):
+        if value <= 0:
+            return None
+
+        account = await AsyncAccount._atomic_balance_update({"user_document": document_id, "is_frozen": False,
+                                                             "balance": {"$gte": value}},
+                                                            -value, transaction_day)
+        if account is None:
+            return await AsyncAccount._hot_withdraw(document_id, value, transaction_day)
+
+        return account
+
+
+    @staticmethod
+    async def _hot_withdraw(document_id, value, transaction_day: datetime=None):
+        account = await AsyncAccount._db.accounts.find_one({"user_document": document_id, "is_frozen": False,
+                                                            "balance_shards": {"$gt": 0}})
+        if account is None:
+            return None
+
+        account = AsyncAccount.from_document(account)
+        balance = await async_run_in_transaction(AsyncAccount._db.client,
+                                                 lambda session: account._drain(value, transaction_day, session))
+        Account.balance_cache.invalidate(document_id)
+        if balance is None:
+            return None
+
+        account.balance = balance
+        return account
+
+
+    @staticmethod
+    async def _atomic_balance_update(query: dict, delta, transaction_day: datetime=None):
+        account = await AsyncAccount._db.accounts.find_one_and_update(query,
+                                                                      balance_update(delta, transaction_day),
+                                                                      projection={"_id": 0},
+                                                                      return_document=ReturnDocument.AFTER)
+        Account.balance_cache.invalidate(query["user_document"])
+        if account:
+            return await AsyncAccount._load(account)
+
+        return None
+
+
+    @staticmethod
+    async def project_ledger_entry(entry: dict, transaction_day: datetime=None, session=None):
+        account = await AsyncAccount._db.accounts.find_one_and_update({"account_id": entry["account_id"]},
+                                                                      balance_update(entry["delta"], transaction_day),
+                                                                      projection={"_id": 0},
+                                                                      return_document=ReturnDocument.AFTER,
+                                                                      session=session)
+        if account is None:
+            return None
+
+        Account.balance_cache.invalidate(account["user_document"])
+        account = AsyncAccount.from_document(account)
+        account.balance = entry["balance"]
+        return account
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from utils.static_vars import HISTORY_FLUSH_INTERVAL_MS, HISTORY_FLUSH_MAX_ENTRIES, HISTORY_WRITE_ACK
+
+logger = logging.getLogger(__name__)
+
+WRITE_ACKS = ("flushed", "queued")
+STOP = object()
+
+
+def failed_writes(error: Exception, size: int) -> dict:
+    """Map the index of each failed operation to its error.
+
+    Only a BulkWriteError that lists write errors (and no write concern
+    error) pins the failure down; anything else, an unencodable document
+    too, fails every operation of the write.
+    """
+    if isinstance(error, BulkWriteError) and not error.details.get("writeConcernErrors"):
+        write_errors = error.details.get("writeErrors", [])
+        if write_errors:
+            return {write_error["index"]: error for write_error in write_errors}
+
+    return dict.fromkeys(range(size), error)
+
+
+class PendingWrite:
+    __slots__ = ("history", "statement", "done", "error")
+
+    def __init__(self, history: UpdateOne, statement: UpdateOne, done=None):
+        self.history = history
+        self.statement = statement
+        self.done = done
+        self.error = None
+
+
+class HistoryWriter:
+    """Write-behind queue for history and statement appends.
+
+    A background thread flushes pending appends with one unordered
+    bulk_write per collection, ``interval`` seconds after the first one arrived or as
+    soon as ``max_entries`` are waiting. With ``ack="flushed"`` submit()
+    returns once its flush is acknowledged; with ``ack="queued"`` it returns
+    at once, and appends still queued when the process dies are lost.
+    """
+
+    def __init__(self, db, interval: float=HISTORY_FLUSH_INTERVAL_MS / 1000,
+                 max_entries: int=HISTORY_FLUSH_MAX_ENTRIES, ack: str=HISTORY_WRITE_ACK):
+        if ack not in WRITE_ACKS:
+            raise ValueError(f"ack must be one of {', '.join(WRITE_ACKS)}")
+
+        self._db = db
+        self.interval = interval
+        self.max_entries = max_entries
+        self.ack = ack
+        self._queue = queue.Queue()
+        self._worker = None
+        self.flushes = 0
+        self.entries = 0
+        self.failures = 0
+
+    def stats(self) -> dict:
+        return {"ack": self.ack, "queued": self._queue.qsize(), "flushes": self.flushes,
+                "entries": self.entries, "failures": self.failures}
+
+    def start(self) -> None:
+        self._worker = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._worker.start()
+
+    def submit(self, history: UpdateOne, statement: UpdateOne) -> None:
+        pending = PendingWrite(history, statement, threading.Event() if self.ack == "flushed" else None)
+        self._queue.put(pending)
+        if pending.done is not None:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+
+    def close(self) -> None:
+        """Flush everything submitted so far and stop the background thread."""
+        self._queue.put(STOP)
+        self._worker.join()
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is STOP:
+                return
+
+            batch = [first]
+            deadline = time.monotonic() + self.interval
+            stopping = False
+            while len(batch) < self.max_entries:
+                try:
+                    pending = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if pending is STOP:
+                    stopping = True
+                    break
+                batch.append(pending)
+
+            self._flush(batch)
+            if stopping:
+                return
+
+    def _flush(self, batch: list) -> None:
+        # A failure fails only the appends it hit, and the statements are
+        # written even when history appends failed: the worker must survive,
+        # or every later flushed submit would hang.
+        errors = {}
+        for collection, operations in self._operations(batch):
+            try:
+                collection.bulk_write(operations, ordered=False)
+            except Exception as e:
+                for index, error in failed_writes(e, len(batch)).items():
+                    errors.setdefault(index, error)
+
+        self._settle(batch, errors)
+        for pending in batch:
+            if pending.done is not None:
+                pending.done.set()
+
+    def _operations(self, batch: list) -> tuple:
+        return ((self._db.transactions_history, [pending.history for pending in batch]),
+                (self._db.statements, [pending.statement for pending in batch]))
+
+    def _settle(self, batch: list, errors: dict) -> None:
+        if errors:
+            self.failures += len(errors)
+            if self.ack == "queued":
+                logger.error("Dropped %d queued history appends", len(errors), exc_info=next(iter(errors.values())))
+
+        self.flushes += 1
+        self.entries += len(batch)
+        for index, pending in enumerate(batch):
+            pending.error = errors.get(index)
+
+
+class AsyncHistoryWriter(HistoryWriter):
+    """Same pipeline as ``HistoryWriter``, run as a task on the server's event loop."""
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._full = asyncio.Event()
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, history: UpdateOne, statement: UpdateOne) -> None:
+        done = asyncio.get_running_loop().create_future() if self.ack == "flushed" else None
+        pending = PendingWrite(history, statement, done)
+        self._queue.put_nowait(pending)
+        if self._queue.qsize() + 1 >= self.max_entries:
+            self._full.set()
+        if done is not None:
+            await done
+            if pending.error is not None:
+                raise pending.error
+
+    async def close(self) -> None:
+        self._queue.put_nowait(STOP)
+        self._full.set()
+        await self._worker
+
+    async def _run(self) -> None:
+        while True:
+            first = await self._queue.get()
+            if first is STOP:
+                return
+
+            # Sleep out the window unless the batch fills up first, then take
+            # whatever is queued without awaiting again.
+            if self._queue.qsize() + 1 < self.max_entries:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = [first]
+            stopping = False
+            while len(batch) < self.max_entries and not self._queue.empty():
+                pending = self._queue.get_nowait()
+                if pending is STOP:
+                    stopping = True
+                    break
+                batch.append(pending)
+
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: list) -> None:
+        errors = {}
+        for collection, operations in self._operations(batch):
+            try:
+                await collection.bulk_write(operations, ordered=False)
+            except Exception as e:
+                for index, error in failed_writes(e, len(batch)).items():
+                    errors.setdefault(index, error)
+
+        self._settle(batch, errors)
+        for pending in batch:
+            # A submitter that was cancelled no longer waits on its future
+            if pending.done is not None and not pending.done.done():
+                pending.done.set_result(None)
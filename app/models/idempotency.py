@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from utils.cache import TTLCache, MISSING
+from utils.static_vars import IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_LOCK_SECONDS, IDEMPOTENCY_CACHE_SIZE
+
+
+def utcnow() -> datetime:
+    # Mongo hands back naive UTC datetimes, so stored and computed times stay naive.
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def claim_update(fingerprint: str, now: datetime) -> dict:
+    return {"$setOnInsert": {"fingerprint": fingerprint, "status": None, "response": None, "created_at": now}}
+
+
+def is_abandoned(record: dict, now: datetime) -> bool:
+    return record["status"] is None and record["created_at"] <= now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+
+
+class IdempotencyKey:
+    """Dedup records for retried requests, expired by a TTL index on ``created_at``.
+
+    A record without ``status`` is a claim held by the request in flight;
+    completed records are immutable, so they are also kept in ``cache``.
+    """
+    _db = None
+    cache = TTLCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL_SECONDS)
+
+    @classmethod
+    def get_database(cls):
+        return cls._db
+
+    @classmethod
+    def set_database(cls, db):
+        cls._db = db
+
+    @classmethod
+    def claim(cls, record_id: str, fingerprint: str):
+        """Return ``None`` when the caller now owns ``record_id``, otherwise the existing record."""
+        record = cls.cache.get(record_id)
+        if record is not MISSING:
+            return record
+
+        now = utcnow()
+        try:
+            record = cls._db.idempotency_keys.find_one_and_update({"_id": record_id},
+                                                                  claim_update(fingerprint, now),
+                                                                  upsert=True,
+                                                                  return_document=ReturnDocument.BEFORE)
+        except DuplicateKeyError:
+            record = cls._db.idempotency_keys.find_one({"_id": record_id})
+
+        if record is None:
+            return None
+
+        if is_abandoned(record, now):
+            taken = cls._db.idempotency_keys.find_one_and_update(
+                {"_id": record_id, "status": None, "created_at": record["created_at"]},
+                {"$set": {"fingerprint": fingerprint, "created_at": now}}
+            )
+            if taken:
+                return None
+
+        if record["status"] is not None:
+            cls.cache.set(record_id, record)
+
+        return record
+
+    @classmethod
+    def complete(cls, record_id: str, fingerprint: str, status: int, response) -> None:
+        cls._db.idempotency_keys.update_one({"_id": record_id},
+                                            {"$set": {"status": status, "response": response}})
+        cls.cache.set(record_id, {"_id": record_id, "fingerprint": fingerprint,
+                                  "status": status, "response": response})
+
+    @classmethod
+    def release(cls, record_id: str) -> None:
+        cls._db.idempotency_keys.delete_one({"_id": record_id, "status": None})
+
+
+class AsyncIdempotencyKey(IdempotencyKey):
+    _db = None
+
+    @classmethod
+    async def claim(cls, record_id: str, fingerprint: str):
+        record = cls.cache.get(record_id)
+        if record is not MISSING:
+            return record
+
+        now = utcnow()
+        try:
+            record = await cls._db.idempotency_keys.find_one_and_update({"_id": record_id},
+                                                                        claim_update(fingerprint, now),
+                                                                        upsert=True,
+                                                                        return_document=ReturnDocument.BEFORE)
+        except DuplicateKeyError:
+            record = await cls._db.idempotency_keys.find_one({"_id": record_id})
+
+        if record is None:
+            return None
+
+        if is_abandoned(record, now):
+            taken = await cls._db.idempotency_keys.find_one_and_update(
+                {"_id": record_id, "status": None, "created_at": record["created_at"]},
+                {"$set": {"fingerprint": fingerprint, "created_at": now}}
+            )
+            if taken:
+                return None
+
+        if record["status"] is not None:
+            cls.cache.set(record_id, record)
+
+        return record
+
+    @classmethod
+    async def complete(cls, record_id: str, fingerprint: str, status: int, response) -> None:
+        await cls._db.idempotency_keys.update_one({"_id": record_id},
+                                                  {"$set": {"status": status, "response": response}})
+        cls.cache.set(record_id, {"_id": record_id, "fingerprint": fingerprint,
+                                  "status": status, "response": response})
+
+    @classmethod
+    async def release(cls, record_id: str) -> None:
+        await cls._db.idempotency_keys.delete_one({"_id": record_id, "status": None})
@@ -0,0 +1,280 @@
+from datetime import datetime
+from bson import Int64
+from pymongo import DESCENDING, DeleteMany, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from typing import List
+
+from app.database.transactions import mark_transient
+from utils.static_vars import LEDGER_APPEND_RETRIES
+
+EMPTY_HEAD = {"seq": 0, "balance": 0}
+HEAD_PROJECTION = {"_id": 0, "seq": 1, "balance": 1}
+
+
+def ledger_entry(account_id: str, head: dict, delta, entry_type: str, counterpart: str=None,
+                 timestamp: datetime=None) -> dict:
+    # Entries are never updated: each one carries the running balance after it,
+    # so the newest entry of an account is its current balance.
+    return {
+        "account_id": account_id,
+        "seq": head["seq"] + 1,
+        "type": entry_type,
+        "delta": Int64(delta),
+        "balance": Int64(head["balance"] + delta),
+        "counterpart": counterpart,
+        "timestamp": timestamp or datetime.now().replace(microsecond=0)
+    }
+
+
+def ledger_entries(account_id: str, head: dict, movements: List[tuple]) -> List[dict]:
+    """Chain ``(delta, type, counterpart, timestamp)`` movements after ``head``."""
+    entries = []
+    for movement in movements:
+        entry = ledger_entry(account_id, head, *movement)
+        entries.append(entry)
+        head = entry
+
+    return entries
+
+
+def heads_pipeline(account_ids: List[str]) -> list:
+    # With the (account_id, seq) index the sort + $first is answered by a
+    # DISTINCT_SCAN, one index seek per account.
+    return [{"$match": {"account_id": {"$in": account_ids}}},
+            {"$sort": {"account_id": 1, "seq": -1}},
+            {"$group": {"_id": "$account_id", "seq": {"$first": "$seq"}, "balance": {"$first": "$balance"}}}]
+
+
+def replay_pipeline(snapshots: dict) -> list:
+    return [{"$match": {"$or": [{"account_id": account_id, "seq": {"$gt": snapshot["seq"]}}
+                                for account_id, snapshot in snapshots.items()]}},
+            {"$sort": {"account_id": 1, "seq": 1}},
+            {"$group": {"_id": "$account_id", "delta": {"$sum": "$delta"}, "seq": {"$last": "$seq"},
+                        "head_balance": {"$last": "$balance"}}}]
+
+
+def snapshot_document(account_id: str, seq: int, balance) -> dict:
+    return {"_id": f"{account_id}:{seq}", "account_id": account_id, "seq": seq, "balance": Int64(balance),
+            "created_at": datetime.now().replace(microsecond=0)}
+
+
+def prune_operations(account_id: str, seq: int):
+    # Entries up to a snapshot are folded into it, and so are older snapshots
+    return (DeleteMany({"account_id": account_id, "seq": {"$lte": seq}}),
+            DeleteMany({"account_id": account_id, "seq": {"$lt": seq}}))
+
+
+def inserted_count(error: BulkWriteError) -> int:
+    if any(write_error["code"] != 11000 for write_error in error.details["writeErrors"]):
+        raise error
+
+    return error.details["nInserted"]
+
+
+class Ledger:
+    """Append-only journal of money movements, with periodic balance snapshots.
+
+    ``(account_id, seq)`` is unique, so two writers racing on the same head
+    can't both append: the loser re-reads the head and retries. Compaction
+    replays the entries after the latest snapshot into a new one and prunes
+    what it covers, so reads and replays stay bounded; a rebuild resets the
+    ``accounts.balance`` projection from the same replay.
+    """
+    _db = None
+
+    @classmethod
+    def get_database(cls):
+        return cls._db
+
+    @classmethod
+    def set_database(cls, db):
+        cls._db = db
+
+    @classmethod
+    def head(cls, account_id: str, session=None) -> dict:
+        head = cls._db.ledger.find_one({"account_id": account_id}, HEAD_PROJECTION, sort=[("seq", DESCENDING)],
+                                       session=session)
+        if head is None:
+            head = cls._db.ledger_snapshots.find_one({"account_id": account_id}, HEAD_PROJECTION,
+                                                     sort=[("seq", DESCENDING)], session=session)
+
+        return head or EMPTY_HEAD
+
+    @classmethod
+    def heads(cls, account_ids: List[str]) -> dict:
+        heads = {head["_id"]: head for head in cls._db.ledger.aggregate(heads_pipeline(account_ids))}
+        missing = [account_id for account_id in account_ids if account_id not in heads]
+        if missing:
+            heads.update({head["_id"]: head for head in cls._db.ledger_snapshots.aggregate(heads_pipeline(missing))})
+
+        return {account_id: heads.get(account_id, EMPTY_HEAD) for account_id in account_ids}
+
+    @classmethod
+    def balance(cls, account_id: str) -> int:
+        return cls.head(account_id)["balance"]
+
+    @classmethod
+    def open(cls, account_id: str, balance) -> None:
+        cls._db.ledger_snapshots.insert_one(snapshot_document(account_id, 0, balance))
+
+    @classmethod
+    def append(cls, account_id: str, delta, entry_type: str, counterpart: str=None, timestamp: datetime=None,
+               session=None):
+        """Append one movement; ``None`` when a debit would overdraw the account.
+
+        Inside a transaction (``session``) the head read is stale once another
+        append took its ``seq``, so the duplicate key is raised as a transient
+        error and run_in_transaction retries the whole transaction instead.
+        """
+        for _ in range(LEDGER_APPEND_RETRIES):
+            head = cls.head(account_id, session)
+            if delta < 0 and head["balance"] + delta < 0:
+                return None
+
+            entry = ledger_entry(account_id, head, delta, entry_type, counterpart, timestamp)
+            try:
+                cls._db.ledger.insert_one(entry, session=session)
+                return entry
+            except DuplicateKeyError as e:
+                if session is not None:
+                    raise mark_transient(e)
+                continue
+
+        raise Exception("Ledger append kept conflicting. Please try again.")
+
+    @classmethod
+    def append_many(cls, entries: List[dict]) -> int:
+        """Insert a chain built by ``ledger_entries``; returns how many made it in.
+
+        The insert is ordered, so a concurrent append cuts the chain at the
+        first taken ``seq`` and everything after it is left out.
+        """
+        try:
+            return len(cls._db.ledger.insert_many(entries, ordered=True).inserted_ids)
+        except BulkWriteError as e:
+            return inserted_count(e)
+
+    @classmethod
+    def replay(cls, account_ids: List[str]) -> dict:
+        """Latest snapshot plus the entries after it, per account."""
+        snapshots = {account_id: dict(EMPTY_HEAD) for account_id in account_ids}
+        for snapshot in cls._db.ledger_snapshots.aggregate(heads_pipeline(account_ids)):
+            snapshots[snapshot["_id"]] = {"seq": snapshot["seq"], "balance": snapshot["balance"]}
+
+        replayed = {account_id: {**snapshot, "snapshot_seq": snapshot["seq"], "head_balance": snapshot["balance"]}
+                    for account_id, snapshot in snapshots.items()}
+        if not account_ids:
+            return replayed
+
+        for row in cls._db.ledger.aggregate(replay_pipeline(snapshots), allowDiskUse=True):
+            state = replayed[row["_id"]]
+            state["balance"] += row["delta"]
+            state["seq"] = row["seq"]
+            state["head_balance"] = row["head_balance"]
+
+        return replayed
+
+    @classmethod
+    def compact(cls, account_ids: List[str]) -> dict:
+        """Snapshot every account with entries past its latest snapshot, then prune.
+
+        Entries and snapshots the new snapshot covers are deleted once it is
+        written; a concurrent append lands after it and is kept. Accounts
+        whose replayed balance disagrees with their newest entry are reported
+        as drifted and left untouched.
+        """
+        snapshots = []
+        entry_prunes = []
+        snapshot_prunes = []
+        drifted = []
+        for account_id, state in cls.replay(account_ids).items():
+            if state["balance"] != state["head_balance"]:
+                drifted.append(account_id)
+                continue
+
+            if state["seq"] > state["snapshot_seq"]:
+                snapshot = snapshot_document(account_id, state["seq"], state["balance"])
+                snapshots.append(ReplaceOne({"_id": snapshot["_id"]}, snapshot, upsert=True))
+            if state["seq"]:
+                entry_prune, snapshot_prune = prune_operations(account_id, state["seq"])
+                entry_prunes.append(entry_prune)
+                snapshot_prunes.append(snapshot_prune)
+
+        if snapshots:
+            cls._db.ledger_snapshots.bulk_write(snapshots, ordered=False)
+
+        pruned = 0
+        if entry_prunes:
+            pruned = cls._db.ledger.bulk_write(entry_prunes, ordered=False).deleted_count
+            cls._db.ledger_snapshots.bulk_write(snapshot_prunes, ordered=False)
+
+        return {"snapshots": len(snapshots), "pruned": pruned, "drifted": drifted}
+
+    @classmethod
+    def rebuild(cls, account_ids: List[str]) -> int:
+        """Reset ``accounts.balance`` to the replayed ledger balance; run while writes are paused."""
+        updates = [UpdateOne({"account_id": account_id}, {"$set": {"balance": Int64(state["balance"])}})
+                   for account_id, state in cls.replay(account_ids).items()]
+        if not updates:
+            return 0
+
+        return cls._db.accounts.bulk_write(updates, ordered=False).modified_count
+
+
+class AsyncLedger(Ledger):
+    _db = None
+
+    @classmethod
+    async def head(cls, account_id: str, session=None) -> dict:
+        head = await cls._db.ledger.find_one({"account_id": account_id}, HEAD_PROJECTION,
+                                             sort=[("seq", DESCENDING)], session=session)
+        if head is None:
+            head = await cls._db.ledger_snapshots.find_one({"account_id": account_id}, HEAD_PROJECTION,
+                                                           sort=[("seq", DESCENDING)], session=session)
+
+        return head or EMPTY_HEAD
+
+    @classmethod
+    async def heads(cls, account_ids: List[str]) -> dict:
+        heads = {head["_id"]: head
+                 async for head in cls._db.ledger.aggregate(heads_pipeline(account_ids))}
+        missing = [account_id for account_id in account_ids if account_id not in heads]
+        if missing:
+            heads.update({head["_id"]: head
+                          async for head in cls._db.ledger_snapshots.aggregate(heads_pipeline(missing))})
+
+        return {account_id: heads.get(account_id, EMPTY_HEAD) for account_id in account_ids}
+
+    @classmethod
+    async def balance(cls, account_id: str) -> int:
+        return (await cls.head(account_id))["balance"]
+
+    @classmethod
+    async def open(cls, account_id: str, balance) -> None:
+        await cls._db.ledger_snapshots.insert_one(snapshot_document(account_id, 0, balance))
+
+    @classmethod
+    async def append(cls, account_id: str, delta, entry_type: str, counterpart: str=None, timestamp: datetime=None,
+                     session=None):
+        for _ in range(LEDGER_APPEND_RETRIES):
+            head = await cls.head(account_id, session)
+            if delta < 0 and head["balance"] + delta < 0:
+                return None
+
+            entry = ledger_entry(account_id, head, delta, entry_type, counterpart, timestamp)
+            try:
+                await cls._db.ledger.insert_one(entry, session=session)
+                return entry
+            except DuplicateKeyError as e:
+                if session is not None:
+                    raise mark_transient(e)
+                continue
+
+        raise Exception("Ledger append kept conflicting. Please try again.")
+
+    @classmethod
+    async def append_many(cls, entries: List[dict]) -> int:
+        try:
+            return len((await cls._db.ledger.insert_many(entries, ordered=True)).inserted_ids)
+        except BulkWriteError as e:
+            return inserted_count(e)
@@ -0,0 +1,131 @@
+from datetime import datetime
+from typing import List
+from pymongo.errors import BulkWriteError
+
+from app.models.account import Account, account_document, history_bucket_document
+from app.models.ledger import snapshot_document
+from app.models.user import User, user_record
+from utils.AccountIdGenerator import AccountIdGenerator
+
+
+def write_error_message(write_error: dict) -> str:
+    if write_error.get("code") == 11000:
+        return f"duplicate {', '.join(write_error.get('keyPattern', {})) or 'key'}"
+
+    return write_error.get("errmsg", "write failed")
+
+
+def write_failures(error: BulkWriteError) -> dict:
+    # Unordered inserts keep going past a failed document and report it by index
+    return {write_error["index"]: write_error_message(write_error) for write_error in error.details["writeErrors"]}
+
+
+def onboarding_accounts(rows: List[dict], account_ids: List[str]) -> List[dict]:
+    return [account_document(account_id, row["document_id"], row.get("balance", 0))
+            for row, account_id in zip(rows, account_ids)]
+
+
+def imported_documents(documents: List[dict], failures: dict) -> List[dict]:
+    return [document for index, document in enumerate(documents) if index not in failures]
+
+
+class Onboarding:
+    """Bulk creation of users with their accounts, for imports.
+
+    Each batch is a handful of unordered insert_many calls, so one bad row
+    doesn't hold up the rest. A row whose account can't be inserted has its
+    user removed again, so it can simply be imported again.
+    """
+    _db = None
+
+    @classmethod
+    def get_database(cls):
+        return cls._db
+
+    @classmethod
+    def set_database(cls, db):
+        cls._db = db
+
+    @classmethod
+    def import_batch(cls, rows: List[dict], journal: bool=False) -> dict:
+        """Insert ``rows`` (user fields plus a minor-unit ``balance``); returns {index: error} for the rejected ones."""
+        try:
+            cls._db.users.insert_many([user_record(row) for row in rows], ordered=False)
+            failures = {}
+        except BulkWriteError as e:
+            failures = write_failures(e)
+
+        User.cache.invalidate(*(row["document_id"] for row in rows))
+        pending = [index for index in range(len(rows)) if index not in failures]
+        account_ids = [AccountIdGenerator.generate(cls._db) for _ in pending]
+        accounts = onboarding_accounts([rows[index] for index in pending], account_ids)
+        if not accounts:
+            return failures
+
+        try:
+            cls._db.accounts.insert_many(accounts, ordered=False)
+            account_failures = {}
+        except BulkWriteError as e:
+            account_failures = write_failures(e)
+            cls._db.users.delete_many({"document_id": {"$in": [accounts[index]["user_document"]
+                                                               for index in account_failures]}})
+            User.cache.invalidate(*(accounts[index]["user_document"] for index in account_failures))
+
+        for index, error in account_failures.items():
+            failures[pending[index]] = error
+
+        imported = imported_documents(accounts, account_failures)
+        if imported:
+            now = datetime.now()
+            cls._db.transactions_history.insert_many([history_bucket_document(account["account_id"], now)
+                                                      for account in imported], ordered=False)
+            if journal:
+                cls._db.ledger_snapshots.insert_many([snapshot_document(account["account_id"], 0, account["balance"])
+                                                      for account in imported], ordered=False)
+            Account.balance_cache.invalidate(*(account["user_document"] for account in imported))
+
+        return failures
+
+
+class AsyncOnboarding(Onboarding):
+    _db = None
+
+    @classmethod
+    async def import_batch(cls, rows: List[dict], journal: bool=False) -> dict:
+        try:
+            await cls._db.users.insert_many([user_record(row) for row in rows], ordered=False)
+            failures = {}
+        except BulkWriteError as e:
+            failures = write_failures(e)
+
+        User.cache.invalidate(*(row["document_id"] for row in rows))
+        pending = [index for index in range(len(rows)) if index not in failures]
+        account_ids = [await AccountIdGenerator.generate_async(cls._db) for _ in pending]
+        accounts = onboarding_accounts([rows[index] for index in pending], account_ids)
+        if not accounts:
+            return failures
+
+        try:
+            await cls._db.accounts.insert_many(accounts, ordered=False)
+            account_failures = {}
+        except BulkWriteError as e:
+            account_failures = write_failures(e)
+            await cls._db.users.delete_many({"document_id": {"$in": [accounts[index]["user_document"]
+                                                                     for index in account_failures]}})
+            User.cache.invalidate(*(accounts[index]["user_document"] for index in account_failures))
+
+        for index, error in account_failures.items():
+            failures[pending[index]] = error
+
+        imported = imported_documents(accounts, account_failures)
+        if imported:
+            now = datetime.now()
+            await cls._db.transactions_history.insert_many([history_bucket_document(account["account_id"], now)
+                                                            for account in imported], ordered=False)
+            if journal:
+                await cls._db.ledger_snapshots.insert_many([snapshot_document(account["account_id"], 0,
+                                                                              account["balance"])
+                                                            for account in imported], ordered=False)
+            Account.balance_cache.invalidate(*(account["user_document"] for account in imported))
+
+        return failures
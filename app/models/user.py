@@ -1,7 +1,22 @@
 from pymongo import MongoClient
 
+from utils.cache import TTLCache, MISSING
+from utils.static_vars import USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS, USER_CACHE_NEGATIVE_TTL_SECONDS
+
+USER_FIELDS = ("firstname", "lastname", "document_id", "phone", "birthdate", "email")
+USER_PROJECTION = {"_id": 0, **{field: 1 for field in USER_FIELDS}}
+USER_EXISTS_PROJECTION = {"_id": 0, "document_id": 1}
+
+
+def user_record(fields: dict) -> dict:
+    return {field: fields[field] for field in USER_FIELDS}
+
+
 class User:
     _db = None
+    # User records by document_id; None marks a document with no user, kept
+    # for USER_CACHE_NEGATIVE_TTL_SECONDS only.
+    cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
 
     @classmethod
     def get_database(cls):
@@ -20,16 +35,9 @@ class User:
         self.email: str = email
 
     def create(self):
-        user_data = {
-            "firstname": self.firstname,
-            "lastname": self.lastname,
-            "document_id": self.document_id,
-            "phone": self.phone,
-            "birthdate": self.birthdate,
-            "email": self.email
-        }
-
-        return self._db.users.insert_one(user_data).inserted_id
+        inserted_id = self._db.users.insert_one(user_record(self.__dict__)).inserted_id
+        self.cache.invalidate(self.document_id)
+        return inserted_id
     
 
     def update(self, data):
@@ -40,10 +48,13 @@ class User:
             print(update_data)
             self._db.users.update_one({"document_id": self.document_id},
                                       {"$set": update_data})
+            self.cache.invalidate(self.document_id)
          
     
     def delete(self):
-        return self._db.users.delete_one({"document_id": self.document_id})
+        delete_result = self._db.users.delete_one({"document_id": self.document_id})
+        self.cache.invalidate(self.document_id)
+        return delete_result
     
     @staticmethod
     def find_by_name(firstname: str, lastname: str):
@@ -57,10 +68,85 @@ class User:
     
     @staticmethod
     def find_by_document(document_id: str):
-        user = User._db.users.find_one({"document_id": document_id})
+        record = User.cache.get(document_id)
+        if record is MISSING:
+            generation = User.cache.generation
+            record = User._db.users.find_one({"document_id": document_id}, USER_PROJECTION)
+            User.cache.set(document_id, record, generation, ttl=None if record else USER_CACHE_NEGATIVE_TTL_SECONDS)
+
+        # Every caller gets its own object; the cached record is never handed out
+        return User(**record) if record else None
+
+
+    @staticmethod
+    def exists(document_id: str) -> bool:
+        # A cached record answers it; otherwise a query covered by the
+        # document_id index. Only misses are cached, there is no record to keep.
+        record = User.cache.get(document_id)
+        if record is not MISSING:
+            return record is not None
+
+        generation = User.cache.generation
+        found = User._db.users.find_one({"document_id": document_id}, USER_EXISTS_PROJECTION) is not None
+        if not found:
+            User.cache.set(document_id, None, generation, ttl=USER_CACHE_NEGATIVE_TTL_SECONDS)
+
+        return found
+
+
+class AsyncUser(User):
+    _db = None
+
+    async def create(self):
+        inserted_id = (await self._db.users.insert_one(user_record(self.__dict__))).inserted_id
+        self.cache.invalidate(self.document_id)
+        return inserted_id
+
+
+    async def update(self, data):
+        update_data = {key: value for key, value in data.items() if key != "document_id"}
+
+        if update_data:
+            await self._db.users.update_one({"document_id": self.document_id},
+                                            {"$set": update_data})
+            self.cache.invalidate(self.document_id)
+
+
+    async def delete(self):
+        delete_result = await self._db.users.delete_one({"document_id": self.document_id})
+        self.cache.invalidate(self.document_id)
+        return delete_result
+
+    @staticmethod
+    async def find_by_name(firstname: str, lastname: str):
+        user = await AsyncUser._db.users.find_one({"firstname": firstname, "lastname": lastname})
         if user:
             del user["_id"]
-            return User(**user)
-        
+            return AsyncUser(**user)
+
         return None
-            
\ No newline at end of file
+
+
+    @staticmethod
+    async def find_by_document(document_id: str):
+        record = User.cache.get(document_id)
+        if record is MISSING:
+            generation = User.cache.generation
+            record = await AsyncUser._db.users.find_one({"document_id": document_id}, USER_PROJECTION)
+            User.cache.set(document_id, record, generation, ttl=None if record else USER_CACHE_NEGATIVE_TTL_SECONDS)
+
+        return AsyncUser(**record) if record else None
+
+
+    @staticmethod
+    async def exists(document_id: str) -> bool:
+        record = User.cache.get(document_id)
+        if record is not MISSING:
+            return record is not None
+
+        generation = User.cache.generation
+        found = await AsyncUser._db.users.find_one({"document_id": document_id}, USER_EXISTS_PROJECTION) is not None
+        if not found:
+            User.cache.set(document_id, None, generation, ttl=USER_CACHE_NEGATIVE_TTL_SECONDS)
+
+        return found
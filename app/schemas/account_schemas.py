@@ -1,55 +1,55 @@
-from dataclasses import dataclass
+from pydantic import Field
+from pydantic.dataclasses import dataclass
 from typing import List, Optional
 from datetime import datetime
+from app.schemas.base import Schema
+from utils.static_vars import HOT_ACCOUNT_MAX_SHARDS
 
 @dataclass
-class AccountData:
+class AccountData(Schema):
     account_id: Optional[str]=None
-    user_document: str=None
+    user_document: Optional[str]=None
     balance: float=0
     is_frozen: bool=False
-    transaction_history: List[dict]=None
+    transaction_history: Optional[List[dict]]=Field(default=None, exclude=True)
 
-    def to_dict(self):
-        return {
-            "account_id": self.account_id,
-            "user_document": self.user_document,
-            "balance": self.balance,
-            "is_frozen": self.is_frozen
-        }
-    
 
 @dataclass
-class AccountTransaction:
+class AccountTransaction(Schema):
     account_id: Optional[str]=None
-    user_document: str=None
-    value: float=0
+    user_document: Optional[str]=None
+    value: float=Field(default=0, gt=0)
     recipient_account_id: Optional[str]=None
     recipient_document: Optional[str]=None
-    transaction_date: datetime=datetime.today()
-
-    def to_dict(self):
-        return {
-            "account_id": self.account_id,
-            "user_document": self.user_document,
-            "value": self.value,
-            "recipient_account_id": self.recipient_account_id,
-            "recipient_document": self.recipient_document,
-            "transaction_date": self.transaction_date.strftime("%Y-%m-%d %H:%M:%S")
-        }
-    
+    transaction_date: datetime=Field(default_factory=datetime.now)
+
 
 @dataclass
-class AccountHistoryRequest:
+class AccountBatchTransaction(AccountTransaction):
+    # Checked per item by plan_batch, so one bad amount doesn't reject the whole batch
+    value: float=0
+    operation: str="deposit"
+
+
+@dataclass
+class AccountHistoryRequest(Schema):
     account_id: Optional[str]=None
-    user_document: str=None
+    user_document: Optional[str]=None
     start_date: Optional[datetime]=None
     end_date: Optional[datetime]=None
+    page_size: Optional[int]=Field(default=None, ge=1)
+    continuation_token: Optional[str]=None
+
 
-    def to_dict(self):
-        return {
-            "account_id": self.account_id,
-            "user_document": self.user_document,
-            "start_date": self.start_date.strftime("%Y-%m-%d %H:%M:%S") if self.start_date else self.start_date,
-            "end_date": self.end_date.strftime("%Y-%m-%d %H:%M:%S") if self.end_date else self.end_date
-        } 
+@dataclass
+class AccountStatementRequest(Schema):
+    account_id: Optional[str]=None
+    user_document: Optional[str]=None
+    month: str=Field(default_factory=lambda: datetime.now().strftime("%Y-%m"), pattern=r"^\d{4}-(0[1-9]|1[0-2])$")
+
+
+@dataclass
+class AccountHotMode(Schema):
+    account_id: Optional[str]=None
+    user_document: Optional[str]=None
+    shards: int=Field(default=0, ge=0, le=HOT_ACCOUNT_MAX_SHARDS)
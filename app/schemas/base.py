@@ -0,0 +1,14 @@
+from functools import lru_cache
+from pydantic import TypeAdapter
+
+
+@lru_cache(maxsize=None)
+def schema_adapter(schema: type) -> TypeAdapter:
+    return TypeAdapter(schema)
+
+
+class Schema:
+    """Gives pydantic dataclasses a JSON-ready ``to_dict`` built by pydantic-core."""
+
+    def to_dict(self) -> dict:
+        return schema_adapter(type(self)).dump_python(self, mode="json")
@@ -0,0 +1,8 @@
+from pydantic import Field
+from pydantic.dataclasses import dataclass
+from app.schemas.user_schemas import UserData
+
+
+@dataclass
+class OnboardingRow(UserData):
+    balance: float=Field(default=0, ge=0)
@@ -1,7 +1,9 @@
-from dataclasses import dataclass
+from pydantic.dataclasses import dataclass
+from typing import Optional
+from app.schemas.base import Schema
 
 @dataclass
-class UserData:
+class UserData(Schema):
     firstname: str
     lastname: str
     document_id: str
@@ -9,25 +11,8 @@ class UserData:
     birthdate: str
     email: str
 
-    def to_dict(self):
-        return {
-            "firstname": self.firstname,
-            "lastname": self.lastname,
-            "document_id": self.document_id,
-            "phone": self.phone,
-            "birthdate": self.birthdate,
-            "email": self.email
-        }
-
 @dataclass
-class UserUpdate:
+class UserUpdate(Schema):
     document_id: str
-    phone: str
-    email: str
-
-    def to_dict(self):
-        return {
-            "document_id": self.document_id,
-            "phone": self.phone,
-            "email": self.email
-        }
+    phone: Optional[str]=None
+    email: Optional[str]=None
@@ -0,0 +1,93 @@
+"""Account ID allocation: random-suffix probing vs block-leased sequences.
+
+    python -m benchmarks.bench_account_ids --ids 5000 --occupied 200000
+
+``--occupied`` pre-fills today's ID space with that many random IDs to mimic
+a busy onboarding day. The random generator has to probe past them, while the
+sequence generator only pays one counter write per leased block.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from random import sample
+
+from pymongo import MongoClient, monitoring
+
+from benchmarks.common import BENCH_DATABASE
+from utils.AccountIdGenerator import AccountIdGenerator
+from utils.static_vars import MONGODB_PATH
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = {}
+
+    def started(self, event):
+        self.commands[event.command_name] = self.commands.get(event.command_name, 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def occupy(db, occupied: int) -> None:
+    day = datetime.now().strftime("%d%m%Y")
+    db.accounts.delete_many({})
+    db.counters.delete_many({})
+    db.accounts.create_index("account_id", unique=True)
+    if occupied:
+        db.accounts.insert_many([{"account_id": f"{day}{suffix:06d}"}
+                                 for suffix in sample(range(1000000), occupied)])
+
+
+def run(name: str, generate, db, counter: CommandCounter, ids: int, threads: int) -> dict:
+    counter.commands.clear()
+    AccountIdGenerator._leases.clear()
+    failures = 0
+
+    def allocate(_):
+        nonlocal failures
+        try:
+            return generate(db)
+        except Exception:
+            failures += 1
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        allocated = [account_id for account_id in pool.map(allocate, range(ids)) if account_id]
+    elapsed = time.perf_counter() - start
+
+    round_trips = counter.commands.get("find", 0) + counter.commands.get("findAndModify", 0)
+    return {
+        "generator": name,
+        "ids": len(allocated),
+        "ids_per_sec": round(len(allocated) / elapsed, 1),
+        "round_trips_per_id": round(round_trips / max(len(allocated), 1), 4),
+        "duplicates": len(allocated) - len(set(allocated)),
+        "failures": failures
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ids", type=int, default=5000)
+    parser.add_argument("--occupied", type=int, default=200000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    counter = CommandCounter()
+    client = MongoClient(MONGODB_PATH, event_listeners=[counter])
+    db = client[BENCH_DATABASE]
+    occupy(db, args.occupied)
+
+    print(run("random", AccountIdGenerator.generate_random, db, counter, args.ids, args.threads))
+    print(run("sequence", AccountIdGenerator.generate, db, counter, args.ids, args.threads))
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""N concurrent writers against one account, legacy vs atomic balance updates.
+
+    python -m benchmarks.bench_concurrent_writers --writers 16 --operations 200
+
+Half of the writers deposit 1 and the other half withdraw 1, so the final
+balance must equal the opening balance. Any difference is a lost update.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from app.api.services.account_service import AccountService
+from app.models.account import Account
+from app.schemas.account_schemas import AccountTransaction
+from benchmarks.common import bench_database, reset_database, seed_account, timed, summarize
+from utils.money import to_minor, to_major
+
+DOCUMENT_ID = "000000001"
+
+
+def writer(service: AccountService, operation: str, operations: int) -> list:
+    method = service.deposit if operation == "deposit" else service.withdraw
+    transaction = AccountTransaction(user_document=DOCUMENT_ID, value=1,
+                                     transaction_date=datetime.today())
+    return [timed(method, transaction) for _ in range(operations)]
+
+
+def run(atomic: bool, writers: int, operations: int) -> dict:
+    db = bench_database()
+    reset_database(db)
+    opening_balance = writers * operations
+    seed_account(DOCUMENT_ID, to_minor(opening_balance))
+    service = AccountService(db, atomic=atomic)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=writers) as pool:
+        futures = [pool.submit(writer, service, "deposit" if i % 2 == 0 else "withdraw", operations)
+                   for i in range(writers)]
+        latencies = [latency for future in futures for latency in future.result()]
+    elapsed = time.perf_counter() - start
+
+    expected_balance = opening_balance + (writers + 1) // 2 * operations - writers // 2 * operations
+    final_balance = to_major(Account.find_by_document_id(DOCUMENT_ID).balance)
+    return {
+        "mode": "atomic" if atomic else "legacy",
+        **summarize(latencies, elapsed),
+        "expected_balance": expected_balance,
+        "final_balance": final_balance,
+        "lost_updates": abs(expected_balance - final_balance)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--operations", type=int, default=200)
+    args = parser.parse_args()
+
+    for atomic in (False, True):
+        print(run(atomic, args.writers, args.operations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""Latency and throughput of every registered route, driven in-process.
+
+    python -m benchmarks.bench_endpoints --requests 500 --concurrency 32
+    python -m benchmarks.bench_endpoints --save-baseline
+    python -m benchmarks.bench_endpoints --compare
+
+Requests go through the ASGI app from app/api/routes/routes.py with
+httpx.ASGITransport, so routing, validation, services and models all run as
+in production, against the mongod at MONGODB_PATH (``docker compose up db``).
+Data lives in the bench_bank database, which is wiped before each run.
+
+``--compare`` fails (exit code 1) when an endpoint's throughput drops or its
+p99 grows by more than ``--tolerance`` against the stored baseline. The
+baseline in benchmarks/baselines/endpoints.json is recorded against the
+docker-compose mongod, and carries the hardware, mongod version and load it
+was recorded with; ``--compare`` warns when this run's differ.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+from pathlib import Path
+
+os.environ["MONGODB_DATABASE"] = "bench_bank"
+
+import httpx
+from bson import Int64
+from fastapi.routing import APIRoute
+
+from app.api.routes.routes import application, bind_database
+from app.database.mongodb import ensure_indexes
+from app.models.account import Account
+from benchmarks.common import reset_database, seed_account, summarize
+
+# httpx.ASGITransport doesn't run the lifespan, so bind the database up front
+db = bind_database()
+BASELINE_PATH = Path(__file__).parent / "baselines" / "endpoints.json"
+POOL_SIZE = 100
+POOL_HISTORY = 20
+IMPORT_ROWS = 100
+
+
+def user(document_id: str) -> dict:
+    return {
+        "firstname": "Bench",
+        "lastname": document_id,
+        "document_id": document_id,
+        "phone": f"phone-{document_id}",
+        "birthdate": "2000-01-01",
+        "email": f"{document_id}@bench.local"
+    }
+
+
+def pool_document(i: int) -> str:
+    return f"1{i % POOL_SIZE:08d}"
+
+
+def transaction(document_id: str, **extra) -> dict:
+    return {"user_document": document_id, "value": 1,
+            "transaction_date": time.strftime("%Y-%m-%d %H:%M:%S"), **extra}
+
+
+def import_body(prefix: str, i: int) -> bytes:
+    # One request imports IMPORT_ROWS fresh users as raw NDJSON
+    return "".join(json.dumps({**user(f"{prefix}{i * IMPORT_ROWS + k:08d}"), "balance": 10}) + "\n"
+                   for k in range(IMPORT_ROWS)).encode()
+
+
+def seed_users(prefix: str, n: int, with_accounts: bool=False) -> None:
+    users = [user(f"{prefix}{i:08d}") for i in range(n)]
+    db.users.insert_many(users)
+    if with_accounts:
+        db.accounts.insert_many([{"account_id": f"{prefix}{i:013d}", "user_document": u["document_id"],
+                                  "balance": Int64(0), "is_frozen": False, "daily_transactions": {},
+                                  "last_date_transaction": None} for i, u in enumerate(users)])
+
+
+def seed_pool() -> None:
+    for i in range(POOL_SIZE):
+        account = seed_account(pool_document(i), 1000000)
+        for _ in range(POOL_HISTORY):
+            account.add_transaction("deposit", 1, transaction_time=time.strftime("%Y-%m-%d %H:%M:%S"))
+
+
+# path -> (setup(n), request(i) -> (method, params, json or raw bytes))
+SCENARIOS = {
+    "/create-user": (None, lambda i: ("POST", None, user(f"2{i:08d}"))),
+    "/create-account": (lambda n: seed_users("3", n),
+                        lambda i: ("POST", None, {"user_document": f"3{i:08d}", "balance": 0})),
+    "/update-user": (None, lambda i: ("POST", None, {"document_id": pool_document(i),
+                                                     "phone": f"updated-{i}",
+                                                     "email": f"updated-{i}@bench.local"})),
+    "/delete-user": (lambda n: seed_users("4", n), lambda i: ("POST", None, user(f"4{i:08d}"))),
+    "/info-user": (None, lambda i: ("POST", None, user(pool_document(i)))),
+    "/delete-account": (lambda n: seed_users("5", n, with_accounts=True),
+                        lambda i: ("POST", None, {"user_document": f"5{i:08d}"})),
+    "/freeze-account": (lambda n: seed_users("6", POOL_SIZE, with_accounts=True),
+                        lambda i: ("POST", None, {"user_document": f"6{i % POOL_SIZE:08d}"})),
+    "/unfreeze-account": (None, lambda i: ("POST", None, {"user_document": f"6{i % POOL_SIZE:08d}"})),
+    "/check-balance-account": (None, lambda i: ("POST", None, {"user_document": pool_document(i)})),
+    "/deposit-account": (None, lambda i: ("POST", None, transaction(pool_document(i)))),
+    "/withdraw-account": (None, lambda i: ("POST", None, transaction(pool_document(i)))),
+    "/transfer-account": (None, lambda i: ("POST", None, transaction(pool_document(i),
+                                                                     recipient_document=pool_document(i + 1)))),
+    "/batch-transactions": (None, lambda i: ("POST", None, [transaction(pool_document(i + k), operation="deposit")
+                                                            for k in range(10)])),
+    "/get-transactions-history": (None, lambda i: ("POST", None, {"user_document": pool_document(i)})),
+    "/export-transactions-history": (None, lambda i: ("POST", {"format": "ndjson"},
+                                                      {"user_document": pool_document(i)})),
+    "/statement-account": (None, lambda i: ("POST", None, {"user_document": pool_document(i),
+                                                           "month": time.strftime("%Y-%m")})),
+    "/hot-account": (None, lambda i: ("POST", None, {"user_document": pool_document(i), "shards": 4})),
+    "/import-onboarding": (None, lambda i: ("POST", {"format": "ndjson"}, import_body("8", i))),
+    "/pool-stats": (None, lambda i: ("GET", None, None)),
+    "/cache-stats": (None, lambda i: ("GET", None, None)),
+    "/metrics": (None, lambda i: ("GET", None, None))
+}
+
+
+def registered_paths() -> list:
+    return [route.path for route in application.routes if isinstance(route, APIRoute)]
+
+
+async def run_endpoint(client: httpx.AsyncClient, path: str, requests: int, concurrency: int) -> dict:
+    setup, build_request = SCENARIOS[path]
+    if setup:
+        setup(requests)
+
+    latencies = []
+    errors = 0
+    next_request = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in next_request:
+            method, params, body = build_request(i)
+            start = time.perf_counter()
+            payload = {"content": body} if isinstance(body, bytes) else {"json": body}
+            response = await client.request(method, path, params=params, **payload)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {**summarize(latencies, time.perf_counter() - start), "errors": errors}
+
+
+async def run(requests: int, concurrency: int) -> dict:
+    missing = [path for path in registered_paths() if path not in SCENARIOS]
+    if missing:
+        raise SystemExit(f"No benchmark scenario for: {', '.join(missing)}")
+
+    reset_database(db)
+    ensure_indexes(db)
+    Account.balance_cache.clear()
+    seed_pool()
+
+    results = {}
+    transport = httpx.ASGITransport(app=application)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for path in registered_paths():
+            results[path] = await run_endpoint(client, path, requests, concurrency)
+            print(f"{path:32} {results[path]}")
+
+    return results
+
+
+def hardware_notes(requests: int, concurrency: int) -> dict:
+    # Numbers only compare across runs on the same machine, mongod and load
+    return {"platform": platform.platform(), "machine": platform.machine(), "cpus": os.cpu_count(),
+            "python": platform.python_version(), "mongod": db.command("buildInfo")["version"],
+            "requests": requests, "concurrency": concurrency}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for path, expected in baseline.items():
+        current = results.get(path)
+        if current is None:
+            continue
+        if current["ops_per_sec"] < expected["ops_per_sec"] * (1 - tolerance):
+            regressions.append(f"{path}: {current['ops_per_sec']} ops/s < baseline {expected['ops_per_sec']}")
+        if current["p99_ms"] > expected["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{path}: p99 {current['p99_ms']} ms > baseline {expected['p99_ms']}")
+        if current["errors"] > expected.get("errors", 0):
+            regressions.append(f"{path}: {current['errors']} errors")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.requests, args.concurrency))
+    notes = hardware_notes(args.requests, args.concurrency)
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps({"hardware": notes, "results": results}, indent=2))
+        print(f"Baseline written to {args.baseline}")
+
+    if args.compare:
+        if not args.baseline.exists():
+            raise SystemExit(f"No baseline at {args.baseline}; run with --save-baseline first")
+
+        baseline = json.loads(args.baseline.read_text())
+        for key, recorded in baseline["hardware"].items():
+            if notes.get(key) != recorded:
+                print(f"WARNING baseline {key} was {recorded}, this run has {notes.get(key)}")
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+        print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
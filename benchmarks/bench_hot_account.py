@@ -0,0 +1,94 @@
+"""Transfer credits per second into one hot account as its shard count grows.
+
+    python -m benchmarks.bench_hot_account --shards 0 1 2 4 8 16 --concurrency 32 --transfers 4000
+
+Every writer has a sender of its own and credits the same recipient, so with
+``--shards 0`` all transactions conflict on the recipient's account document.
+With K shards a conflict needs two credits to pick the same shard, so the
+abort rate should fall and throughput rise with K until something else (the
+server, the client threads) becomes the bottleneck. The recipient must end
+up with exactly the credited total. Transactions need a replica set
+(``docker compose up db``).
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from pymongo.errors import PyMongoError
+
+from app.api.services.account_service import AccountService
+from app.database.mongodb import ensure_indexes
+from app.database.transactions import TRANSACTION_STATS
+from app.models.account import Account
+from app.schemas.account_schemas import AccountTransaction, AccountHotMode
+from benchmarks.common import bench_database, reset_database, seed_account, timed, summarize
+from utils.money import to_minor
+
+HOT_DOCUMENT = "000000000"
+OPENING_BALANCE = 1000000
+
+
+def sender_document(writer_index: int) -> str:
+    return f"1{writer_index:08d}"
+
+
+def writer(service: AccountService, writer_index: int, transfers: int) -> list:
+    transaction = AccountTransaction(user_document=sender_document(writer_index), recipient_document=HOT_DOCUMENT,
+                                     value=1, transaction_date=datetime.today())
+    latencies = []
+    for _ in range(transfers):
+        try:
+            latencies.append(timed(service.transfer, transaction))
+        except PyMongoError:
+            # Gave up after TRANSACTION_MAX_ATTEMPTS; counted as a failure
+            pass
+
+    return latencies
+
+
+def run(shards: int, concurrency: int, transfers: int) -> dict:
+    db = bench_database()
+    reset_database(db)
+    ensure_indexes(db)
+    seed_account(HOT_DOCUMENT)
+    for writer_index in range(concurrency):
+        seed_account(sender_document(writer_index), to_minor(OPENING_BALANCE))
+    service = AccountService(db, atomic=True)
+    service.set_hot_mode(AccountHotMode(user_document=HOT_DOCUMENT, shards=shards))
+    TRANSACTION_STATS.reset()
+
+    per_writer = transfers // concurrency
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(writer, service, writer_index, per_writer) for writer_index in range(concurrency)]
+        latencies = [latency for future in futures for latency in future.result()]
+    elapsed = time.perf_counter() - start
+
+    stats = TRANSACTION_STATS.stats()
+    attempts = stats["commits"] + stats["refusals"] + stats["transient_retries"] + stats["failures"]
+    return {
+        "shards": shards,
+        **summarize(latencies, elapsed),
+        "abort_rate": round(stats["transient_retries"] / attempts, 3) if attempts else 0.0,
+        "failures": stats["failures"],
+        "conserved": Account.find_by_document_id(HOT_DOCUMENT).balance_check() == to_minor(len(latencies))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shards", type=int, nargs="+", default=[0, 1, 2, 4, 8, 16])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--transfers", type=int, default=4000)
+    args = parser.parse_args()
+
+    baseline = None
+    for shards in args.shards:
+        result = run(shards, args.concurrency, args.transfers)
+        baseline = baseline or result["ops_per_sec"]
+        print(f"{result} speedup={result['ops_per_sec'] / baseline:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Serializing a large history response: response_model + JSONResponse vs FastJSONResponse.
+
+    python -m benchmarks.bench_serialization --rows 10000 --iterations 50
+
+Both variants serve the same in-memory rows, shaped like the output of
+``/get-transactions-history``, through an ASGI app driven by httpx. No database
+is involved, so the numbers isolate FastAPI's response path.
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+from app.api.responses import FastJSONResponse, orjson
+from benchmarks.common import summarize
+
+
+def history_rows(rows: int) -> list:
+    start = datetime(2024, 1, 1)
+    return [{"timestamp": (start + timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M:%S"),
+             "type": "deposit" if i % 2 else "withdraw",
+             "value": round(i * 0.37, 2),
+             "counterpart": None}
+            for i in range(rows)]
+
+
+def build_app(rows: list) -> FastAPI:
+    application = FastAPI()
+
+    @application.get("/before", response_model=List[dict], response_class=JSONResponse)
+    async def before():
+        return rows
+
+    @application.get("/after", response_model=List[dict])
+    async def after():
+        return FastJSONResponse(rows)
+
+    return application
+
+
+async def run(rows: int, iterations: int) -> dict:
+    transport = httpx.ASGITransport(app=build_app(history_rows(rows)))
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for variant in ("before", "after"):
+            await client.get(f"/{variant}")
+            latencies = []
+            start = time.perf_counter()
+            for _ in range(iterations):
+                request_start = time.perf_counter()
+                response = await client.get(f"/{variant}")
+                latencies.append(time.perf_counter() - request_start)
+            results[variant] = {**summarize(latencies, time.perf_counter() - start),
+                                "bytes": len(response.content)}
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    if orjson is None:
+        print("orjson is not installed; FastJSONResponse falls back to JSONResponse")
+
+    results = asyncio.run(run(args.rows, args.iterations))
+    for variant, summary in results.items():
+        print(f"{variant:8} {summary}")
+    print(f"p50 speedup: {results['before']['p50_ms'] / results['after']['p50_ms']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
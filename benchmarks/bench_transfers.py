@@ -0,0 +1,82 @@
+"""Transfers per second and abort rate as concurrent transfers pile onto one account pair.
+
+    python -m benchmarks.bench_transfers --concurrency 1 2 4 8 16 32 --transfers 2000
+
+Every writer moves 1 back and forth between the same two accounts, so all
+transactions conflict on the same documents. The abort rate is the share of
+attempts that hit a TransientTransactionError (write conflict) and had to be
+retried. The total across both accounts must stay unchanged. Transactions
+need a replica set (``docker compose up db``).
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from pymongo.errors import PyMongoError
+
+from app.api.services.account_service import AccountService
+from app.database.transactions import TRANSACTION_STATS
+from app.models.account import Account
+from app.schemas.account_schemas import AccountTransaction
+from benchmarks.common import bench_database, reset_database, seed_account, timed, summarize
+from utils.money import to_minor
+
+PAIR = ("000000001", "000000002")
+OPENING_BALANCE = 1000000
+
+
+def writer(service: AccountService, direction: int, transfers: int) -> list:
+    sender, recipient = PAIR if direction == 0 else PAIR[::-1]
+    transaction = AccountTransaction(user_document=sender, recipient_document=recipient, value=1,
+                                     transaction_date=datetime.today())
+    latencies = []
+    for _ in range(transfers):
+        try:
+            latencies.append(timed(service.transfer, transaction))
+        except PyMongoError:
+            # Gave up after TRANSACTION_MAX_ATTEMPTS; counted as a failure
+            pass
+
+    return latencies
+
+
+def run(concurrency: int, transfers: int) -> dict:
+    db = bench_database()
+    reset_database(db)
+    for document_id in PAIR:
+        seed_account(document_id, to_minor(OPENING_BALANCE))
+    service = AccountService(db)
+    TRANSACTION_STATS.reset()
+
+    per_writer = transfers // concurrency
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(writer, service, i % 2, per_writer) for i in range(concurrency)]
+        latencies = [latency for future in futures for latency in future.result()]
+    elapsed = time.perf_counter() - start
+
+    stats = TRANSACTION_STATS.stats()
+    attempts = stats["commits"] + stats["refusals"] + stats["transient_retries"] + stats["failures"]
+    total = sum(Account.find_by_document_id(document_id).balance for document_id in PAIR)
+    return {
+        "concurrency": concurrency,
+        **summarize(latencies, elapsed),
+        "abort_rate": round(stats["transient_retries"] / attempts, 3) if attempts else 0.0,
+        "failures": stats["failures"],
+        "conserved": total == 2 * to_minor(OPENING_BALANCE)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--transfers", type=int, default=2000)
+    args = parser.parse_args()
+
+    for concurrency in args.concurrency:
+        print(run(concurrency, args.transfers))
+
+
+if __name__ == "__main__":
+    main()
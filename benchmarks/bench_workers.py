@@ -0,0 +1,130 @@
+"""Throughput of the production server as the worker count grows.
+
+    python -m benchmarks.bench_workers --workers 1 2 4 8 --requests 20000 --clients 4
+
+For each worker count, ``run.py`` is started as a real server on
+``--port`` against the bench_bank database, and ``--clients`` load-generator
+processes send ``--concurrency`` requests each in flight over keep-alive
+connections. Load generators run in their own processes so the client side
+isn't the bottleneck; give the machine more cores than the largest worker
+count plus clients for a clean scaling curve.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+
+from benchmarks.common import BENCH_DATABASE, bench_database, reset_database, seed_account, summarize
+
+POOL_SIZE = 100
+SCENARIOS = {
+    "/info-user": lambda i: {"firstname": "Bench", "lastname": document(i), "document_id": document(i),
+                             "phone": f"phone-{document(i)}", "birthdate": "2000-01-01",
+                             "email": f"{document(i)}@bench.local"},
+    "/check-balance-account": lambda i: {"user_document": document(i)},
+    "/get-transactions-history": lambda i: {"user_document": document(i)}
+}
+
+
+def document(i: int) -> str:
+    return f"7{i % POOL_SIZE:08d}"
+
+
+def seed() -> None:
+    db = bench_database()
+    reset_database(db)
+    for i in range(POOL_SIZE):
+        seed_account(document(i), 1000000)
+
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    env = {**os.environ, "MONGODB_DATABASE": BENCH_DATABASE, "ENSURE_INDEXES_ON_STARTUP": "false"}
+    return subprocess.Popen([sys.executable, "run.py", "--host", "127.0.0.1", "--port", str(port),
+                             "--workers", str(workers)],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_until_ready(base_url: str, timeout: float=30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/pool-stats").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+
+    raise SystemExit(f"Server at {base_url} did not come up within {timeout}s")
+
+
+def load(base_url: str, path: str, offset: int, requests: int, concurrency: int) -> tuple:
+    async def run():
+        latencies = []
+        errors = 0
+        next_request = iter(range(offset, offset + requests))
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+            async def worker():
+                nonlocal errors
+                for i in next_request:
+                    start = time.perf_counter()
+                    response = await client.post(path, json=SCENARIOS[path](i))
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code >= 400:
+                        errors += 1
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+        return latencies, errors
+
+    return asyncio.run(run())
+
+
+def measure(base_url: str, path: str, requests: int, clients: int, concurrency: int) -> dict:
+    per_client = requests // clients
+    with ProcessPoolExecutor(max_workers=clients, mp_context=multiprocessing.get_context("spawn")) as pool:
+        start = time.perf_counter()
+        futures = [pool.submit(load, base_url, path, n * per_client, per_client, concurrency)
+                   for n in range(clients)]
+        results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+
+    latencies = [latency for client_latencies, _ in results for latency in client_latencies]
+    return {**summarize(latencies, elapsed), "errors": sum(errors for _, errors in results)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--path", choices=sorted(SCENARIOS), default="/info-user")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    seed()
+    base_url = f"http://127.0.0.1:{args.port}"
+    baseline = None
+    for workers in args.workers:
+        server = start_server(workers, args.port)
+        try:
+            wait_until_ready(base_url)
+            measure(base_url, args.path, args.clients * args.concurrency, args.clients, args.concurrency)
+            result = measure(base_url, args.path, args.requests, args.clients, args.concurrency)
+        finally:
+            server.terminate()
+            server.wait()
+
+        baseline = baseline or result["ops_per_sec"]
+        print(f"workers={workers:<3} {result} speedup={result['ops_per_sec'] / baseline:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
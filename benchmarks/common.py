@@ -0,0 +1,45 @@
+import statistics
+import time
+
+from app.database.mongodb import MongoClientManager
+from app.models.user import User
+from app.models.account import Account
+
+BENCH_DATABASE = "bench_bank"
+
+
+def bench_database():
+    db = MongoClientManager.get_database(BENCH_DATABASE)
+    User.set_database(db)
+    Account.set_database(db)
+    return db
+
+
+def reset_database(db) -> None:
+    for name in db.list_collection_names():
+        db[name].delete_many({})
+    User.cache.clear()
+
+
+def seed_account(document_id: str, balance=0) -> Account:
+    User("Bench", document_id, document_id, f"phone-{document_id}", "2000-01-01",
+         f"{document_id}@bench.local").create()
+    account = Account(document_id, balance, False)
+    account.create()
+    return account
+
+
+def timed(operation, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    operation(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def summarize(latencies: list, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(statistics.median(latencies) * 1000, 3) if latencies else 0.0,
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3) if latencies else 0.0
+    }
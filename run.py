@@ -1,5 +1,44 @@
-from app.api.routes.routes import application
+import argparse
+import importlib.util
+import os
+
 import uvicorn
 
+from utils.static_vars import SERVER_HOST, SERVER_PORT, SERVER_WORKERS
+
+APPLICATION = "app.api.routes.routes:application"
+
+
+def event_loop() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def http_protocol() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def configure_workers(workers: int) -> None:
+    # Workers are spawned afresh and inherit the environment; each one's caches
+    # would miss the invalidations of writes served by the others.
+    if workers > 1:
+        os.environ["PROCESS_CACHES"] = "false"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the bank API with one or more worker processes.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS,
+                        help="worker processes; more than one turns the in-process caches off")
+    parser.add_argument("--access-log", action="store_true")
+    args = parser.parse_args()
+
+    configure_workers(args.workers)
+    # The app is passed as an import string so every worker imports it afresh;
+    # Mongo clients are only created in each worker's lifespan.
+    uvicorn.run(APPLICATION, host=args.host, port=args.port, workers=args.workers,
+                loop=event_loop(), http=http_protocol(), access_log=args.access_log)
+
+
 if __name__ == "__main__":
-    uvicorn.run(application, port=8000)
\ No newline at end of file
+    main()
@@ -1,3 +1,4 @@
+import json
 import pytest
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
@@ -7,8 +8,10 @@ from app.api.endpoints.accounts_endpoints import AccountAPI
 
 from app.models.user import User
 from app.models.account import Account
+from app.models.idempotency import IdempotencyKey
 from app.api.services.user_service import UserService
 from app.api.services.account_service import AccountService
+from app.api.services.idempotency_service import IdempotencyService
 from app.schemas.user_schemas import *
 from app.schemas.account_schemas import *
 from utils.static_vars import MONGODB_PATH
@@ -22,11 +25,18 @@ def db():
     db = client.test_bank
     User.set_database(db)
     Account.set_database(db)
+    IdempotencyKey.set_database(db)
     yield db
 
     db.users.delete_many({})
+    User.cache.clear()
     db.accounts.delete_many({})
     db.transactions_history.delete_many({})
+    db.statements.delete_many({})
+    db.balance_shards.delete_many({})
+    db.idempotency_keys.delete_many({})
+    Account.balance_cache.clear()
+    IdempotencyKey.cache.clear()
     client.close()
 
 
@@ -85,7 +95,7 @@ def app(db):
 
     # Setup Account routes
     account_service = AccountService(db)
-    account_api = AccountAPI(account_service)
+    account_api = AccountAPI(account_service, IdempotencyService(db))
     account_router.post("/create-account")(account_api.create_account)
     account_router.post("/delete-account")(account_api.delete_account)
     account_router.post("/freeze-account")(account_api.freeze_account)
@@ -94,7 +104,11 @@ def app(db):
     account_router.post("/deposit-account")(account_api.deposit)
     account_router.post("/withdraw-account")(account_api.withdraw)
     account_router.post("/transfer-account")(account_api.transfer)
+    account_router.post("/batch-transactions", response_model=List[dict])(account_api.apply_batch)
     account_router.post("/get-transactions-history", response_model=List[dict])(account_api.get_transactions_history)
+    account_router.post("/export-transactions-history")(account_api.export_transactions_history)
+    account_router.post("/statement-account", response_model=dict)(account_api.get_statement)
+    account_router.post("/hot-account", response_model=dict)(account_api.set_hot_mode)
 
     # Include routers in the app
     application.include_router(user_router)
@@ -237,8 +251,167 @@ def test_api_get_transactions_history(db, client, default_user, default_account)
     assert response.status_code == 200
 
 
+def test_api_get_transactions_history_paginated(db, client, default_user, default_account):
+    user_data = UserData(**default_user)
+    client.post("/create-user", json=user_data.to_dict())
+    account_data = AccountData(**default_account)
+    client.post("/create-account", json=account_data.to_dict())
+    for _ in range(3):
+        client.post("/deposit-account", json=AccountTransaction(
+            user_document=user_data.document_id,
+            value=10,
+            transaction_date=datetime.today()
+        ).to_dict())
+
+    request_history = AccountHistoryRequest(user_document=user_data.document_id, page_size=2)
+    first_page = client.post("/get-transactions-history", json=request_history.to_dict())
+    request_history.continuation_token = first_page.headers["X-Continuation-Token"]
+    second_page = client.post("/get-transactions-history", json=request_history.to_dict())
+
+    assert len(first_page.json()) == 2
+    assert len(second_page.json()) == 1
+    assert "X-Continuation-Token" not in second_page.headers
+
+
+def test_api_export_transactions_history_ndjson(db, client, default_user, default_account):
+    user_data = UserData(**default_user)
+    client.post("/create-user", json=user_data.to_dict())
+    account_data = AccountData(**default_account)
+    client.post("/create-account", json=account_data.to_dict())
+    for _ in range(2):
+        client.post("/deposit-account", json=AccountTransaction(
+            user_document=user_data.document_id,
+            value=10,
+            transaction_date=datetime.today()
+        ).to_dict())
+
+    request_history = AccountHistoryRequest(user_document=user_data.document_id)
+    response = client.post("/export-transactions-history?format=ndjson", json=request_history.to_dict())
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [line["type"] for line in lines] == ["deposit", "deposit"]
+
+
+def test_api_batch_transactions(db, client, default_user, default_account):
+    user_data = UserData(**default_user)
+    client.post("/create-user", json=user_data.to_dict())
+    account_data = AccountData(**default_account)
+    client.post("/create-account", json=account_data.to_dict())
+    items = [
+        AccountBatchTransaction(user_document=user_data.document_id, value=10, operation="deposit",
+                                transaction_date=datetime.today()).to_dict(),
+        AccountBatchTransaction(user_document=user_data.document_id, value=20, operation="withdraw",
+                                transaction_date=datetime.today()).to_dict()
+    ]
+
+    response = client.post("/batch-transactions", json=items)
+
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()] == ["applied", "applied"]
+    assert response.json()[1]["balance"] == 40
+
+
+def test_api_statement_account(db, client, default_user, default_account):
+    user_data = UserData(**default_user)
+    client.post("/create-user", json=user_data.to_dict())
+    client.post("/create-account", json=AccountData(**default_account).to_dict())
+    client.post("/deposit-account", json=AccountTransaction(user_document=user_data.document_id, value=10,
+                                                            transaction_date=datetime(2024, 1, 15, 9)).to_dict())
+
+    response = client.post("/statement-account", json={"user_document": user_data.document_id, "month": "2024-01"})
+    missing = client.post("/statement-account", json={"user_document": "000000000", "month": "2024-01"})
+
+    assert response.status_code == 200
+    assert response.json()["closing_balance"] == 60
+    assert missing.status_code == 404
+
+
+def test_api_hot_account(db, client, default_user, default_account):
+    user_data = UserData(**default_user)
+    client.post("/create-user", json=user_data.to_dict())
+    client.post("/create-account", json=AccountData(**default_account).to_dict())
+
+    response = client.post("/hot-account", json={"user_document": user_data.document_id, "shards": 4})
+    too_many = client.post("/hot-account", json={"user_document": user_data.document_id, "shards": 100000})
+    missing = client.post("/hot-account", json={"user_document": "000000000", "shards": 4})
+    balance = client.post("/check-balance-account", json={"user_document": user_data.document_id})
+
+    assert response.status_code == 200
+    assert response.json() == {"user_document": user_data.document_id, "shards": 4}
+    assert too_many.status_code == 422
+    assert missing.status_code == 404
+    assert balance.json()["balance"] == 50
+
+
+def test_api_deposit_replays_idempotent_request(db, client, default_user, default_account):
+    user_data = UserData(**default_user)
+    client.post("/create-user", json=user_data.to_dict())
+    account_data = AccountData(**default_account)
+    client.post("/create-account", json=account_data.to_dict())
+    transaction_data = AccountTransaction(
+        user_document=user_data.document_id,
+        value=50,
+        transaction_date=datetime.today()
+    ).to_dict()
+    headers = {"Idempotency-Key": "deposit-1"}
+
+    first = client.post("/deposit-account", json=transaction_data, headers=headers)
+    replay = client.post("/deposit-account", json=transaction_data, headers=headers)
+
+    assert first.json() == replay.json() == {"balance": 100}
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert client.post("/check-balance-account", json=account_data.to_dict()).json()["balance"] == 100
+
 
+def test_api_deposit_replays_retry_without_transaction_date(db, client, default_user, default_account):
+    user_data = UserData(**default_user)
+    client.post("/create-user", json=user_data.to_dict())
+    account_data = AccountData(**default_account)
+    client.post("/create-account", json=account_data.to_dict())
+    transaction_data = {"user_document": user_data.document_id, "value": 50}
+    headers = {"Idempotency-Key": "deposit-1"}
+
+    first = client.post("/deposit-account", json=transaction_data, headers=headers)
+    replay = client.post("/deposit-account", json=transaction_data, headers=headers)
 
+    assert replay.status_code == 200
+    assert first.json() == replay.json() == {"balance": 100}
+    assert replay.headers["Idempotent-Replayed"] == "true"
 
 
+def test_api_deposit_recording_failure_is_not_applied_twice(db, client, default_user, default_account,
+                                                           monkeypatch):
+    user_data = UserData(**default_user)
+    client.post("/create-user", json=user_data.to_dict())
+    account_data = AccountData(**default_account)
+    client.post("/create-account", json=account_data.to_dict())
+    transaction_data = {"user_document": user_data.document_id, "value": 50}
+    headers = {"Idempotency-Key": "deposit-1"}
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("history unavailable")
+
+    monkeypatch.setattr(Account, "add_transaction", fail)
+    first = client.post("/deposit-account", json=transaction_data, headers=headers)
+    monkeypatch.undo()
+    retry = client.post("/deposit-account", json=transaction_data, headers=headers)
+
+    assert first.status_code == retry.status_code == 500
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert client.post("/check-balance-account", json=account_data.to_dict()).json()["balance"] == 100
+
+
+def test_api_idempotency_key_reused_for_other_request(db, client, default_user, default_account):
+    user_data = UserData(**default_user)
+    client.post("/create-user", json=user_data.to_dict())
+    client.post("/create-account", json=AccountData(**default_account).to_dict())
+    headers = {"Idempotency-Key": "deposit-1"}
+    transaction_data = AccountTransaction(user_document=user_data.document_id, value=50,
+                                          transaction_date=datetime.today()).to_dict()
+
+    client.post("/deposit-account", json=transaction_data, headers=headers)
+    response = client.post("/deposit-account", json={**transaction_data, "value": 60}, headers=headers)
 
+    assert response.status_code == 422
@@ -0,0 +1,34 @@
+import pytest
+from fastapi import FastAPI, APIRouter
+from fastapi.testclient import TestClient
+from app.api.middleware import RequestMetricsMiddleware
+from utils.metrics import Histogram
+
+
+@pytest.fixture
+def histogram():
+    return Histogram("test_request_seconds", "", ("method", "route", "status"))
+
+
+@pytest.fixture
+def client(histogram):
+    application = FastAPI()
+    application.add_middleware(RequestMetricsMiddleware, histogram=histogram)
+    router = APIRouter()
+    router.post("/check-balance-account", response_model=dict)(lambda: {"balance": 50})
+    application.include_router(router)
+
+    return TestClient(application)
+
+
+def test_middleware_labels_requests_by_route(client, histogram):
+    client.post("/check-balance-account")
+    client.post("/check-balance-account")
+
+    assert histogram.samples(("POST", "/check-balance-account", "200"))["count"] == 2
+
+
+def test_middleware_groups_unknown_paths(client, histogram):
+    client.get("/does-not-exist")
+
+    assert histogram.samples(("GET", "unmatched", "404"))["count"] == 1
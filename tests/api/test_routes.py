@@ -0,0 +1,19 @@
+import pytest
+from app.api.routes.routes import bind_database, account_api, user_api, onboarding_api
+from app.database.mongodb import MongoClientManager
+from app.models.account import Account, AsyncAccount
+
+
+@pytest.fixture
+def bound():
+    yield bind_database("test_bank")
+
+    MongoClientManager.close()
+
+
+def test_bind_database_wires_models_and_services(bound):
+    assert Account.get_database().name == "test_bank"
+    assert AsyncAccount.get_database().name == "test_bank"
+    assert account_api.account_service._db.name == "test_bank"
+    assert user_api.user_service is not None
+    assert onboarding_api.onboarding_service._db.name == "test_bank"
@@ -19,6 +19,7 @@ def db():
     yield db
 
     db.users.delete_many({})
+    User.cache.clear()
     client.close()
 
 
@@ -0,0 +1,67 @@
+import pytest
+from pymongo import MongoClient
+from app.database.indexes import *
+from app.database.mongodb import INDEXES
+
+from utils.static_vars import MONGODB_PATH
+
+
+@pytest.fixture
+def db():
+    client = MongoClient(MONGODB_PATH)
+    db = client.test_bank
+    yield db
+
+    for collection in INDEXES:
+        db[collection].drop()
+    client.close()
+
+
+def test_ensure_indexes_creates_declared_indexes(db):
+    ensure_indexes(db)
+
+    assert "user_document_1_account_id_1" in db.accounts.index_information()
+    assert "firstname_1_lastname_1" in db.users.index_information()
+
+
+def test_model_queries_avoid_collscan(db):
+    ensure_indexes(db)
+
+    assert verify_query_plans(db) == []
+
+
+def test_verify_query_plans_reports_fetch_in_covered_query(db):
+    ensure_indexes(db)
+    db.accounts.drop_index("user_document_1_account_id_1")
+    db.accounts.create_index("user_document")
+
+    failures = verify_query_plans(db)
+
+    assert {(failure["query"], failure["problem"]) for failure in failures} == {
+        ("Account.exists", "FETCH"), ("Account.find_by_document_id(ids)", "FETCH")
+    }
+
+
+def test_verify_query_plans_reports_in_memory_sort(db):
+    ensure_indexes(db)
+    db.transactions_history.drop_index("account_id_1_day_1__id_1")
+    db.transactions_history.create_index([("account_id", 1), ("day", 1)])
+
+    failures = {failure["query"]: failure["problem"] for failure in verify_query_plans(db)}
+
+    assert failures["Account.get_transaction_history"] == "SORT"
+
+
+def test_verify_query_plans_reports_collscan(db):
+    db.accounts.insert_one({"account_id": "0"})
+
+    failures = verify_query_plans(db)
+
+    assert "Account.find_by_document_id" in [failure["query"] for failure in failures]
+
+
+def test_winning_plan_stages_ignores_rejected_plans():
+    explain = {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}},
+                                "rejectedPlans": [{"stage": "COLLSCAN"}]}}
+
+    assert winning_plan_stages(explain) == {"FETCH", "IXSCAN"}
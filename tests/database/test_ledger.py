@@ -0,0 +1,36 @@
+import pytest
+from bson import Int64
+from pymongo import MongoClient
+from app.database.ledger import *
+from app.database.mongodb import INDEXES
+
+from utils.static_vars import MONGODB_PATH
+
+
+@pytest.fixture
+def db():
+    client = MongoClient(MONGODB_PATH)
+    db = client.test_bank
+    db.ledger.create_indexes(INDEXES["ledger"])
+    Ledger.set_database(db)
+    yield db
+
+    db.ledger.drop()
+    db.ledger_snapshots.drop()
+    db.accounts.drop()
+    client.close()
+
+
+def test_compact_and_rebuild_across_workers(db):
+    account_ids = [f"150120240000{i:02d}" for i in range(10)]
+    db.accounts.insert_many([{"account_id": account_id, "balance": Int64(0)} for account_id in account_ids])
+    for i, account_id in enumerate(account_ids):
+        Ledger.open(account_id, 0)
+        Ledger.append(account_id, i, "deposit")
+
+    summary = compact_ledger(db, workers=3, batch_size=4)
+    corrected = rebuild_balances(db, workers=3, batch_size=4)
+
+    assert summary == {"snapshots": 10, "pruned": 10, "drifted": []}
+    assert corrected == 9
+    assert [account["balance"] for account in db.accounts.find({}).sort("account_id", 1)] == list(range(10))
@@ -0,0 +1,120 @@
+import pytest
+from bson import Int64
+from pymongo import MongoClient
+from datetime import datetime
+from app.database.migrations import *
+
+from utils.static_vars import MONGODB_PATH
+
+
+@pytest.fixture
+def db():
+    client = MongoClient(MONGODB_PATH)
+    db = client.test_bank
+    yield db
+
+    db.transactions_history.drop()
+    db.accounts.drop()
+    db.statements.drop()
+    db.ledger_snapshots.drop()
+    client.close()
+
+
+def test_bucket_transactions_history(db):
+    db.transactions_history.insert_one({
+        "account_id": "15012024000001",
+        "transactions": [
+            {"timestamp": datetime(2024, 1, 16, 9), "type": "withdraw", "value": 5, "counterpart": None},
+            {"timestamp": datetime(2024, 1, 15, 9), "type": "deposit", "value": 10, "counterpart": None},
+            {"timestamp": datetime(2024, 1, 15, 18), "type": "deposit", "value": 20, "counterpart": None}
+        ]
+    })
+
+    migrated = bucket_transactions_history(db, bucket_size=1)
+    buckets = list(db.transactions_history.find({}).sort([("day", 1), ("_id", 1)]))
+
+    assert migrated == 1
+    assert [bucket["day"] for bucket in buckets] == [datetime(2024, 1, 15), datetime(2024, 1, 15), datetime(2024, 1, 16)]
+    assert [bucket["transactions"][0]["value"] for bucket in buckets] == [10, 20, 5]
+    assert bucket_transactions_history(db) == 0
+
+
+def test_minor_unit_amounts(db):
+    db.accounts.insert_many([
+        {"account_id": "15012024000001", "balance": 29.99},
+        {"account_id": "15012024000002", "balance": Int64(5000)}
+    ])
+    db.transactions_history.insert_one({
+        "account_id": "15012024000001",
+        "day": datetime(2024, 1, 15),
+        "count": 3,
+        "transactions": [
+            {"timestamp": datetime(2024, 1, 15, 9), "type": "deposit", "value": 0.29, "counterpart": None},
+            {"timestamp": datetime(2024, 1, 15, 10), "type": "deposit", "value": Int64(100), "counterpart": None},
+            {"timestamp": datetime(2024, 1, 15, 11), "type": "deposit", "value": None, "counterpart": None}
+        ]
+    })
+
+    migrated = minor_unit_amounts(db)
+    balances = [account["balance"] for account in db.accounts.find({}).sort("account_id", 1)]
+    values = [t["value"] for t in db.transactions_history.find_one({})["transactions"]]
+
+    assert migrated == 2
+    assert balances == [2999, 5000]
+    assert all(isinstance(balance, Int64) for balance in balances)
+    assert values == [29, 100, None]
+    assert minor_unit_amounts(db) == 0
+
+
+def test_backfill_statements(db):
+    db.accounts.insert_one({"account_id": "15012024000001", "balance": Int64(65)})
+    db.transactions_history.insert_many([
+        {"account_id": "15012024000001", "day": datetime(2024, 1, 15), "count": 2, "transactions": [
+            {"timestamp": datetime(2024, 1, 15, 9), "type": "deposit", "value": Int64(30), "counterpart": None},
+            {"timestamp": datetime(2024, 1, 15, 10), "type": "withdraw", "value": Int64(20), "counterpart": None}
+        ]},
+        {"account_id": "15012024000001", "day": datetime(2024, 3, 1), "count": 1, "transactions": [
+            {"timestamp": datetime(2024, 3, 1, 9), "type": "deposit", "value": Int64(5), "counterpart": None}
+        ]}
+    ])
+
+    written = backfill_statements(db)
+    statements = {statement["month"]: statement for statement in db.statements.find({})}
+
+    assert written == 2
+    assert statements["2024-01"]["net"] == 10
+    assert statements["2024-01"]["totals"] == {"deposit": 30, "withdraw": 20}
+    assert statements["2024-03"]["net"] == 5
+    assert "opening_balance" not in statements["2024-03"]
+
+
+def test_open_ledger_snapshots(db):
+    db.accounts.insert_many([
+        {"account_id": "15012024000001", "balance": Int64(500)},
+        {"account_id": "15012024000002", "balance": Int64(0)}
+    ])
+
+    created = open_ledger_snapshots(db)
+    snapshot = db.ledger_snapshots.find_one({"_id": "15012024000001:0"})
+
+    assert created == 2
+    assert (snapshot["seq"], snapshot["balance"]) == (0, 500)
+    assert open_ledger_snapshots(db) == 0
+
+
+def test_covering_account_indexes(db):
+    db.accounts.create_index("user_document")
+
+    assert covering_account_indexes(db) == 1
+    assert "user_document_1" not in db.accounts.index_information()
+    assert "user_document_1_account_id_1" in db.accounts.index_information()
+    assert covering_account_indexes(db) == 0
+
+
+def test_history_sort_index(db):
+    db.transactions_history.create_index([("account_id", 1), ("day", 1)])
+
+    assert history_sort_index(db) == 1
+    assert "account_id_1_day_1" not in db.transactions_history.index_information()
+    assert "account_id_1_day_1__id_1" in db.transactions_history.index_information()
+    assert history_sort_index(db) == 0
@@ -0,0 +1,79 @@
+import os
+import pytest
+from datetime import timedelta
+from pymongo import monitoring
+from app.database.mongodb import *
+from utils.metrics import Histogram
+
+
+ADDRESS = ("localhost", 27017)
+
+
+@pytest.fixture
+def listener():
+    return PoolStatsListener()
+
+
+def test_pool_listener_counts_checkouts(listener):
+    listener.connection_created(monitoring.ConnectionCreatedEvent(ADDRESS, 1))
+    listener.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(ADDRESS))
+    listener.connection_checked_out(monitoring.ConnectionCheckedOutEvent(ADDRESS, 1))
+
+    stats = listener.stats()
+
+    assert stats["connections_open"] == 1
+    assert stats["checked_out"] == 1
+    assert stats["checkouts"] == 1
+
+    listener.connection_checked_in(monitoring.ConnectionCheckedInEvent(ADDRESS, 1))
+
+    assert listener.stats()["checked_out"] == 0
+
+
+def test_pool_listener_counts_wait_queue_timeouts(listener):
+    listener.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(ADDRESS))
+    listener.connection_check_out_failed(monitoring.ConnectionCheckOutFailedEvent(
+        ADDRESS, monitoring.ConnectionCheckOutFailedReason.TIMEOUT))
+
+    stats = listener.stats()
+
+    assert stats["checkout_failures"] == 1
+    assert stats["wait_queue_timeouts"] == 1
+    assert stats["checked_out"] == 0
+
+
+def test_client_manager_shares_one_client():
+    db = MongoClientManager.get_database("test_bank")
+    db.command("ping")
+
+    assert MongoClientManager.get_client() is db.client
+    assert MongoClientManager.pool_stats()["checkouts"] >= 1
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_forked_child_builds_its_own_client():
+    parent_client = MongoClientManager.get_client()
+
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if MongoClientManager._client is None and MongoClientManager.get_client() is not parent_client
+                 else 1)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert MongoClientManager.get_client() is parent_client
+
+
+def test_command_listener_labels_by_command_and_collection():
+    histogram = Histogram("test_command_seconds", "", ("command", "collection", "outcome"))
+    listener = CommandMetricsListener(histogram)
+
+    listener.started(monitoring.CommandStartedEvent({"find": "accounts", "filter": {}}, "test_bank", 1, ADDRESS, 1))
+    listener.succeeded(monitoring.CommandSucceededEvent(timedelta(milliseconds=3), {"ok": 1}, "find", 1, ADDRESS, 1))
+    listener.started(monitoring.CommandStartedEvent({"getMore": 42, "collection": "transactions_history"},
+                                                    "test_bank", 2, ADDRESS, 2))
+    listener.failed(monitoring.CommandFailedEvent(timedelta(milliseconds=1), {"ok": 0}, "getMore", 2, ADDRESS, 2))
+
+    assert histogram.samples(("find", "accounts", "success"))["count"] == 1
+    assert histogram.samples(("find", "accounts", "success"))["sum"] == pytest.approx(0.003)
+    assert histogram.samples(("getMore", "transactions_history", "failure"))["count"] == 1
@@ -0,0 +1,119 @@
+import pytest
+from pymongo.errors import DuplicateKeyError, PyMongoError
+import app.database.transactions as transactions
+from app.database.transactions import *
+
+
+class FakeSession:
+    def __init__(self, commit_errors=()):
+        self.commit_errors = list(commit_errors)
+        self.in_transaction = False
+        self.started = 0
+        self.aborted = 0
+        self.commits = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def start_transaction(self):
+        self.in_transaction = True
+        self.started += 1
+
+    def abort_transaction(self):
+        self.in_transaction = False
+        self.aborted += 1
+
+    def commit_transaction(self):
+        self.commits += 1
+        self.in_transaction = False
+        if self.commit_errors:
+            raise self.commit_errors.pop(0)
+
+
+class FakeClient:
+    def __init__(self, session):
+        self.session = session
+
+    def start_session(self):
+        return self.session
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(transactions, "backoff_delay", lambda attempt: 0)
+    TRANSACTION_STATS.reset()
+
+
+def transient(label: str=TRANSIENT_ERROR) -> PyMongoError:
+    return PyMongoError("conflict", error_labels=[label])
+
+
+def test_retries_transient_errors_then_commits():
+    session = FakeSession()
+    failures = [transient(), transient()]
+
+    def callback(s):
+        if failures:
+            raise failures.pop(0)
+        return "done"
+
+    assert run_in_transaction(FakeClient(session), callback) == "done"
+    assert (session.started, session.aborted, session.commits) == (3, 2, 1)
+    assert TRANSACTION_STATS.stats()["transient_retries"] == 2
+
+
+def test_retries_only_the_commit_on_unknown_result():
+    session = FakeSession(commit_errors=[transient(UNKNOWN_COMMIT_RESULT)])
+    calls = []
+
+    assert run_in_transaction(FakeClient(session), lambda s: calls.append(s) or "done") == "done"
+    assert len(calls) == 1
+    assert session.commits == 2
+    assert TRANSACTION_STATS.stats()["commit_retries"] == 1
+
+
+def test_gives_up_after_max_attempts():
+    session = FakeSession()
+
+    def callback(s):
+        raise transient()
+
+    with pytest.raises(PyMongoError):
+        run_in_transaction(FakeClient(session), callback, max_attempts=3)
+    assert session.started == 3
+    assert TRANSACTION_STATS.stats()["failures"] == 1
+
+
+def test_none_result_aborts():
+    session = FakeSession()
+
+    assert run_in_transaction(FakeClient(session), lambda s: None) is None
+    assert (session.aborted, session.commits) == (1, 0)
+    assert TRANSACTION_STATS.stats()["refusals"] == 1
+
+
+def test_non_transient_errors_are_not_retried():
+    session = FakeSession()
+
+    def callback(s):
+        raise PyMongoError("duplicate key")
+
+    with pytest.raises(PyMongoError):
+        run_in_transaction(FakeClient(session), callback)
+    assert session.started == 1
+
+
+def test_marked_duplicate_key_is_retried():
+    session = FakeSession()
+    failures = [mark_transient(DuplicateKeyError("duplicate key", 11000))]
+
+    def callback(s):
+        if failures:
+            raise failures.pop(0)
+        return "done"
+
+    assert run_in_transaction(FakeClient(session), callback) == "done"
+    assert session.started == 2
@@ -1,9 +1,12 @@
 import pytest
+from bson import Int64
 from pymongo import MongoClient
 from datetime import datetime
-from app.models.account import Account
+import app.models.account as account_module
+from app.models.account import Account, shard_drain_plan
 from app.models.user import User
 
+from utils.money import to_minor
 from utils.static_vars import MONGODB_PATH
 from app.database.mongodb import *
 
@@ -20,7 +23,12 @@ def db():
     yield db
 
     db.users.delete_many({})
+    User.cache.clear()
     db.accounts.delete_many({})
+    db.transactions_history.delete_many({})
+    db.statements.delete_many({})
+    db.balance_shards.delete_many({})
+    Account.balance_cache.clear()
     client.close()
 
 @pytest.fixture
@@ -114,15 +122,28 @@ def test_deposit(db, default_account, default_user):
     assert updated_account.balance == 100
 
 
-def test_withdraw_with_balance(db, default_account, default_user):
+def test_withdraw_with_balance(db, default_user):
     _ = default_user.create()
-    account = default_account
+    account = Account("123456789", to_minor(50))
     account.create()
 
-    account.withdraw(20.5)
+    account.withdraw(to_minor(20.5))
     updated_account = Account.find_by_account_id(account.account_id)
 
-    assert updated_account.balance == 29.5
+    assert updated_account.balance == to_minor(29.5)
+
+
+def test_balance_stored_as_int64(db, default_account, default_user):
+    _ = default_user.create()
+    default_account.create()
+    default_account.deposit(to_minor(0.1))
+    default_account.add_transaction("deposit", to_minor(0.1), transaction_time="2024-01-15 10:00:00")
+
+    account = db.accounts.find_one({"account_id": default_account.account_id})
+    bucket = db.transactions_history.find_one({"account_id": default_account.account_id})
+
+    assert isinstance(account["balance"], Int64)
+    assert isinstance(bucket["transactions"][0]["value"], Int64)
 
 
 def test_withdraw_with_nobalance(db, default_account, default_user):
@@ -146,7 +167,7 @@ def test_transfer_with_balance(db, default_account, default_user):
     user2.create()
     account2.create()
 
-    account1.transfer(account2.account_id, 30)
+    account1.transfer(account2, 30)
     updated_account1 = Account.find_by_account_id(account1.account_id)
     updated_account2 = Account.find_by_account_id(account2.account_id)
 
@@ -164,7 +185,7 @@ def test_transfer_with_nobalance(db, default_account, default_user):
     user2.create()
     account2.create()
 
-    account1.transfer(account2.account_id, 60)
+    account1.transfer(account2, 60)
     updated_account1 = Account.find_by_account_id(account1.account_id)
     updated_account2 = Account.find_by_account_id(account2.account_id)
 
@@ -172,6 +193,24 @@ def test_transfer_with_nobalance(db, default_account, default_user):
     assert updated_account2.balance == 60
 
 
+def test_transfer_refused_for_frozen_sender_or_recipient(db, default_account, default_user):
+    default_user.create()
+    default_account.create()
+    User("Jane", "Doe", "987654321", "111-456-789", "2000-01-01", "jane@email.com").create()
+    recipient = Account("987654321", 60, False)
+    recipient.create()
+
+    default_account.freeze()
+    frozen_sender = default_account.transfer(recipient, 10)
+    default_account.unfreeze()
+    recipient.freeze()
+    frozen_recipient = default_account.transfer(recipient, 10)
+
+    assert frozen_sender is None and frozen_recipient is None
+    assert Account.find_by_account_id(default_account.account_id).balance == 50
+    assert Account.find_by_account_id(recipient.account_id).balance == 60
+
+
 def test_find_by_document_id_account_exists(db, default_account, default_user):
     _ = default_user.create()
     _ = default_account.create()
@@ -202,6 +241,26 @@ def test_find_by_account_id_account_doesnt_exist(db):
     assert account is None
 
 
+def test_find_by_document_id_with_fields(db, default_account, default_user):
+    _ = default_user.create()
+    _ = default_account.create()
+    db.accounts.update_one({"user_document": "123456789"}, {"$set": {"is_frozen": True}})
+
+    account = Account.find_by_document_id("123456789", ("is_frozen",))
+
+    assert (account.account_id, account.is_frozen) == (default_account.account_id, True)
+    assert account.balance == 0
+
+
+def test_account_exists(db, default_account, default_user):
+    assert not Account.exists("123456789")
+
+    _ = default_user.create()
+    _ = default_account.create()
+
+    assert Account.exists("123456789")
+
+
 def test_add_transaction_withdrawal(db, default_user, default_account):
     _ = default_user.create()
     account = default_account
@@ -251,13 +310,237 @@ def test_get_transaction_history_with_no_past_transactions(db, default_user, def
     assert len(transactions) == 0
 
 
-def test_update_transaction_count(db, default_user, default_account):
+def test_add_transaction_rolls_over_full_bucket(db, default_user, default_account, monkeypatch):
+    monkeypatch.setattr(account_module, "HISTORY_BUCKET_SIZE", 2)
+    _ = default_user.create()
+    account = default_account
+    account.create()
+
+    for value in (10, 20, 30):
+        account.add_transaction("deposit", value, transaction_time="2024-01-15 10:00:00")
+
+    assert db.transactions_history.count_documents({"account_id": account.account_id}) == 2
+    assert [t["value"] for t in account.get_transaction_history()] == [10, 20, 30]
+
+
+def test_get_transaction_history_reads_only_range_buckets(db, default_user, default_account):
     _ = default_user.create()
     account = default_account
     account.create()
+    account.add_transaction("deposit", 10, transaction_time="2024-01-15 10:00:00")
+    account.add_transaction("deposit", 20, transaction_time="2024-02-15 10:00:00")
+    account.add_transaction("deposit", 30, transaction_time="2024-03-15 10:00:00")
 
-    account.update_transaction_count(datetime.today().strftime("%Y-%m-%d %H:%M:%S"))
+    transactions = account.get_transaction_history(datetime(2024, 2, 1), datetime(2024, 2, 28))
+
+    assert [t["value"] for t in transactions] == [20]
+
+
+def test_get_transaction_history_page(db, default_user, default_account, monkeypatch):
+    monkeypatch.setattr(account_module, "HISTORY_BUCKET_SIZE", 2)
+    _ = default_user.create()
+    account = default_account
+    account.create()
+    for value in (10, 20, 30, 40, 50):
+        account.add_transaction("deposit", value, transaction_time="2024-01-15 10:00:00")
+
+    first_page, token = account.get_transaction_history_page(3)
+    second_page, last_token = account.get_transaction_history_page(3, token)
+
+    assert [t["value"] for t in first_page] == [10, 20, 30]
+    assert [t["value"] for t in second_page] == [40, 50]
+    assert last_token is None
+    assert "_bucket" not in first_page[0]
+
+
+def test_get_transaction_history_page_invalid_token(db, default_user, default_account):
+    _ = default_user.create()
+    default_account.create()
+
+    with pytest.raises(ValueError):
+        default_account.get_transaction_history_page(3, "not-a-token")
+
+
+def test_daily_transaction_count_follows_balance_write(db, default_user, default_account):
+    _ = default_user.create()
+    default_account.create()
+
+    Account.atomic_deposit("123456789", 10, datetime(2024, 1, 15, 9))
+    Account.atomic_withdraw("123456789", 5, datetime(2024, 1, 15, 18))
+    updated_account = Account.atomic_deposit("123456789", 10, datetime(2024, 1, 16, 9))
+
+    assert updated_account.last_date_transaction == datetime(2024, 1, 16)
+    assert updated_account.last_date_transactions_count == 1
+    assert Account.count_transactions_on("123456789", datetime(2024, 1, 15)) == 2
+    assert Account.count_transactions_on("123456789", datetime(2024, 1, 17)) == 0
+
+
+def test_daily_transaction_count_on_legacy_account(db, default_user, default_account):
+    _ = default_user.create()
+    default_account.create()
+    db.accounts.update_one({"account_id": default_account.account_id},
+                           {"$set": {"last_date_transaction": "15-01-2024", "last_date_transactions_count": 7},
+                            "$unset": {"daily_transactions": ""}})
+
+    default_account.deposit(10, datetime(2024, 1, 15, 9))
     updated_account = Account.find_by_document_id("123456789")
 
+    assert updated_account.last_date_transaction == datetime(2024, 1, 15)
     assert updated_account.last_date_transactions_count == 1
-    assert updated_account.last_date_transaction.strftime("%d-%m-%Y") == datetime.today().strftime("%d-%m-%Y")
+
+
+def test_atomic_deposit(db, default_account, default_user):
+    _ = default_user.create()
+    default_account.create()
+
+    account = Account.atomic_deposit("123456789", 25)
+
+    assert account.balance == 75
+    assert Account.find_by_account_id(default_account.account_id).balance == 75
+
+
+def test_non_positive_amounts_are_refused(db, default_account, default_user):
+    _ = default_user.create()
+    default_account.create()
+    User("Jane", "Doe", "987654321", "111-456-789", "2000-01-01", "jane@email.com").create()
+    recipient = Account("987654321", 60, False)
+    recipient.create()
+
+    assert Account.atomic_deposit("123456789", -10) is None
+    assert Account.atomic_withdraw("123456789", -10) is None
+    assert default_account.transfer(recipient, -10) is None
+    assert Account.atomic_deposit("123456789", 0) is None
+    assert Account.find_by_account_id(default_account.account_id).balance == 50
+    assert Account.find_by_account_id(recipient.account_id).balance == 60
+
+
+def test_atomic_withdraw_with_nobalance(db, default_account, default_user):
+    _ = default_user.create()
+    default_account.create()
+
+    account = Account.atomic_withdraw("123456789", 70)
+
+    assert account is None
+    assert Account.find_by_account_id(default_account.account_id).balance == 50
+
+
+def test_atomic_withdraw_frozen_account(db, default_account, default_user):
+    _ = default_user.create()
+    default_account.create()
+    default_account.freeze()
+
+    account = Account.atomic_withdraw("123456789", 10)
+
+    assert account is None
+    assert Account.find_by_account_id(default_account.account_id).balance == 50
+
+
+def test_get_statement_materialized_on_write(db, default_user, default_account):
+    _ = default_user.create()
+    default_account.create()
+
+    default_account.deposit(30, datetime(2024, 1, 15, 9))
+    default_account.add_transaction("deposit", 30, transaction_time="2024-01-15 09:00:00")
+    default_account.withdraw(20, datetime(2024, 1, 20, 9))
+    default_account.add_transaction("withdraw", 20, transaction_time="2024-01-20 09:00:00")
+    default_account.deposit(5, datetime(2024, 3, 1, 9))
+    default_account.add_transaction("deposit", 5, transaction_time="2024-03-01 09:00:00")
+
+    january = default_account.get_statement("2024-01")
+
+    assert (january["opening_balance"], january["closing_balance"]) == (50, 60)
+    assert january["totals"] == {"deposit": 30, "withdraw": 20}
+    assert january["counts"] == {"deposit": 1, "withdraw": 1}
+    assert default_account.get_statement("2024-02")["opening_balance"] == 60
+    assert default_account.get_statement("2024-03")["closing_balance"] == 65
+    assert default_account.get_statement("2023-12")["closing_balance"] == 50
+
+
+def test_get_statement_with_back_dated_entries(db, default_user, default_account):
+    _ = default_user.create()
+    default_account.create()
+
+    default_account.deposit(5, datetime(2024, 3, 1, 9))
+    default_account.add_transaction("deposit", 5, transaction_time="2024-03-01 09:00:00")
+    default_account.withdraw(20, datetime(2024, 1, 20, 9))
+    default_account.add_transaction("withdraw", 20, transaction_time="2024-01-20 09:00:00")
+    default_account.deposit(30, datetime(2024, 1, 15, 9))
+    default_account.add_transaction("deposit", 30, transaction_time="2024-01-15 09:00:00")
+
+    january = default_account.get_statement("2024-01")
+    march = default_account.get_statement("2024-03")
+
+    assert (january["opening_balance"], january["closing_balance"]) == (50, 60)
+    assert (march["opening_balance"], march["closing_balance"]) == (60, 65)
+
+
+def test_shard_drain_plan_takes_account_first_then_largest_shards():
+    shards = [{"_id": "a:0", "balance": 5}, {"_id": "a:1", "balance": 30}, {"_id": "a:2", "balance": 10}]
+
+    assert shard_drain_plan(20, shards, 45) == (20, [("a:1", 25)])
+    assert shard_drain_plan(0, shards, 42) == (0, [("a:1", 30), ("a:2", 10), ("a:0", 2)])
+    assert shard_drain_plan(20, shards, 66) is None
+
+
+def test_hot_account_transfer_credits_shards(db, default_account, default_user):
+    default_user.create()
+    default_account.create()
+    User("Jane", "Doe", "987654321", "111-456-789", "2000-01-01", "jane@email.com").create()
+    hot_account = Account("987654321", 60, False)
+    hot_account.create()
+    hot_account.set_hot_shards(4)
+
+    for _ in range(5):
+        assert default_account.transfer(hot_account, 10) is hot_account
+
+    assert db.accounts.find_one({"account_id": hot_account.account_id})["balance"] == 60
+    assert db.balance_shards.count_documents({"account_id": hot_account.account_id}) == 4
+    assert Account.find_by_account_id(hot_account.account_id).balance_check() == 110
+    assert Account.find_by_account_id(default_account.account_id).balance == 0
+
+
+def test_hot_account_debit_drains_shards(db, default_account, default_user):
+    default_user.create()
+    default_account.create()
+    default_account.set_hot_shards(2)
+    db.balance_shards.update_one({"account_id": default_account.account_id, "shard": 1},
+                                 {"$inc": {"balance": Int64(40)}})
+
+    account = Account.atomic_withdraw("123456789", 70, datetime(2024, 1, 15))
+    refused = Account.atomic_withdraw("123456789", 30)
+
+    assert account.balance == 20
+    assert refused is None
+    assert Account.find_by_account_id(default_account.account_id).balance == 20
+    assert Account.count_transactions_on("123456789", datetime(2024, 1, 15)) == 1
+
+
+def test_hot_account_legacy_withdraw_drains_shards(db, default_account, default_user):
+    default_user.create()
+    default_account.create()
+    default_account.set_hot_shards(2)
+    db.balance_shards.update_one({"account_id": default_account.account_id, "shard": 1},
+                                 {"$inc": {"balance": Int64(40)}})
+
+    account = Account.find_by_account_id(default_account.account_id)
+    account.withdraw(70)
+    account.deposit(5)
+
+    assert account.balance == 25
+    assert db.accounts.find_one({"account_id": default_account.account_id})["balance"] == 5
+    assert Account.find_by_account_id(default_account.account_id).balance == 25
+
+
+def test_set_hot_shards_folds_removed_shards_back(db, default_account, default_user):
+    default_user.create()
+    default_account.create()
+    default_account.set_hot_shards(4)
+    db.balance_shards.update_many({"account_id": default_account.account_id}, {"$inc": {"balance": Int64(5)}})
+
+    default_account.set_hot_shards(1)
+    assert Account.find_by_account_id(default_account.account_id).balance == 70
+
+    default_account.set_hot_shards(0)
+    account = db.accounts.find_one({"account_id": default_account.account_id})
+    assert (account["balance"], account["balance_shards"]) == (70, 0)
+    assert db.balance_shards.count_documents({"account_id": default_account.account_id}) == 0
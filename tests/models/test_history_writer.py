@@ -0,0 +1,133 @@
+import asyncio
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from app.models.account import Account, history_append_operation, statement_operation
+from app.models.history_writer import *
+
+from utils.static_vars import MONGODB_PATH
+
+
+@pytest.fixture
+def db():
+    client = MongoClient(MONGODB_PATH)
+    db = client.test_bank
+    Account.set_database(db)
+    yield db
+
+    Account.history_writer = None
+    db.transactions_history.delete_many({})
+    db.statements.delete_many({})
+    client.close()
+
+
+def operations(account_id: str, hour: int):
+    transaction_data = {"timestamp": datetime(2024, 1, 15, hour), "type": "deposit", "value": 10, "counterpart": None}
+    return (UpdateOne(*history_append_operation(account_id, transaction_data), upsert=True),
+            UpdateOne(*statement_operation(account_id, transaction_data), upsert=True))
+
+
+def test_flushed_ack_returns_after_the_write(db):
+    writer = HistoryWriter(db, interval=0.01, max_entries=8)
+    writer.start()
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(lambda i: writer.submit(*operations("15012024000001", i % 24)), range(32)))
+    count = db.transactions_history.find_one({"account_id": "15012024000001"})["count"]
+    writer.close()
+
+    assert count == 32
+    assert writer.stats()["flushes"] < 32
+    assert db.statements.find_one({"account_id": "15012024000001"})["counts"]["deposit"] == 32
+
+
+def test_close_flushes_queued_entries(db):
+    writer = HistoryWriter(db, interval=10, ack="queued")
+    writer.start()
+
+    for hour in range(3):
+        writer.submit(*operations("15012024000001", hour))
+    writer.close()
+
+    assert db.transactions_history.find_one({"account_id": "15012024000001"})["count"] == 3
+
+
+def test_failed_flush_keeps_the_worker_running(db):
+    writer = HistoryWriter(db, interval=0.01)
+    writer.start()
+    history, statement = operations("15012024000001", 9)
+
+    with pytest.raises(Exception):
+        writer.submit(UpdateOne({"account_id": "15012024000001"}, {"$set": {"value": object()}}), statement)
+    writer.submit(history, statement)
+    writer.close()
+
+    assert writer.stats()["failures"] == 1
+    assert db.transactions_history.find_one({"account_id": "15012024000001"})["count"] == 1
+
+
+def test_failed_append_fails_only_its_own_submit(db):
+    writer = HistoryWriter(db, interval=10, max_entries=2)
+    writer.start()
+    history, statement = operations("15012024000001", 9)
+    bad_history = UpdateOne({"_id": "15012024000002"}, {"$inc": {"count": "one"}}, upsert=True)
+    _, bad_statement = operations("15012024000002", 10)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        good = pool.submit(writer.submit, history, statement)
+        bad = pool.submit(writer.submit, bad_history, bad_statement)
+        good.result()
+        with pytest.raises(BulkWriteError):
+            bad.result()
+    writer.close()
+
+    assert writer.stats()["failures"] == 1
+    assert db.transactions_history.find_one({"account_id": "15012024000001"})["count"] == 1
+    assert db.statements.count_documents({"account_id": {"$in": ["15012024000001", "15012024000002"]}}) == 2
+
+
+def test_failed_writes_maps_write_errors_to_operations():
+    error = BulkWriteError({"writeErrors": [{"index": 1, "code": 11000}], "writeConcernErrors": []})
+
+    unencodable = ValueError("unencodable")
+
+    assert failed_writes(error, 3) == {1: error}
+    assert failed_writes(unencodable, 2) == {0: unencodable, 1: unencodable}
+
+
+def test_rejects_unknown_ack(db):
+    with pytest.raises(ValueError):
+        HistoryWriter(db, ack="never")
+
+
+def test_add_transaction_goes_through_writer(db):
+    writer = HistoryWriter(db, interval=0.001)
+    writer.start()
+    Account.history_writer = writer
+    account = Account("123456789", 10, account_id="15012024000001")
+
+    account.add_transaction("deposit", 10, transaction_time="2024-01-15 09:00:00")
+    writer.close()
+
+    assert writer.stats()["entries"] == 1
+    assert db.transactions_history.find_one({"account_id": "15012024000001"})["count"] == 1
+
+
+def test_async_writer_batches_concurrent_submits(db):
+    async def run():
+        client = AsyncIOMotorClient(MONGODB_PATH)
+        writer = AsyncHistoryWriter(client.test_bank, interval=0.01, max_entries=8)
+        writer.start()
+        await asyncio.gather(*(writer.submit(*operations("15012024000001", i % 24)) for i in range(20)))
+        await writer.close()
+        client.close()
+        return writer.stats()
+
+    stats = asyncio.run(run())
+
+    assert stats["entries"] == 20
+    assert stats["flushes"] < 20
+    assert db.transactions_history.find_one({"account_id": "15012024000001"})["count"] == 20
@@ -0,0 +1,108 @@
+import pytest
+from pymongo import MongoClient
+from datetime import datetime
+from app.models.ledger import *
+from app.database.transactions import run_in_transaction
+from app.database.mongodb import INDEXES
+
+from utils.static_vars import MONGODB_PATH
+
+
+@pytest.fixture
+def db():
+    client = MongoClient(MONGODB_PATH)
+    db = client.test_bank
+    db.ledger.create_indexes(INDEXES["ledger"])
+    Ledger.set_database(db)
+    yield db
+
+    db.ledger.delete_many({})
+    db.ledger_snapshots.delete_many({})
+    db.accounts.delete_many({})
+    client.close()
+
+
+def test_ledger_entries_chain_running_balance():
+    entries = ledger_entries("15012024000001", {"seq": 3, "balance": 100},
+                             [(50, "deposit", None, datetime(2024, 1, 15)),
+                              (-30, "withdraw", None, datetime(2024, 1, 16))])
+
+    assert [(entry["seq"], entry["balance"]) for entry in entries] == [(4, 150), (5, 120)]
+
+
+def test_append_derives_balance_from_snapshot(db):
+    Ledger.open("15012024000001", 100)
+
+    Ledger.append("15012024000001", 50, "deposit")
+    entry = Ledger.append("15012024000001", -120, "withdraw")
+
+    assert (entry["seq"], entry["balance"]) == (2, 30)
+    assert Ledger.balance("15012024000001") == 30
+    assert Ledger.append("15012024000001", -31, "withdraw") is None
+
+
+def test_append_conflict_in_transaction_is_retried(db, monkeypatch):
+    Ledger.open("15012024000001", 100)
+    Ledger.append("15012024000001", 50, "deposit")
+    head = Ledger.head
+    # The first read misses the deposit, as if it had committed after the transaction started
+    stale_heads = [{"seq": 0, "balance": 100}]
+    monkeypatch.setattr(Ledger, "head", lambda account_id, session=None:
+                        stale_heads.pop() if stale_heads else head(account_id, session))
+
+    entry = run_in_transaction(db.client, lambda session: Ledger.append("15012024000001", -80, "withdraw",
+                                                                        session=session))
+
+    assert (entry["seq"], entry["balance"]) == (2, 70)
+    assert Ledger.balance("15012024000001") == 70
+
+
+def test_append_many_stops_at_concurrent_append(db):
+    Ledger.open("15012024000001", 100)
+    head = Ledger.head("15012024000001")
+    entries = ledger_entries("15012024000001", head, [(10, "deposit", None, None), (10, "deposit", None, None)])
+
+    Ledger.append("15012024000001", -100, "withdraw")
+
+    assert Ledger.append_many(entries) == 0
+    assert Ledger.balance("15012024000001") == 0
+
+
+def test_compact_snapshots_and_reports_drift(db):
+    Ledger.open("15012024000001", 100)
+    Ledger.open("15012024000002", 0)
+    Ledger.append("15012024000001", 25, "deposit")
+    Ledger.append("15012024000002", 10, "deposit")
+    db.ledger.update_one({"account_id": "15012024000002"}, {"$set": {"balance": 99}})
+
+    summary = Ledger.compact(["15012024000001", "15012024000002"])
+    snapshot = db.ledger_snapshots.find_one({"account_id": "15012024000001", "seq": 1})
+
+    assert summary == {"snapshots": 1, "pruned": 1, "drifted": ["15012024000002"]}
+    assert snapshot["balance"] == 125
+    assert Ledger.compact(["15012024000001"]) == {"snapshots": 0, "pruned": 0, "drifted": []}
+
+
+def test_compact_prunes_entries_and_snapshots_it_covers(db):
+    Ledger.open("15012024000001", 100)
+    Ledger.append("15012024000001", 25, "deposit")
+    Ledger.append("15012024000001", -5, "withdraw")
+
+    Ledger.compact(["15012024000001"])
+    entry = Ledger.append("15012024000001", 10, "deposit")
+
+    assert [snapshot["seq"] for snapshot in db.ledger_snapshots.find({"account_id": "15012024000001"})] == [2]
+    assert (entry["seq"], entry["balance"]) == (3, 130)
+    assert db.ledger.count_documents({"account_id": "15012024000001"}) == 1
+    assert Ledger.replay(["15012024000001"])["15012024000001"]["balance"] == 130
+
+
+def test_rebuild_resets_balance_projection(db):
+    db.accounts.insert_one({"account_id": "15012024000001", "balance": 7})
+    Ledger.open("15012024000001", 100)
+    Ledger.append("15012024000001", 25, "deposit")
+    Ledger.compact(["15012024000001"])
+    Ledger.append("15012024000001", -5, "withdraw")
+
+    assert Ledger.rebuild(["15012024000001"]) == 1
+    assert db.accounts.find_one({"account_id": "15012024000001"})["balance"] == 120
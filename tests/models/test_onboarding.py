@@ -0,0 +1,54 @@
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from app.models.onboarding import Onboarding, write_failures
+from app.models.user import User
+
+from utils.static_vars import MONGODB_PATH
+from app.database.mongodb import *
+
+
+@pytest.fixture
+def db():
+    client = MongoClient(MONGODB_PATH)
+    db = client.test_bank
+    create_users_indexes(db)
+    create_accounts_indexes(db)
+    Onboarding.set_database(db)
+    User.set_database(db)
+    yield db
+
+    db.users.delete_many({})
+    User.cache.clear()
+    db.accounts.delete_many({})
+    db.transactions_history.delete_many({})
+    db.ledger_snapshots.delete_many({})
+    client.close()
+
+
+def row(document_id: str, balance: int=0) -> dict:
+    return {"firstname": "John", "lastname": "Doe", "document_id": document_id, "phone": f"phone-{document_id}",
+            "birthdate": "1999-01-01", "email": f"{document_id}@email.com", "balance": balance}
+
+
+def test_write_failures_names_duplicate_keys():
+    error = BulkWriteError({"writeErrors": [{"index": 2, "code": 11000, "keyPattern": {"email": 1},
+                                             "errmsg": "E11000 duplicate key error"},
+                                            {"index": 5, "code": 121, "errmsg": "Document failed validation"}]})
+
+    assert write_failures(error) == {2: "duplicate email", 5: "Document failed validation"}
+
+
+def test_import_batch(db):
+    User("Jane", "Doe", "000000002", "phone-taken", "2000-01-01", "jane@email.com").create()
+    rows = [row("000000001", 5000), row("000000002"), row("000000003"),
+            {**row("000000001"), "phone": "phone-other", "email": "other@email.com"}]
+
+    failures = Onboarding.import_batch(rows, journal=True)
+
+    assert failures == {1: "duplicate document_id", 3: "duplicate document_id"}
+    accounts = {account["user_document"]: account for account in db.accounts.find({})}
+    assert sorted(accounts) == ["000000001", "000000003"]
+    assert accounts["000000001"]["balance"] == 5000
+    assert db.transactions_history.count_documents({"count": 0}) == 2
+    assert db.ledger_snapshots.count_documents({}) == 2
@@ -13,6 +13,7 @@ def db():
     yield db
 
     db.users.delete_many({})
+    User.cache.clear()
     client.close()
 
 @pytest.fixture
@@ -93,4 +94,39 @@ def test_find_by_document_user_exists(db, default_user):
 def test_find_by_document_user_doesnt_exist(db):
     found_user = User.find_by_document("123456789")
 
-    assert found_user is None
\ No newline at end of file
+    assert found_user is None
+
+
+def test_find_by_document_caches_missing_user(db, default_user):
+    assert User.find_by_document("123456789") is None
+    assert User.find_by_document("123456789") is None
+
+    default_user.create()
+    user = User.find_by_document("123456789")
+
+    assert user.email == "john@email.com"
+    assert User.cache.stats()["negative_hits"] == 1
+
+
+def test_exists_caches_only_missing_user(db, default_user):
+    assert not User.exists("123456789")
+
+    default_user.create()
+
+    assert User.exists("123456789")
+    assert User.cache.stats()["negative_hits"] == 0
+    assert User.find_by_document("123456789").email == "john@email.com"
+
+
+def test_find_by_document_invalidated_by_update_and_delete(db, default_user):
+    default_user.create()
+    User.find_by_document("123456789").update({"email": "changed@email.com"})
+    cached = User.find_by_document("123456789")
+    cached.phone = "mutated"
+
+    assert cached.email == "changed@email.com"
+    assert User.find_by_document("123456789").phone == "123-456-789"
+
+    default_user.delete()
+
+    assert User.find_by_document("123456789") is None
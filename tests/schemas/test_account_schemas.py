@@ -0,0 +1,53 @@
+import time
+import pytest
+from datetime import datetime
+from app.schemas.account_schemas import *
+
+
+def test_transaction_date_defaults_to_creation_time():
+    first = AccountTransaction(user_document="123456789", value=50)
+    time.sleep(0.01)
+    second = AccountTransaction(user_document="123456789", value=50)
+
+    assert first.transaction_date < second.transaction_date
+
+
+def test_transaction_parses_json_payload():
+    transaction = AccountBatchTransaction(user_document="123456789", value="50",
+                                          transaction_date="2024-01-15 10:30:00", operation="withdraw")
+
+    assert transaction.value == 50.0
+    assert transaction.transaction_date == datetime(2024, 1, 15, 10, 30)
+
+
+def test_transaction_rejects_invalid_value():
+    with pytest.raises(ValueError):
+        AccountTransaction(user_document="123456789", value="fifty")
+
+
+def test_transaction_rejects_non_positive_value():
+    with pytest.raises(ValueError):
+        AccountTransaction(user_document="123456789", value=0)
+    with pytest.raises(ValueError):
+        AccountTransaction(user_document="123456789", value=-50)
+
+    assert AccountBatchTransaction(user_document="123456789", value=-50).value == -50
+
+
+def test_history_request_rejects_non_positive_page_size():
+    with pytest.raises(ValueError):
+        AccountHistoryRequest(user_document="123456789", page_size=0)
+    with pytest.raises(ValueError):
+        AccountHistoryRequest(user_document="123456789", page_size=-5)
+
+    assert AccountHistoryRequest(user_document="123456789").page_size is None
+
+
+def test_to_dict_is_json_ready():
+    account_data = AccountData(user_document="123456789", balance=50, transaction_history=[{}])
+    transaction = AccountTransaction(user_document="123456789", value=50,
+                                     transaction_date=datetime(2024, 1, 15, 10, 30))
+
+    assert account_data.to_dict() == {"account_id": None, "user_document": "123456789",
+                                      "balance": 50.0, "is_frozen": False}
+    assert transaction.to_dict()["transaction_date"] == "2024-01-15T10:30:00"
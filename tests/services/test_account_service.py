@@ -1,14 +1,19 @@
+import multiprocessing
 import pytest
+from bson import Int64
 from pymongo import MongoClient
 from datetime import datetime, timedelta
 from app.models.user import User
 from app.models.account import Account
+from app.models.ledger import Ledger
 from app.api.services.user_service import UserService
 from app.api.services.account_service import AccountService
 from app.schemas.user_schemas import UserData
 from app.schemas.account_schemas import *
 
-from utils.static_vars import MONGODB_PATH
+from utils.cache import TTLCache
+from utils.money import to_minor
+from utils.static_vars import MONGODB_PATH, BALANCE_CACHE_TTL_SECONDS
 from app.database.mongodb import *
 
 
@@ -18,11 +23,19 @@ def db():
     db = client.test_bank
     User.set_database(db)
     Account.set_database(db)
+    Ledger.set_database(db)
+    db.ledger.create_indexes(INDEXES["ledger"])
     yield db
 
     db.users.delete_many({})
+    User.cache.clear()
     db.accounts.delete_many({})
     db.transactions_history.delete_many({})
+    db.statements.delete_many({})
+    db.ledger.delete_many({})
+    db.ledger_snapshots.delete_many({})
+    db.balance_shards.delete_many({})
+    Account.balance_cache.clear()
     client.close()
 
 @pytest.fixture
@@ -116,6 +129,23 @@ def test_check_balance(db, default_user, default_account):
     assert balance == 50
 
 
+def test_check_balance_cache_invalidated_by_deposit(db, default_user, default_account):
+    UserService(db).create_user(default_user)
+    service = AccountService(db)
+    service.create_account(default_account)
+
+    assert service.check_balance(default_account) == 50
+    assert service.check_balance(default_account) == 50
+    service.deposit(AccountTransaction(
+        user_document=default_user.document_id,
+        value=25,
+        transaction_date=datetime.today()
+    ))
+
+    assert service.check_balance(default_account) == 75
+    assert Account.balance_cache.stats()["hits"] >= 1
+
+
 def test_deposit(db, default_user, default_account):
     user_data = default_user
     UserService(db).create_user(user_data)
@@ -158,6 +188,58 @@ def test_withdraw(db, default_user, default_account):
     assert account.last_date_transactions_count == 1
 
 
+def test_deposit_atomic(db, default_user, default_account):
+    UserService(db).create_user(default_user)
+    service = AccountService(db, atomic=True)
+    service.create_account(default_account)
+
+    balance = service.deposit(AccountTransaction(
+        user_document=default_user.document_id,
+        value=50,
+        transaction_date=datetime.today()
+    ))
+    account = Account.find_by_document_id("123456789")
+
+    assert balance == 100
+    assert account.balance == to_minor(100)
+    assert account.last_date_transactions_count == 1
+
+
+def test_withdraw_atomic_rejected(db, default_user, default_account):
+    UserService(db).create_user(default_user)
+    service = AccountService(db, atomic=True)
+    service.create_account(default_account)
+
+    balance = service.withdraw(AccountTransaction(
+        user_document=default_user.document_id,
+        value=80,
+        transaction_date=datetime.today()
+    ))
+    history = service.get_transactions_history(AccountHistoryRequest(user_document="123456789"))
+
+    assert balance is None
+    assert service.check_balance(default_account) == 50
+    assert len(history) == 0
+
+
+def test_withdraw_rejected_records_nothing(db, default_user, default_account):
+    UserService(db).create_user(default_user)
+    service = AccountService(db)
+    service.create_account(default_account)
+
+    balance = service.withdraw(AccountTransaction(
+        user_document=default_user.document_id,
+        value=80,
+        transaction_date=datetime(2024, 1, 15, 9)
+    ))
+    history = service.get_transactions_history(AccountHistoryRequest(user_document="123456789"))
+
+    assert balance is None
+    assert service.check_balance(default_account) == 50
+    assert len(history) == 0
+    assert db.statements.count_documents({"account_id": default_account.account_id}) == 0
+
+
 def test_transfer(db, default_user, default_account, default_user_tmp, default_account_tmp):
     user_data = default_user
     user_data_tmp = default_user_tmp
@@ -277,3 +359,212 @@ def test_get_transactions_history_recipient_user(db, default_user, default_user_
     assert len(transactions_history) == 1
     assert len(transactions_history_tmp) == 1
 
+
+def test_export_transactions_history_csv(db, default_user, default_account):
+    UserService(db).create_user(default_user)
+    service = AccountService(db)
+    service.create_account(default_account)
+    service.deposit(AccountTransaction(
+        user_document=default_user.document_id,
+        value=50,
+        transaction_date=datetime(2024, 1, 15, 10, 30)
+    ))
+
+    content = "".join(service.export_transactions_history(
+        AccountHistoryRequest(user_document=default_user.document_id), "csv"
+    ))
+
+    assert content.splitlines() == ["timestamp,type,value,counterpart",
+                                    "2024-01-15 10:30:00,deposit,50.0,"]
+
+
+def test_apply_batch(db, default_user, default_user_tmp, default_account, default_account_tmp):
+    UserService(db).create_user(default_user)
+    UserService(db).create_user(default_user_tmp)
+    service = AccountService(db)
+    service.create_account(default_account)
+    service.create_account(default_account_tmp)
+    transaction_date = datetime.today()
+
+    results = service.apply_batch([
+        AccountBatchTransaction(user_document="123456789", value=30, operation="deposit", transaction_date=transaction_date),
+        AccountBatchTransaction(user_document="123456789", value=100, operation="withdraw", transaction_date=transaction_date),
+        AccountBatchTransaction(user_document="123456789", value=1, operation="withdraw", transaction_date=transaction_date),
+        AccountBatchTransaction(user_document="987654321", value=40, operation="withdraw", transaction_date=transaction_date),
+        AccountBatchTransaction(user_document="000000000", value=10, operation="deposit", transaction_date=transaction_date)
+    ])
+    history = service.get_transactions_history(AccountHistoryRequest(user_document="123456789"))
+
+    assert [result["status"] for result in results] == ["applied", "rejected", "applied", "applied", "rejected"]
+    assert results[1]["reason"] == "insufficient funds"
+    assert results[4]["reason"] == "account not found"
+    assert service.check_balance(default_account) == 79
+    assert service.check_balance(default_account_tmp) == 60
+    assert [t["type"] for t in history] == ["deposit", "withdraw"]
+
+
+def test_apply_batch_frozen_account(db, default_user, default_account):
+    UserService(db).create_user(default_user)
+    service = AccountService(db)
+    service.create_account(default_account)
+    service.freeze_account(default_account)
+
+    results = service.apply_batch([
+        AccountBatchTransaction(user_document="123456789", value=30, operation="deposit")
+    ])
+
+    assert results[0]["status"] == "rejected"
+    assert results[0]["reason"] == "account is frozen"
+    assert service.check_balance(default_account) == 50
+
+
+def test_apply_batch_hot_account_spends_shard_funds(db, default_user, default_account):
+    UserService(db).create_user(default_user)
+    service = AccountService(db)
+    service.create_account(default_account)
+    service.set_hot_mode(AccountHotMode(user_document=default_user.document_id, shards=2))
+    db.balance_shards.update_one({"account_id": default_account.account_id, "shard": 1},
+                                 {"$inc": {"balance": Int64(to_minor(40))}})
+
+    results = service.apply_batch([
+        AccountBatchTransaction(user_document="123456789", value=70, operation="withdraw"),
+        AccountBatchTransaction(user_document="123456789", value=30, operation="withdraw")
+    ])
+    history = service.get_transactions_history(AccountHistoryRequest(user_document="123456789"))
+
+    assert [result["status"] for result in results] == ["applied", "rejected"]
+    assert results[0]["balance"] == 20
+    assert results[1]["reason"] == "insufficient funds"
+    assert service.check_balance(default_account) == 20
+    assert [t["type"] for t in history] == ["withdraw"]
+
+
+def test_get_statement(db, default_user, default_account):
+    UserService(db).create_user(default_user)
+    service = AccountService(db)
+    service.create_account(default_account)
+    service.deposit(AccountTransaction(user_document=default_user.document_id, value=30,
+                                       transaction_date=datetime(2024, 1, 15, 9)))
+    service.withdraw(AccountTransaction(user_document=default_user.document_id, value=20.5,
+                                        transaction_date=datetime(2024, 1, 20, 9)))
+
+    statement = service.get_statement(AccountStatementRequest(user_document=default_user.document_id,
+                                                              month="2024-01"))
+
+    assert (statement["opening_balance"], statement["closing_balance"]) == (50, 59.5)
+    assert statement["totals"] == {"deposit": 30, "withdraw": 20.5}
+    assert service.get_statement(AccountStatementRequest(user_document="000000000")) is None
+
+
+def test_hot_account_transfers(db, default_user, default_user_tmp, default_account, default_account_tmp):
+    UserService(db).create_user(default_user)
+    UserService(db).create_user(default_user_tmp)
+    service = AccountService(db, atomic=True)
+    service.create_account(default_account)
+    service.create_account(default_account_tmp)
+
+    hot_mode = service.set_hot_mode(AccountHotMode(user_document=default_user_tmp.document_id, shards=8))
+    for _ in range(4):
+        service.transfer(AccountTransaction(user_document=default_user.document_id,
+                                            recipient_document=default_user_tmp.document_id, value=10))
+    service.transfer(AccountTransaction(user_document=default_user_tmp.document_id,
+                                        recipient_document=default_user.document_id, value=125.5))
+
+    assert hot_mode == {"user_document": default_user_tmp.document_id, "shards": 8}
+    assert service.check_balance(AccountData(user_document=default_user_tmp.document_id)) == 14.5
+    assert service.check_balance(AccountData(user_document=default_user.document_id)) == 135.5
+    assert service.set_hot_mode(AccountHotMode(user_document="000000000", shards=2)) is None
+
+
+def test_journal_mode_derives_balances_from_ledger(db, default_user, default_user_tmp, default_account,
+                                                   default_account_tmp):
+    UserService(db).create_user(default_user)
+    UserService(db).create_user(default_user_tmp)
+    service = AccountService(db, journal=True)
+    service.create_account(default_account)
+    service.create_account(default_account_tmp)
+    transaction_date = datetime.today()
+
+    service.deposit(AccountTransaction(user_document="123456789", value=30, transaction_date=transaction_date))
+    rejected = service.withdraw(AccountTransaction(user_document="123456789", value=100,
+                                                   transaction_date=transaction_date))
+    service.transfer(AccountTransaction(user_document="123456789", value=20, recipient_document="987654321",
+                                        transaction_date=transaction_date))
+    account = Account.find_by_document_id("123456789")
+
+    assert rejected is None
+    assert service.check_balance(default_account) == 60
+    assert service.check_balance(default_account_tmp) == 120
+    assert account.balance == to_minor(60)
+    assert account.last_date_transactions_count == 2
+    assert [entry["type"] for entry in db.ledger.find({"account_id": account.account_id}).sort("seq", 1)] == \
+        ["deposit", "transfer-out"]
+
+
+def test_journal_mode_transfer_failing_credit_leaves_no_debit(db, default_user, default_user_tmp, default_account,
+                                                              default_account_tmp, monkeypatch):
+    UserService(db).create_user(default_user)
+    UserService(db).create_user(default_user_tmp)
+    service = AccountService(db, journal=True)
+    service.create_account(default_account)
+    service.create_account(default_account_tmp)
+    append = Ledger.append
+
+    def failing_credit(account_id, delta, entry_type, *args, **kwargs):
+        if entry_type == "transfer-in":
+            raise RuntimeError("credit failed")
+        return append(account_id, delta, entry_type, *args, **kwargs)
+
+    monkeypatch.setattr(Ledger, "append", failing_credit)
+    with pytest.raises(RuntimeError):
+        service.transfer(AccountTransaction(user_document="123456789", value=20, recipient_document="987654321",
+                                            transaction_date=datetime.today()))
+
+    assert db.ledger.count_documents({}) == 0
+    assert service.check_balance(default_account) == 50
+    assert Account.find_by_document_id("123456789").balance == to_minor(50)
+
+
+def test_journal_mode_apply_batch(db, default_user, default_account):
+    UserService(db).create_user(default_user)
+    service = AccountService(db, journal=True)
+    service.create_account(default_account)
+    transaction_date = datetime.today()
+
+    results = service.apply_batch([
+        AccountBatchTransaction(user_document="123456789", value=30, operation="deposit", transaction_date=transaction_date),
+        AccountBatchTransaction(user_document="123456789", value=100, operation="withdraw", transaction_date=transaction_date),
+        AccountBatchTransaction(user_document="123456789", value=70, operation="withdraw", transaction_date=transaction_date)
+    ])
+    account = Account.find_by_document_id("123456789")
+
+    assert [result["status"] for result in results] == ["applied", "rejected", "applied"]
+    assert Ledger.balance(account.account_id) == to_minor(10)
+    assert account.balance == to_minor(10)
+
+
+def deposit_in_other_worker(document_id: str):
+    # Runs in a fresh process with its own caches, like another uvicorn worker
+    client = MongoClient(MONGODB_PATH)
+    db = client.test_bank
+    User.set_database(db)
+    Account.set_database(db)
+    AccountService(db).deposit(AccountTransaction(user_document=document_id, value=25))
+    client.close()
+
+
+def test_check_balance_sees_deposit_served_by_other_worker(db, default_user, default_account, monkeypatch):
+    UserService(db).create_user(default_user)
+    service = AccountService(db)
+    service.create_account(default_account)
+    monkeypatch.setenv("PROCESS_CACHES", "false")
+    monkeypatch.setattr(Account, "balance_cache", TTLCache(0, BALANCE_CACHE_TTL_SECONDS))
+    assert service.check_balance(default_account) == 50
+
+    worker = multiprocessing.get_context("spawn").Process(target=deposit_in_other_worker,
+                                                          args=(default_account.user_document,))
+    worker.start()
+    worker.join()
+
+    assert worker.exitcode == 0
+    assert AccountService(db).check_balance(default_account) == 75
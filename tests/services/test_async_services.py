@@ -0,0 +1,98 @@
+import asyncio
+import pytest
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorClient
+from app.models.user import AsyncUser
+from app.models.account import AsyncAccount
+from app.api.services.user_service import AsyncUserService
+from app.api.services.account_service import AsyncAccountService
+from app.schemas.user_schemas import UserData, UserUpdate
+from app.schemas.account_schemas import *
+
+from utils.static_vars import MONGODB_PATH
+
+
+def run_with_db(test):
+    async def runner():
+        client = AsyncIOMotorClient(MONGODB_PATH)
+        db = client.test_bank
+        AsyncUser.set_database(db)
+        AsyncAccount.set_database(db)
+        try:
+            await test(db)
+        finally:
+            await db.users.delete_many({})
+            AsyncUser.cache.clear()
+            await db.accounts.delete_many({})
+            await db.transactions_history.delete_many({})
+            client.close()
+
+    asyncio.run(runner())
+
+
+@pytest.fixture
+def default_user() -> UserData:
+    return UserData(
+        "John", "Doe", "123456789", "123-456-789", "1999-01-01", "john@email.com"
+    )
+
+
+@pytest.fixture
+def default_user_tmp() -> UserData:
+    return UserData(
+        "Jane", "Doe", "987654321", "111-222-333", "1998-01-01", "jane@email.com"
+    )
+
+
+def test_async_service_user_lifecycle(default_user):
+    async def test(db):
+        service = AsyncUserService(db)
+        await service.create_user(default_user)
+        await service.update_user(UserUpdate("123456789", "11 1111 1111", None))
+
+        user_info = await service.get_user_info("123456789")
+        assert user_info.phone == "11 1111 1111"
+        assert user_info.email == "john@email.com"
+
+        await service.delete_user(user_info)
+        assert await AsyncUser.find_by_document("123456789") is None
+
+    run_with_db(test)
+
+
+def test_async_service_deposit_and_withdraw(default_user):
+    async def test(db):
+        await AsyncUserService(db).create_user(default_user)
+        service = AsyncAccountService(db)
+        account_data = AccountData(user_document="123456789", balance=50)
+        await service.create_account(account_data)
+
+        await service.deposit(AccountTransaction(user_document="123456789", value=50,
+                                                 transaction_date=datetime.today()))
+        await service.withdraw(AccountTransaction(user_document="123456789", value=30,
+                                                  transaction_date=datetime.today()))
+
+        assert await service.check_balance(account_data) == 70
+        history = await service.get_transactions_history(AccountHistoryRequest(user_document="123456789"))
+        assert len(history) == 2
+
+    run_with_db(test)
+
+
+def test_async_service_transfer(default_user, default_user_tmp):
+    async def test(db):
+        user_service = AsyncUserService(db)
+        await user_service.create_user(default_user)
+        await user_service.create_user(default_user_tmp)
+        service = AsyncAccountService(db)
+        await service.create_account(AccountData(user_document="123456789", balance=50))
+        await service.create_account(AccountData(user_document="987654321", balance=100))
+
+        await service.transfer(AccountTransaction(user_document="123456789", value=30,
+                                                  recipient_document="987654321",
+                                                  transaction_date=datetime.today()))
+
+        assert await service.check_balance(AccountData(user_document="123456789")) == 20
+        assert await service.check_balance(AccountData(user_document="987654321")) == 130
+
+    run_with_db(test)
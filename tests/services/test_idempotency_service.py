@@ -0,0 +1,100 @@
+import pytest
+from pymongo import MongoClient
+from datetime import datetime, timedelta
+from app.models.idempotency import IdempotencyKey
+from app.api.services.idempotency_service import *
+from app.schemas.account_schemas import *
+
+from utils.static_vars import MONGODB_PATH, IDEMPOTENCY_LOCK_SECONDS
+
+
+@pytest.fixture
+def db():
+    client = MongoClient(MONGODB_PATH)
+    db = client.test_bank
+    IdempotencyKey.set_database(db)
+    yield db
+
+    db.idempotency_keys.delete_many({})
+    IdempotencyKey.cache.clear()
+    client.close()
+
+
+@pytest.fixture
+def transaction() -> AccountTransaction:
+    return AccountTransaction(user_document="123456789", value=50,
+                              transaction_date=datetime(2024, 1, 15, 10, 30))
+
+
+def test_fingerprint_depends_on_request_body(transaction):
+    other = AccountTransaction(user_document="123456789", value=60, transaction_date=transaction.transaction_date)
+
+    assert request_fingerprint(transaction) == request_fingerprint(AccountTransaction(**transaction.__dict__))
+    assert request_fingerprint(transaction) != request_fingerprint(other)
+
+
+def test_record_id_rejects_oversized_keys():
+    with pytest.raises(ValueError):
+        record_id("deposit", "k" * 256)
+
+
+def test_first_request_claims_key(db, transaction):
+    service = IdempotencyService(db)
+
+    assert service.begin("deposit", "key-1", transaction) is None
+    assert db.idempotency_keys.find_one({"_id": "deposit:key-1"})["status"] is None
+
+
+def test_in_flight_key_conflicts(db, transaction):
+    service = IdempotencyService(db)
+    service.begin("deposit", "key-1", transaction)
+
+    with pytest.raises(IdempotencyConflict):
+        service.begin("deposit", "key-1", transaction)
+
+
+def test_completed_key_replays_from_store(db, transaction):
+    service = IdempotencyService(db)
+    service.begin("deposit", "key-1", transaction)
+    service.complete("deposit", "key-1", transaction, 200, {"balance": 100})
+    IdempotencyKey.cache.clear()
+
+    record = service.begin("deposit", "key-1", transaction)
+
+    assert (record["status"], record["response"]) == (200, {"balance": 100})
+
+
+def test_completed_key_replays_from_cache(db, transaction):
+    service = IdempotencyService(db)
+    service.begin("deposit", "key-1", transaction)
+    service.complete("deposit", "key-1", transaction, 200, {"balance": 100})
+    db.idempotency_keys.delete_many({})
+
+    assert service.begin("deposit", "key-1", transaction)["response"] == {"balance": 100}
+
+
+def test_reused_key_with_different_body_is_rejected(db, transaction):
+    service = IdempotencyService(db)
+    service.begin("deposit", "key-1", transaction)
+    service.complete("deposit", "key-1", transaction, 200, {"balance": 100})
+
+    with pytest.raises(ValueError):
+        service.begin("deposit", "key-1", AccountTransaction(user_document="123456789", value=1))
+
+
+def test_released_key_can_be_claimed_again(db, transaction):
+    service = IdempotencyService(db)
+    service.begin("deposit", "key-1", transaction)
+    service.release("deposit", "key-1")
+
+    assert service.begin("deposit", "key-1", transaction) is None
+
+
+def test_abandoned_claim_is_taken_over(db, transaction):
+    service = IdempotencyService(db)
+    service.begin("deposit", "key-1", transaction)
+    db.idempotency_keys.update_one({"_id": "deposit:key-1"}, {"$set": {
+        "created_at": datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS + 1)
+    }})
+
+    assert service.begin("deposit", "key-1", transaction) is None
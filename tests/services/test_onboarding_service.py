@@ -0,0 +1,94 @@
+import asyncio
+import io
+import json
+import pytest
+from pymongo import MongoClient
+from app.api.services.onboarding_service import OnboardingService, AsyncOnboardingService, parse_rows, validate_row
+from app.models.account import Account
+from app.models.onboarding import Onboarding
+from app.models.user import User
+
+from utils.static_vars import MONGODB_PATH
+from app.database.mongodb import *
+
+
+@pytest.fixture
+def db():
+    client = MongoClient(MONGODB_PATH)
+    db = client.test_bank
+    create_users_indexes(db)
+    create_accounts_indexes(db)
+    Onboarding.set_database(db)
+    Account.set_database(db)
+    yield db
+
+    db.users.delete_many({})
+    User.cache.clear()
+    db.accounts.delete_many({})
+    db.transactions_history.delete_many({})
+    Account.balance_cache.clear()
+    client.close()
+
+
+CSV_IMPORT = """firstname,lastname,document_id,phone,birthdate,email,balance
+John,Doe,000000001,111-111-111,1999-01-01,john@email.com,12.5
+Jane,Doe,000000002,222-222-222,1998-01-01,jane@email.com,
+Joe,Doe,000000003,111-111-111,1997-01-01,joe@email.com,3
+Jim,Doe,000000004,444-444-444,1996-01-01,jim@email.com,-1
+"""
+
+
+def test_parse_rows_ndjson():
+    lines = ['{"document_id": "1"}\n', "\n", "not json\n", "[1, 2]\n"]
+
+    assert list(parse_rows(lines, "ndjson")) == [(1, {"document_id": "1"}, None), (2, None, "invalid JSON"),
+                                                 (3, None, "expected a JSON object")]
+
+
+def test_parse_rows_csv_treats_empty_cells_as_missing():
+    rows = list(parse_rows(io.StringIO(CSV_IMPORT), "csv"))
+
+    assert len(rows) == 4
+    assert "balance" not in rows[1][1]
+    assert rows[0][1]["document_id"] == "000000001"
+
+
+def test_validate_row_converts_balance_to_minor_units():
+    fields, error = validate_row({"firstname": "John", "lastname": "Doe", "document_id": "1", "phone": "1",
+                                  "birthdate": "1999-01-01", "email": "john@email.com", "balance": "12.5"})
+    _, missing = validate_row({"firstname": "John"})
+
+    assert (fields["balance"], error) == (1250, None)
+    assert missing.startswith("lastname: Field required")
+
+
+def test_import_file_reports_rejected_rows(db):
+    service = OnboardingService(db)
+
+    summary = service.import_file(io.BytesIO(CSV_IMPORT.encode()), "csv")
+
+    assert (summary["imported"], summary["failed"]) == (2, 2)
+    assert [(error["row"], error["error"]) for error in summary["errors"]] == [
+        (3, "duplicate phone"), (4, "balance: Input should be greater than or equal to 0")]
+    assert Account.find_by_document_id("000000001").balance == 1250
+    assert db.users.count_documents({}) == 2
+
+
+def test_iter_import_batches_and_ends_with_totals(db):
+    lines = [json.dumps({"firstname": "John", "lastname": "Doe", "document_id": f"00000000{i}",
+                         "phone": f"phone-{i}", "birthdate": "1999-01-01", "email": f"{i}@email.com"}) + "\n"
+             for i in range(5)]
+
+    report = list(OnboardingService(db).iter_import(lines + lines[:1], "ndjson", batch_size=2))
+
+    assert report == [{"row": 6, "document_id": "000000000", "error": "duplicate document_id"},
+                      {"imported": 5, "failed": 1}]
+
+
+def test_async_import_file_reports_rejected_rows():
+    upload = io.BytesIO(b'{"firstname": "John"}\nnot json\n')
+
+    summary = asyncio.run(AsyncOnboardingService(None).import_file(upload, "ndjson"))
+
+    assert (summary["imported"], summary["failed"]) == (0, 2)
+    assert summary["errors"][1] == {"row": 2, "error": "invalid JSON"}
@@ -0,0 +1,54 @@
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pymongo import MongoClient
+from utils.AccountIdGenerator import AccountIdGenerator, ACCOUNT_ID_MAX_SEQUENCE
+
+from utils.static_vars import MONGODB_PATH, ACCOUNT_ID_BLOCK_SIZE
+
+
+@pytest.fixture
+def db():
+    client = MongoClient(MONGODB_PATH)
+    db = client.test_bank
+    AccountIdGenerator._leases.clear()
+    yield db
+
+    db.counters.delete_many({})
+    AccountIdGenerator._leases.clear()
+    client.close()
+
+
+def test_generate_uses_date_prefix(db):
+    account_id = AccountIdGenerator.generate(db)
+
+    assert account_id.startswith(datetime.now().strftime("%d%m%Y"))
+    assert len(account_id) == 14
+
+
+def test_generate_leases_one_block_per_block_size(db):
+    ids = [AccountIdGenerator.generate(db) for _ in range(ACCOUNT_ID_BLOCK_SIZE + 1)]
+    counter = db.counters.find_one({"_id": f"account_id:{datetime.now().strftime('%d%m%Y')}"})
+
+    assert len(set(ids)) == len(ids)
+    assert counter["next"] == 2 * ACCOUNT_ID_BLOCK_SIZE
+
+
+def test_generate_is_unique_across_threads_and_processes(db):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        ids = list(pool.map(lambda _: AccountIdGenerator.generate(db), range(1000)))
+    AccountIdGenerator._leases.clear()
+    ids += [AccountIdGenerator.generate(db) for _ in range(10)]
+
+    assert len(set(ids)) == len(ids)
+
+
+def test_generate_refuses_to_overflow_the_daily_sequence(db):
+    day = datetime.now().strftime("%d%m%Y")
+    db.counters.insert_one({"_id": f"account_id:{day}", "next": ACCOUNT_ID_MAX_SEQUENCE})
+
+    last_id = AccountIdGenerator.generate(db)
+
+    assert last_id == f"{day}{ACCOUNT_ID_MAX_SEQUENCE}"
+    with pytest.raises(Exception):
+        AccountIdGenerator.generate(db)
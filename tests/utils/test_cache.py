@@ -0,0 +1,70 @@
+import pytest
+from utils.cache import *
+
+
+@pytest.fixture
+def cache():
+    return TTLCache(maxsize=2, ttl=60)
+
+
+def test_get_or_load_reads_through_once(cache):
+    loads = []
+    loader = lambda: loads.append(1) or 50
+
+    assert cache.get_or_load("123456789", loader) == 50
+    assert cache.get_or_load("123456789", loader) == 50
+    assert len(loads) == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_invalidate_drops_entry(cache):
+    cache.set("123456789", 50)
+    cache.invalidate("123456789")
+
+    assert cache.get("123456789") is MISSING
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_stale_fill_after_invalidation_is_dropped(cache):
+    generation = cache.generation
+    cache.invalidate("123456789")
+    cache.set("123456789", 50, generation)
+
+    assert cache.get("123456789") is MISSING
+
+
+def test_lru_eviction(cache):
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_entry_is_a_miss():
+    cache = TTLCache(maxsize=2, ttl=0)
+    cache.set("a", 1)
+
+    assert cache.get("a") is MISSING
+
+
+def test_per_entry_ttl_and_negative_hits(cache):
+    cache.set("123456789", None, ttl=0)
+    cache.set("987654321", None)
+
+    assert cache.get("123456789") is MISSING
+    assert cache.get("987654321") is None
+    assert cache.stats()["negative_hits"] == 1
+
+
+def test_zero_maxsize_stores_nothing():
+    cache = TTLCache(0, 60)
+    cache.set("123456789", 50)
+
+    assert cache.get_or_load("123456789", lambda: 75) == 75
+    assert cache.get("123456789") is MISSING
+    assert cache.stats()["size"] == 0
@@ -0,0 +1,37 @@
+import pytest
+from utils.metrics import *
+
+
+@pytest.fixture
+def histogram():
+    return Histogram("test_duration_seconds", "Test latency.", ("route",), buckets=(0.1, 1.0))
+
+
+def test_histogram_counts_observations(histogram):
+    histogram.observe(("/deposit-account",), 0.05)
+    histogram.observe(("/deposit-account",), 0.5)
+
+    samples = histogram.samples(("/deposit-account",))
+
+    assert samples["count"] == 2
+    assert samples["sum"] == pytest.approx(0.55)
+
+
+def test_histogram_renders_cumulative_buckets(histogram):
+    histogram.observe(("/deposit-account",), 0.05)
+    histogram.observe(("/deposit-account",), 0.5)
+    histogram.observe(("/deposit-account",), 5)
+
+    lines = histogram.render().splitlines()
+
+    assert lines[:2] == ["# HELP test_duration_seconds Test latency.", "# TYPE test_duration_seconds histogram"]
+    assert 'test_duration_seconds_bucket{route="/deposit-account",le="0.1"} 1' in lines
+    assert 'test_duration_seconds_bucket{route="/deposit-account",le="1.0"} 2' in lines
+    assert 'test_duration_seconds_bucket{route="/deposit-account",le="+Inf"} 3' in lines
+    assert 'test_duration_seconds_count{route="/deposit-account"} 3' in lines
+
+
+def test_histogram_escapes_label_values(histogram):
+    histogram.observe(('a"b',), 0.05)
+
+    assert 'route="a\\"b"' in histogram.render()
@@ -0,0 +1,13 @@
+from bson import Int64
+from utils.money import *
+
+
+def test_to_minor_is_exact_for_cents():
+    assert to_minor(0.29) == 29
+    assert to_minor(20.5) == 2050
+    assert isinstance(to_minor(0.1), Int64)
+
+
+def test_to_major_round_trips():
+    assert to_major(to_minor(29.99)) == 29.99
+    assert to_major(None) is None
@@ -1,21 +1,96 @@
+import os
+import threading
 from datetime import datetime
 from random import randint
 
-class AccountIdGenerator:    
+from pymongo import ReturnDocument
+
+from utils.static_vars import ACCOUNT_ID_BLOCK_SIZE
+
+# The sequence is six digits; past it an ID would grow and could read as another day's
+ACCOUNT_ID_MAX_SEQUENCE = 999999
+
+class AccountIdGenerator:
+    # IDs are the current date followed by a per-day sequence. Each process
+    # leases blocks of the sequence from a counter document with a single $inc,
+    # so allocation needs no reads and two processes never hand out the same ID.
+    _lock = threading.Lock()
+    _leases = {}
+
     @staticmethod
     def generate(db) -> str:
+        day = datetime.now().strftime("%d%m%Y")
+        while True:
+            new_id = AccountIdGenerator._next_leased(db.name, day)
+            if new_id is not None:
+                return new_id
+
+            AccountIdGenerator._store_lease(db.name, day, AccountIdGenerator._lease_block(db, day))
+
+
+    @staticmethod
+    async def generate_async(db) -> str:
+        day = datetime.now().strftime("%d%m%Y")
+        while True:
+            new_id = AccountIdGenerator._next_leased(db.name, day)
+            if new_id is not None:
+                return new_id
+
+            counter = await db.counters.find_one_and_update({"_id": f"account_id:{day}"},
+                                                            {"$inc": {"next": ACCOUNT_ID_BLOCK_SIZE}},
+                                                            upsert=True,
+                                                            return_document=ReturnDocument.AFTER)
+            AccountIdGenerator._store_lease(db.name, day, counter["next"])
+
+
+    @staticmethod
+    def generate_random(db) -> str:
+        # Former generator: random suffix plus a database probe per attempt
         for i in range(5):
             current_time = datetime.now()
             new_id = f"{current_time.day:02d}{current_time.month:02d}{current_time.year}{randint(0, 999):03d}{randint(0, 999):03d}"
 
             if db.accounts.find_one({"account_id": new_id}) is None:
-                break
-            else:
-                new_id = None
+                return new_id
+
+        raise Exception("Failed to generate unique account id. Please try again.")
+
+
+    @staticmethod
+    def _lease_block(db, day: str) -> int:
+        counter = db.counters.find_one_and_update({"_id": f"account_id:{day}"},
+                                                  {"$inc": {"next": ACCOUNT_ID_BLOCK_SIZE}},
+                                                  upsert=True,
+                                                  return_document=ReturnDocument.AFTER)
+        return counter["next"]
+
+
+    @staticmethod
+    def _store_lease(database: str, day: str, block_end: int) -> None:
+        with AccountIdGenerator._lock:
+            lease = AccountIdGenerator._leases.get(database)
+            # Another thread may have refilled meanwhile; keep its block and
+            # drop ours, which only leaves a gap in the sequence.
+            if lease is None or lease[0] != day or lease[1] >= lease[2]:
+                AccountIdGenerator._leases[database] = [day, block_end - ACCOUNT_ID_BLOCK_SIZE, block_end]
+
+
+    @staticmethod
+    def _next_leased(database: str, day: str):
+        with AccountIdGenerator._lock:
+            lease = AccountIdGenerator._leases.get(database)
+            if lease is None or lease[0] != day or lease[1] >= lease[2]:
+                return None
+
+            sequence = lease[1]
+            lease[1] += 1
+
+        if sequence > ACCOUNT_ID_MAX_SEQUENCE:
+            raise Exception("No account ids are left for today. Please try again tomorrow.")
+
+        return f"{day}{sequence:06d}"
 
-        
-        if new_id is None:
-            raise Exception("Failed to generate unique account id. Please try again.")
 
-        return new_id
-            
+if hasattr(os, "register_at_fork"):
+    # A lease copied into a forked child would hand out the parent's IDs again
+    os.register_at_fork(after_in_child=AccountIdGenerator._leases.clear)
@@ -0,0 +1,11 @@
+import inspect
+
+from starlette.concurrency import run_in_threadpool
+
+
+async def call_service(method, *args, **kwargs):
+    """Await async service methods, run blocking ones in the threadpool."""
+    if inspect.iscoroutinefunction(method):
+        return await method(*args, **kwargs)
+
+    return await run_in_threadpool(method, *args, **kwargs)
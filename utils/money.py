@@ -0,0 +1,20 @@
+from bson.int64 import Int64
+
+# Balances and transaction values are stored as int64 counts of the minor unit
+# (cents), so $inc, $sum and bulk arithmetic stay exact. Conversion happens only
+# where amounts cross the API boundary.
+MINOR_UNITS = 100
+
+
+def to_minor(amount) -> Int64|None:
+    if amount is None:
+        return None
+
+    return Int64(round(amount * MINOR_UNITS))
+
+
+def to_major(minor) -> float|None:
+    if minor is None:
+        return None
+
+    return minor / MINOR_UNITS
@@ -1 +1,50 @@
-MONGODB_PATH = "mongodb://localhost:27017"
\ No newline at end of file
+import os
+
+MONGODB_PATH = os.environ.get("MONGODB_PATH", "mongodb://localhost:27017")
+MONGODB_DATABASE = os.environ.get("MONGODB_DATABASE", "bank")
+
+SERVER_HOST = os.environ.get("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.environ.get("SERVER_PORT", 8000))
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", os.cpu_count() or 1))
+# The balance, user and idempotency caches live in each process and only see
+# that process's invalidations; run.py turns them off when it starts several workers.
+PROCESS_CACHES = os.environ.get("PROCESS_CACHES", "true").lower() == "true"
+
+MONGODB_MAX_POOL_SIZE = int(os.environ.get("MONGODB_MAX_POOL_SIZE", 100))
+MONGODB_MIN_POOL_SIZE = int(os.environ.get("MONGODB_MIN_POOL_SIZE", 0))
+MONGODB_MAX_IDLE_TIME_MS = int(os.environ.get("MONGODB_MAX_IDLE_TIME_MS", 60000))
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGODB_WAIT_QUEUE_TIMEOUT_MS", 2000))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGODB_CONNECT_TIMEOUT_MS", 5000))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGODB_SERVER_SELECTION_TIMEOUT_MS", 5000))
+
+TRANSACTION_MAX_ATTEMPTS = int(os.environ.get("TRANSACTION_MAX_ATTEMPTS", 10))
+TRANSACTION_BACKOFF_MS = float(os.environ.get("TRANSACTION_BACKOFF_MS", 2))
+TRANSACTION_BACKOFF_MAX_MS = float(os.environ.get("TRANSACTION_BACKOFF_MAX_MS", 100))
+
+ATOMIC_BALANCE_UPDATES = os.environ.get("ATOMIC_BALANCE_UPDATES", "true").lower() == "true"
+LEDGER_BALANCES = os.environ.get("LEDGER_BALANCES", "false").lower() == "true"
+LEDGER_APPEND_RETRIES = int(os.environ.get("LEDGER_APPEND_RETRIES", 20))
+LEDGER_REBUILD_BATCH_SIZE = int(os.environ.get("LEDGER_REBUILD_BATCH_SIZE", 1000))
+LEDGER_REBUILD_WORKERS = int(os.environ.get("LEDGER_REBUILD_WORKERS", 4))
+HISTORY_BUCKET_SIZE = int(os.environ.get("HISTORY_BUCKET_SIZE", 500))
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get("HISTORY_MAX_PAGE_SIZE", 1000))
+HISTORY_EXPORT_BATCH_SIZE = int(os.environ.get("HISTORY_EXPORT_BATCH_SIZE", 1000))
+HISTORY_WRITE_BEHIND = os.environ.get("HISTORY_WRITE_BEHIND", "false").lower() == "true"
+HISTORY_WRITE_ACK = os.environ.get("HISTORY_WRITE_ACK", "flushed")
+HISTORY_FLUSH_INTERVAL_MS = float(os.environ.get("HISTORY_FLUSH_INTERVAL_MS", 5))
+HISTORY_FLUSH_MAX_ENTRIES = int(os.environ.get("HISTORY_FLUSH_MAX_ENTRIES", 500))
+HOT_ACCOUNT_MAX_SHARDS = int(os.environ.get("HOT_ACCOUNT_MAX_SHARDS", 64))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 10000))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 100000)) if PROCESS_CACHES else 0
+USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", 5))
+USER_CACHE_NEGATIVE_TTL_SECONDS = float(os.environ.get("USER_CACHE_NEGATIVE_TTL_SECONDS", 1))
+BALANCE_CACHE_SIZE = int(os.environ.get("BALANCE_CACHE_SIZE", 100000)) if PROCESS_CACHES else 0
+BALANCE_CACHE_TTL_SECONDS = float(os.environ.get("BALANCE_CACHE_TTL_SECONDS", 2))
+ACCOUNT_ID_BLOCK_SIZE = int(os.environ.get("ACCOUNT_ID_BLOCK_SIZE", 100))
+ENSURE_INDEXES_ON_STARTUP = os.environ.get("ENSURE_INDEXES_ON_STARTUP", "true").lower() == "true"
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 86400))
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get("IDEMPOTENCY_LOCK_SECONDS", 30))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", 10000)) if PROCESS_CACHES else 0
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", 1000))
+IMPORT_MAX_REPORTED_ERRORS = int(os.environ.get("IMPORT_MAX_REPORTED_ERRORS", 1000))
+IMPORT_SPOOL_MAX_BYTES = int(os.environ.get("IMPORT_SPOOL_MAX_BYTES", 8 * 1024 * 1024))